@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import collections
+import tempfile
+import resource
+import subprocess
+import threading
+import multiprocessing
+import SocketServer
+import SimpleHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import grimoireebook
+from PIL import Image
+from ebooklib import epub
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+DEFAULT_REGRESSION_TOLERANCE = 0.2
+
+MEMORY_REGRESSION_SLACK_KB = 1024
+
+def generateSyntheticGrimoire(themes, pages, cards, sheetSize, cardsPerSheet, seed=0):
+	randomGenerator = random.Random(seed)
+	gridSize = int(cardsPerSheet ** 0.5 + 0.999)
+	cardSize = sheetSize // gridSize
+	cardIndex = 0
+	themeCollection = []
+
+	for themeNumber in range(themes):
+		pageCollection = []
+		for pageNumber in range(pages):
+			cardCollection = []
+			for cardNumber in range(cards):
+				sheetNumber, slot = divmod(cardIndex, cardsPerSheet)
+				cardCollection.append({ "cardId" : cardIndex,
+										"cardName" : "card_%d.%d.%d" % (themeNumber, pageNumber, cardNumber),
+										"cardIntro" : " ".join(randomGenerator.choice(SYNTHETIC_WORDS) for word in range(randomGenerator.randint(5, 40))),
+										"cardDescription" : " ".join(randomGenerator.choice(SYNTHETIC_WORDS) for word in range(randomGenerator.randint(50, 400))),
+										"highResolution" : { "image" : { "sheetPath" : "images/syntheticSheet%04d.jpg" % sheetNumber,
+																		"rect" : { "x" : (slot % gridSize) * cardSize, "y" : (slot // gridSize) * cardSize, "width" : cardSize, "height" : cardSize },
+																		"sheetSize" : { "x" : 0, "y" : 0, "width" : sheetSize, "height" : sheetSize } } } })
+				cardIndex += 1
+			pageCollection.append({ "pageName" : "page_%d.%d" % (themeNumber, pageNumber), "cardCollection" : cardCollection })
+		themeCollection.append({ "themeName" : "theme_%d" % themeNumber, "pageCollection" : pageCollection })
+
+	return { "Response" : { "themeCollection" : themeCollection }, "ErrorCode" : 1, "ThrottleSeconds" : 0, "ErrorStatus" : "Success", "Message" : "Ok", "MessageData" : {} }
+
+SYNTHETIC_WORDS = ['guardian', 'traveler', 'darkness', 'light', 'hive', 'fallen', 'vex', 'cabal', 'ghost', 'city', 'wall', 'moon', 'venus', 'mars', 'reef', 'awoken', 'exo', 'warlock', 'titan', 'hunter', 'oryx', 'crota', 'rasputin', 'speaker', 'vanguard', 'the', 'of', 'and', 'a', 'in']
+
+def generateSyntheticSheets(grimoireJson, sheetsFolder, sheetSize):
+	sheetPaths = set(card["highResolution"]["image"]["sheetPath"] for theme in grimoireJson["Response"]["themeCollection"]
+																for page in theme["pageCollection"]
+																for card in page["cardCollection"])
+	for sheetPath in sorted(sheetPaths):
+		noise = Image.effect_noise((sheetSize, sheetSize), 64)
+		Image.merge('RGB', (noise, noise.rotate(90), noise.transpose(Image.FLIP_LEFT_RIGHT))).save(os.path.join(sheetsFolder, os.path.basename(sheetPath)), quality=90)
+	return len(sheetPaths)
+
+def createSheetRequestHandler(sheetsFolder, latency=0):
+	class SheetRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+		def do_GET(self):
+			time.sleep(latency)
+			SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+		def translate_path(self, path):
+			return os.path.join(sheetsFolder, os.path.basename(path.split('?')[0]))
+
+		def log_message(self, format, *args):
+			pass
+
+	return SheetRequestHandler
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 64
+
+def startSheetServer(sheetsFolder, latency=0):
+	server = ThreadingHTTPServer(('127.0.0.1', 0), createSheetRequestHandler(sheetsFolder, latency))
+	serverThread = threading.Thread(target=server.serve_forever)
+	serverThread.daemon = True
+	serverThread.start()
+	return server
+
+def pointDefinitionAtSheetServer(grimoireDefinition, server):
+	grimoireDefinition.sheets = collections.OrderedDict()
+	for cardData in grimoireebook.iterGrimoireCards(grimoireDefinition):
+		cardData.image.sourceImage = 'http://127.0.0.1:%d/%s' % (server.server_address[1], os.path.basename(cardData.image.sourceImage))
+		grimoireebook.addCardToSheetIndex(grimoireDefinition.sheets, cardData)
+	return grimoireDefinition
+
+def useBenchmarkFolders(workFolder):
+	grimoireebook.DEFAULT_CACHE_FOLDER = os.path.join(workFolder, 'cache')
+	grimoireebook.DEFAULT_IMAGE_FOLDER = os.path.join(workFolder, 'cache', 'images')
+	grimoireebook.DEFAULT_CROP_CACHE_FOLDER = os.path.join(workFolder, 'cache', 'crops')
+	grimoireebook.DEFAULT_BUILD_STATE_FILE = os.path.join(workFolder, 'cache', 'buildState.json')
+	grimoireebook.DEFAULT_BOOK_FILE = os.path.join(workFolder, 'destinyGrimoire.epub')
+
+def getPeakMemoryKB():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measureStageInChild(stage, resultConnection):
+	startPeakMemory = getPeakMemoryKB()
+	start = time.time()
+	items = stage()
+	resultConnection.send({ 'seconds' : time.time() - start, 'items' : items, 'peakMemoryKB' : getPeakMemoryKB() - startPeakMemory })
+	resultConnection.close()
+
+def measureStage(stage, repeat):
+	measurements = []
+	for attempt in range(repeat):
+		parentConnection, childConnection = multiprocessing.Pipe(False)
+		stageProcess = multiprocessing.Process(target=measureStageInChild, args=(stage, childConnection))
+		stageProcess.start()
+		measurement = parentConnection.recv()
+		stageProcess.join()
+		measurements.append(measurement)
+
+	fastest = min(measurements, key=lambda measurement: measurement['seconds'])
+	return dict(fastest, itemsPerSecond=fastest['items'] / max(fastest['seconds'], 1e-9), peakMemoryKB=max(measurement['peakMemoryKB'] for measurement in measurements))
+
+def runGrimoireCommand(arguments):
+	with open(os.devnull, 'wb') as devnull:
+		subprocess.call([sys.executable] + arguments, stdout=devnull, stderr=devnull)
+	return 1
+
+def runStartupBenchmarks(repeat):
+	results = collections.OrderedDict()
+	results['startInterpreter'] = measureStage(lambda: runGrimoireCommand(['-c', 'pass']), repeat)
+	results['importGrimoireebook'] = measureStage(lambda: runGrimoireCommand(['-c', 'import grimoireebook']), repeat)
+	results['showUsage'] = measureStage(lambda: runGrimoireCommand(['grimoireebook.py', '--help']), repeat)
+	results['rejectArguments'] = measureStage(lambda: runGrimoireCommand(['grimoireebook.py', '--unknown-option']), repeat)
+	return results
+
+def runBenchmarks(scale, repeat, workFolder):
+	useBenchmarkFolders(workFolder)
+	sheetsFolder = os.path.join(workFolder, 'sheets')
+	os.makedirs(sheetsFolder)
+
+	grimoireJson = generateSyntheticGrimoire(scale['themes'], scale['pages'], scale['cards'], scale['sheetSize'], scale['cardsPerSheet'])
+	rawGrimoireJson = json.dumps(grimoireJson)
+	generateSyntheticSheets(grimoireJson, sheetsFolder, scale['sheetSize'])
+	cardCount = scale['themes'] * scale['pages'] * scale['cards']
+
+	server = startSheetServer(sheetsFolder, scale['sheetLatency'] / 1000.0)
+	try:
+		grimoireDefinition = pointDefinitionAtSheetServer(grimoireebook.getDestinyGrimoireDefinitionFromJson(json.loads(rawGrimoireJson)), server)
+		sheetCount = len(grimoireebook.groupGrimoireCardsBySheet(grimoireDefinition))
+
+		def parseJson():
+			grimoireebook.getDestinyGrimoireDefinitionFromJson(json.loads(rawGrimoireJson))
+			return cardCount
+
+		def parseStream():
+			grimoireebook.getDestinyGrimoireDefinitionFromStream(rawGrimoireJson[start:start + grimoireebook.DOWNLOAD_CHUNK_SIZE] for start in range(0, len(rawGrimoireJson), grimoireebook.DOWNLOAD_CHUNK_SIZE))
+			return cardCount
+
+		def downloadSheets():
+			shutil.rmtree(grimoireebook.DEFAULT_IMAGE_FOLDER, ignore_errors=True)
+			grimoireebook.dowloadGrimoireImages(grimoireDefinition)
+			return sheetCount
+
+		def cropCards():
+			grimoireebook.generateGrimoireCardImages(grimoireDefinition, grimoireebook.DEFAULT_IMAGE_FOLDER, encodeProfile=scale['encodeProfile'])
+			return cardCount
+
+		def cropCardsFromSheetPack():
+			grimoireebook.generateGrimoireCardImages(grimoireDefinition, sheetPack, sheetManifest=sheetManifest, encodeProfile=scale['encodeProfile'])
+			return cardCount
+
+		def cropCardsFromWarmCache():
+			grimoireebook.generateGrimoireCardImages(grimoireDefinition, grimoireebook.DEFAULT_IMAGE_FOLDER, grimoireebook.DEFAULT_CROP_CACHE_FOLDER, encodeProfile=scale['encodeProfile'])
+			return cardCount
+
+		def createGrimoireEpub():
+			shutil.rmtree(grimoireebook.DEFAULT_CROP_CACHE_FOLDER, ignore_errors=True)
+			grimoireebook.createGrimoireEpub(grimoireDefinition, epub.EpubBook(), incremental=False, encodeProfile=scale['encodeProfile'])
+			return cardCount
+
+		def createOverlappedGrimoireEpub():
+			shutil.rmtree(grimoireebook.DEFAULT_CROP_CACHE_FOLDER, ignore_errors=True)
+			grimoireebook.createGrimoireEpub(grimoireDefinition, epub.EpubBook(), incremental=False, overlapStages=True, encodeProfile=scale['encodeProfile'])
+			return cardCount
+
+		def createStreamedGrimoireEpub():
+			shutil.rmtree(grimoireebook.DEFAULT_CROP_CACHE_FOLDER, ignore_errors=True)
+			grimoireebook.createGrimoireEpub(grimoireDefinition, epub.EpubBook(), incremental=False, streamBook=True, encodeProfile=scale['encodeProfile'])
+			return cardCount
+
+		results = runStartupBenchmarks(repeat)
+		results['parseJson'] = measureStage(parseJson, repeat)
+		results['parseStream'] = measureStage(parseStream, repeat)
+		results['downloadSheets'] = measureStage(downloadSheets, repeat)
+		results['cropCards'] = measureStage(cropCards, repeat)
+		sheetManifest = grimoireebook.loadSheetManifest(grimoireebook.DEFAULT_IMAGE_FOLDER)
+		sheetPack = grimoireebook.packGrimoireSheets(grimoireebook.DEFAULT_IMAGE_FOLDER, sheetManifest)
+		results['cropCardsFromSheetPack'] = measureStage(cropCardsFromSheetPack, repeat)
+		grimoireebook.generateGrimoireCardImages(grimoireDefinition, grimoireebook.DEFAULT_IMAGE_FOLDER, grimoireebook.DEFAULT_CROP_CACHE_FOLDER, encodeProfile=scale['encodeProfile'])
+		results['cropCardsFromWarmCache'] = measureStage(cropCardsFromWarmCache, repeat)
+		results['createGrimoireEpub'] = measureStage(createGrimoireEpub, repeat)
+		results['createOverlappedGrimoireEpub'] = measureStage(createOverlappedGrimoireEpub, repeat)
+		results['createStreamedGrimoireEpub'] = measureStage(createStreamedGrimoireEpub, repeat)
+	finally:
+		server.shutdown()
+		server.server_close()
+
+	return { 'scale' : scale, 'stages' : results }
+
+def compareWithBaseline(results, baseline, tolerance=DEFAULT_REGRESSION_TOLERANCE):
+	regressions = []
+	if baseline['scale'] != results['scale']:
+		logging.warning("Baseline was recorded at scale %s, current run uses %s" % (baseline['scale'], results['scale']))
+
+	for stageName, stageResult in results['stages'].items():
+		baselineResult = baseline['stages'].get(stageName)
+		if baselineResult is None:
+			continue
+		if stageResult['itemsPerSecond'] < baselineResult['itemsPerSecond'] * (1 - tolerance):
+			regressions.append("%s throughput dropped from %.1f to %.1f items/s" % (stageName, baselineResult['itemsPerSecond'], stageResult['itemsPerSecond']))
+		if stageResult['peakMemoryKB'] > baselineResult['peakMemoryKB'] * (1 + tolerance) + MEMORY_REGRESSION_SLACK_KB:
+			regressions.append("%s peak memory grew from %d to %d KB" % (stageName, baselineResult['peakMemoryKB'], stageResult['peakMemoryKB']))
+
+	return regressions
+
+def printResults(results):
+	print "%-28s %10s %8s %14s %14s" % ('stage', 'seconds', 'items', 'items/s', 'peak KB')
+	for stageName, stageResult in results['stages'].items():
+		print "%-28s %10.3f %8d %14.1f %14d" % (stageName, stageResult['seconds'], stageResult['items'], stageResult['itemsPerSecond'], stageResult['peakMemoryKB'])
+
+def parseCommandLineArguments(arguments):
+	parser = argparse.ArgumentParser(description='Benchmark the Grimoire ebook pipeline against a synthetic Grimoire.')
+	parser.add_argument('--themes', type=int, default=4)
+	parser.add_argument('--pages', type=int, default=5)
+	parser.add_argument('--cards', type=int, default=8, help='cards per page')
+	parser.add_argument('--sheet-size', dest='sheetSize', type=int, default=1024, help='sheet width and height in pixels')
+	parser.add_argument('--cards-per-sheet', dest='cardsPerSheet', type=int, default=16)
+	parser.add_argument('--sheet-latency', dest='sheetLatency', type=int, default=0, help='milliseconds the local sheet server waits before answering')
+	parser.add_argument('--encode-profile', dest='encodeProfile', choices=sorted(grimoireebook.CARD_IMAGE_ENCODE_PROFILES), default=grimoireebook.DEFAULT_ENCODE_PROFILE)
+	parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the fastest one is reported')
+	parser.add_argument('--save-baseline', dest='saveBaseline', nargs='?', const=DEFAULT_BASELINE_FILE, default=None,
+						help='write the results as the new baseline (default %s)' % DEFAULT_BASELINE_FILE)
+	parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE_FILE, default=None,
+						help='fail if a stage regressed against a baseline (default %s)' % DEFAULT_BASELINE_FILE)
+	parser.add_argument('--tolerance', type=float, default=DEFAULT_REGRESSION_TOLERANCE,
+						help='allowed relative slowdown or memory growth before failing (default %s)' % DEFAULT_REGRESSION_TOLERANCE)
+	return parser.parse_args(arguments)
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.WARNING)
+	arguments = parseCommandLineArguments(sys.argv[1:])
+	os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+	scale = { 'themes' : arguments.themes, 'pages' : arguments.pages, 'cards' : arguments.cards,
+				'sheetSize' : arguments.sheetSize, 'cardsPerSheet' : arguments.cardsPerSheet, 'encodeProfile' : arguments.encodeProfile, 'sheetLatency' : arguments.sheetLatency }
+	workFolder = tempfile.mkdtemp(prefix='grimoireBenchmark')
+	try:
+		results = runBenchmarks(scale, arguments.repeat, workFolder)
+	finally:
+		shutil.rmtree(workFolder, ignore_errors=True)
+
+	printResults(results)
+
+	if arguments.saveBaseline:
+		with open(arguments.saveBaseline, 'w') as baselineFile:
+			json.dump(results, baselineFile, indent=2)
+
+	if arguments.compare:
+		with open(arguments.compare) as baselineFile:
+			regressions = compareWithBaseline(results, json.load(baselineFile, object_pairs_hook=collections.OrderedDict), arguments.tolerance)
+		for regression in regressions:
+			print "REGRESSION: %s" % regression
+		sys.exit(1 if regressions else 0)
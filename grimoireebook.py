@@ -1,18 +1,50 @@
 #!/usr/bin/env python
-import requests
 import urlparse
-import jsonpath_rw
-import urllib
-import urllib2
 import os
 import collections
 import sys
 import logging
 import re
 import hashlib
-from PIL import Image
-from sets import Set
-from ebooklib import epub
+import json
+import io
+import imghdr
+import zipfile
+import time
+import threading
+import Queue
+import contextlib
+import argparse
+import multiprocessing
+import random
+import struct
+import mmap
+import shutil
+import tempfile
+import bisect
+import binascii
+import importlib
+from multiprocessing.pool import ThreadPool
+
+class LazyModule(object):
+	def __init__(self, moduleName):
+		self._moduleName = moduleName
+		self._module = None
+
+	def __getattr__(self, name):
+		if self._module is None:
+			self._module = importlib.import_module(self._moduleName)
+		return getattr(self._module, name)
+
+	def __repr__(self):
+		return '<lazy module %r>' % self._moduleName
+
+requests = LazyModule('requests')
+Image = LazyModule('PIL.Image')
+epub = LazyModule('ebooklib.epub')
+emailUtils = LazyModule('email.utils')
+cgi = LazyModule('cgi')
+sqlite3 = LazyModule('sqlite3')
 
 DEFAULT_PAGE_STYLE = '''
 	cardname {
@@ -37,85 +69,1908 @@ DEFAULT_PAGE_STYLE = '''
 	}
 '''
 
-DEFAULT_IMAGE_FOLDER = os.path.join(os.path.expanduser('~'), '.destinyLore/cache/images')
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.destinyLore/cache')
+
+DEFAULT_IMAGE_FOLDER = os.path.join(DEFAULT_CACHE_FOLDER, 'images')
+
+DEFAULT_CROP_CACHE_FOLDER = os.path.join(DEFAULT_CACHE_FOLDER, 'crops')
 
 DEFAULT_BOOK_FILE = os.path.join(os.path.expanduser('~'), '.destinyLore/destinyGrimoire.epub')
 
-def generateGrimoireEbook(apiKey):
-	createGrimoireEpub(loadDestinyGrimoireDefinition(apiKey))
+DEFAULT_BUILD_STATE_FILE = os.path.join(DEFAULT_CACHE_FOLDER, 'buildState.json')
+
+DEFAULT_DOWNLOAD_POOL_SIZE = 8
+
+DEFAULT_CROP_POOL_SIZE = 1
+
+DEFAULT_VOLUME_POOL_SIZE = multiprocessing.cpu_count()
+
+DEFAULT_PIPELINE_QUEUE_SIZE = 4
+
+PIPELINE_WAIT_INTERVAL = 1.0
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_REQUEST_RETRIES = 5
+
+REQUEST_BACKOFF_BASE = 0.5
+
+REQUEST_BACKOFF_CAP = 30.0
+
+MAX_REQUEST_CONCURRENCY = 64
+
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+BUNGIE_THROTTLE_ERROR_CODES = frozenset([36, 37, 38, 51, 52])
+
+BUNGIE_ERROR_RESPONSE_SIZE_LIMIT = 64 * 1024
+
+CARD_IMAGE_ENCODE_PROFILES = { 'fast' : { 'JPEG' : { 'quality' : 80 }, 'PNG' : { 'compress_level' : 1 } },
+								'balanced' : { 'JPEG' : { 'optimize' : True }, 'PNG' : { 'optimize' : True } },
+								'smallest' : { 'JPEG' : { 'quality' : 65, 'optimize' : True, 'progressive' : True }, 'PNG' : { 'optimize' : True } } }
+
+DEFAULT_ENCODE_PROFILE = 'balanced'
+
+CARD_IMAGE_FORMAT_EXTENSIONS = { 'JPEG' : '.jpg', 'PNG' : '.png' }
+
+SHEET_MANIFEST_FILE_NAME = 'manifest.json'
+
+SHEET_PACK_FILE_NAME = 'sheets.pack'
+
+SHEET_PACK_MAGIC = 'GRIMPACK'
+
+SHEET_PACK_FORMAT_VERSION = 1
+
+SHEET_PACK_TRAILER_FORMAT = '<Q'
+
+SHEET_PACK_SPOOL_SIZE = 16 * 1024 * 1024
+
+DEFAULT_BOOK_IDENTIFIER = 'destinyGrimoire'
+
+DEFAULT_BOOK_TITLE = 'Destiny Grimoire'
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+SNAPSHOT_INDEX_ENTRY_NAME = 'index.json'
+
+SNAPSHOT_DEFINITION_ENTRY_NAME = 'definition.json'
+
+SNAPSHOT_SHEETS_FOLDER_NAME = 'sheets'
+
+GRIMOIRE_DEFINITION_URL = 'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/'
+
+GRIMOIRE_DEFINITION_CACHE_FILE_NAME = 'grimoireDefinition.json'
+
+GRIMOIRE_DEFINITION_VALIDATORS_FILE_NAME = 'grimoireDefinition.validators.json'
+
+GRIMOIRE_CATALOG_FILE_NAME = 'grimoireCatalog.sqlite'
+
+GRIMOIRE_CATALOG_TIMEOUT = 30.0
+
+CATALOG_CARD_COLUMNS = 'hash, cardName, cardIntro, cardDescription, sourceImage, regionXStart, regionYStart, regionWidth, regionHeight'
+
+GRIMOIRE_CATALOG_SCHEMA = '''
+	CREATE TABLE IF NOT EXISTS definitions (locale TEXT PRIMARY KEY, version TEXT);
+	CREATE TABLE IF NOT EXISTS themes (id INTEGER PRIMARY KEY, locale TEXT NOT NULL, position INTEGER NOT NULL, themeName TEXT NOT NULL);
+	CREATE TABLE IF NOT EXISTS pages (id INTEGER PRIMARY KEY, themeId INTEGER NOT NULL REFERENCES themes (id), position INTEGER NOT NULL, pageName TEXT NOT NULL);
+	CREATE TABLE IF NOT EXISTS cards (id INTEGER PRIMARY KEY, pageId INTEGER NOT NULL REFERENCES pages (id), position INTEGER NOT NULL, locale TEXT NOT NULL,
+										hash TEXT NOT NULL, cardName TEXT NOT NULL, cardIntro TEXT, cardDescription TEXT,
+										sourceImage TEXT NOT NULL, regionXStart INTEGER, regionYStart INTEGER, regionWidth INTEGER, regionHeight INTEGER);
+	CREATE INDEX IF NOT EXISTS themesByLocale ON themes (locale, position);
+	CREATE INDEX IF NOT EXISTS themesByName ON themes (themeName);
+	CREATE INDEX IF NOT EXISTS pagesByTheme ON pages (themeId, position);
+	CREATE INDEX IF NOT EXISTS pagesByName ON pages (pageName);
+	CREATE INDEX IF NOT EXISTS cardsByPage ON cards (pageId, position);
+	CREATE INDEX IF NOT EXISTS cardsByHash ON cards (hash, locale);
+	CREATE INDEX IF NOT EXISTS cardsByName ON cards (cardName);
+	CREATE INDEX IF NOT EXISTS cardsBySheet ON cards (sourceImage);
+'''
+
+SEARCH_INDEX_FILE_NAME = 'searchIndex.bin'
+
+SEARCH_INDEX_MAGIC = 'GRIMSRCH'
 
-def loadDestinyGrimoireDefinition(apiKey):
-	return getDestinyGrimoireDefinitionFromJson(getDestinyGrimoireFromBungie(apiKey))
+SEARCH_INDEX_FORMAT_VERSION = 1
 
-def createGrimoireEpub(destinyGrimoireDefinition, book=epub.EpubBook()):
-	book.set_identifier('destinyGrimoire')
-	book.set_title('Destiny Grimoire')
-	book.set_language('en')
+SEARCH_INDEX_HEADER_FORMAT = '<8sIIII'
+
+SEARCH_INDEX_HASH_SIZE = 20
+
+SEARCH_TERM_MIN_LENGTH = 2
+
+KEYWORD_INDEX_MIN_TERM_LENGTH = 4
+
+KEYWORD_INDEX_MAX_CARDS = 10
+
+LORE_MARKUP_PATTERN = re.compile(r'<[^>]*>|&\w+;')
+
+LORE_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+SEARCH_QUERY_TERM_PATTERN = re.compile(r'(\w+)(\*?)', re.UNICODE)
+
+def generateGrimoireEbook(apiKey=None, streamDefinition=False, traceFile=None, locales=None, themesPerVolume=0, volumePoolSize=DEFAULT_VOLUME_POOL_SIZE, indexVolume=False, snapshotFile=None, exportSnapshotFile=None, useCatalog=False, writeSearchIndex=False, **buildOptions):
+	global activeTracer
+	if traceFile is not None:
+		activeTracer = GrimoireTracer()
+
+	try:
+		with traceSpan('generateGrimoireEbook'):
+			if exportSnapshotFile is not None:
+				exportGrimoireSnapshot(apiKey, exportSnapshotFile, locales, streamDefinition, buildOptions.get('downloadPoolSize', DEFAULT_DOWNLOAD_POOL_SIZE), buildOptions.get('revalidateCachedSheets', True))
+				return
+
+			snapshot = GrimoireSnapshot(snapshotFile) if snapshotFile is not None else None
+			if snapshot is not None and not locales and snapshot.getLocales() != [None]:
+				locales = snapshot.getLocales()
+			searchIndexes = collections.OrderedDict((locale, GrimoireSearchIndex()) for locale in (locales or [None])) if writeSearchIndex else None
+			if snapshot is not None:
+				definitionsByLocale = snapshot.loadDefinitions(locales, searchIndexes)
+				buildOptions.update(sheetStore=snapshot, sheetManifest=snapshot.getSheetManifest(), buildTime=snapshot.created)
+			elif locales or useCatalog or writeSearchIndex:
+				definitionsByLocale = loadDestinyGrimoireDefinitions(apiKey, locales or [None], streamDefinition, useCatalog, searchIndexes)
+			else:
+				definitionsByLocale = { None : loadDestinyGrimoireDefinition(apiKey, streamDefinition) }
+
+			if searchIndexes is not None:
+				with traceSpan('writeSearchIndex'):
+					for locale, searchIndex in searchIndexes.items():
+						searchIndex.save(getSearchIndexFile(locale))
+
+			if locales or themesPerVolume > 0:
+				createGrimoireEditions(definitionsByLocale, themesPerVolume, volumePoolSize, indexVolume, **buildOptions)
+			else:
+				createGrimoireEpub(definitionsByLocale[None], **buildOptions)
+	finally:
+		if traceFile is not None:
+			activeTracer.save(traceFile)
+			activeTracer = None
+
+def loadDestinyGrimoireDefinition(apiKey, streamDefinition=False, locale=None, useCatalog=False, searchIndex=None):
+	if useCatalog:
+		with traceSpan('loadCatalogedDefinition', locale=locale):
+			return loadCatalogedGrimoireDefinition(apiKey, locale, searchIndex)
+
+	if streamDefinition:
+		with traceSpan('fetchAndParseDefinition', locale=locale):
+			return getDestinyGrimoireDefinitionFromStream(streamDestinyGrimoireFromBungie(apiKey, locale), searchIndex)
+
+	with traceSpan('fetchDefinition', locale=locale):
+		grimoireJson = getDestinyGrimoireFromBungie(apiKey, locale)
+	with traceSpan('parseDefinition', locale=locale):
+		return getDestinyGrimoireDefinitionFromJson(grimoireJson, searchIndex)
+
+def loadDestinyGrimoireDefinitions(apiKey, locales, streamDefinition=False, useCatalog=False, searchIndexes=None):
+	localePool = ThreadPool(len(locales))
+	try:
+		return collections.OrderedDict(zip(locales, localePool.map(lambda locale: loadDestinyGrimoireDefinition(apiKey, streamDefinition, locale, useCatalog, (searchIndexes or {}).get(locale)), locales)))
+	finally:
+		localePool.close()
+		localePool.join()
+
+def setGrimoireBookMetadata(book, bookIdentifier=DEFAULT_BOOK_IDENTIFIER, bookTitle=DEFAULT_BOOK_TITLE, language='en'):
+	book.set_identifier(bookIdentifier)
+	book.set_title(bookTitle)
+	book.set_language(language)
 	book.add_author('Bungie')
 	book.set_cover("cover.jpg", open('resources/cover.jpg', 'rb').read())
 
-	book.add_item(epub.EpubItem(uid="style_default", file_name="style/default.css", media_type="text/css", content=DEFAULT_PAGE_STYLE))
+def createGrimoireEpub(destinyGrimoireDefinition, book=None, downloadPoolSize=DEFAULT_DOWNLOAD_POOL_SIZE, revalidateCachedSheets=True, useCropCache=True, cropPoolSize=DEFAULT_CROP_POOL_SIZE, incremental=True, streamBook=False, encodeProfile=DEFAULT_ENCODE_PROFILE, overlapStages=False,
+						bookFile=None, buildStateFile=None, bookIdentifier=DEFAULT_BOOK_IDENTIFIER, bookTitle=DEFAULT_BOOK_TITLE, language='en', sheetManifest=None, sheetStore=None, buildTime=None, packSheets=False, keywordIndex=False):
+	book = book or epub.EpubBook()
+	bookFile = bookFile or DEFAULT_BOOK_FILE
+	buildStateFile = buildStateFile or DEFAULT_BUILD_STATE_FILE
+	setGrimoireBookMetadata(book, bookIdentifier, bookTitle, language)
+
+	bookAssets = createBookAssets()
+	book.add_item(bookAssets.style)
+
+	cropCacheFolder = DEFAULT_CROP_CACHE_FOLDER if useCropCache else None
+	cardPipeline = None
+	reusableCardImages = None
+	if overlapStages and sheetManifest is None:
+		cardPipeline = GrimoireCardPipeline(destinyGrimoireDefinition, DEFAULT_IMAGE_FOLDER, cropCacheFolder, downloadPoolSize, cropPoolSize, revalidateCachedSheets,
+											loadBuildState(buildStateFile) if incremental else None, bookFile, encodeProfile)
+		cardPipeline.start()
+		cardImages = cardPipeline.cardImages
+	else:
+		if sheetManifest is None:
+			with traceSpan('downloadSheets'):
+				sheetManifest = dowloadGrimoireImages(destinyGrimoireDefinition, downloadPoolSize, revalidateCachedSheets, packSheets)
+			if packSheets and sheetStore is None:
+				sheetStore = PackedSheetStore(os.path.join(DEFAULT_IMAGE_FOLDER, SHEET_PACK_FILE_NAME))
+		if packSheets and sheetStore is None:
+			with traceSpan('packSheets'):
+				sheetStore = packGrimoireSheets(DEFAULT_IMAGE_FOLDER, sheetManifest)
+		with traceSpan('loadReusableCardImages'):
+			reusableCardImages = loadReusableCardImages(destinyGrimoireDefinition, loadBuildState(buildStateFile), bookFile, sheetManifest, encodeProfile) if incremental else None
+
+	sheetStore = sheetStore or DEFAULT_IMAGE_FOLDER
+	bookWriter = StreamingEpubWriter(bookFile, book, buildTime=buildTime) if streamBook else None
+	if bookWriter is not None:
+		bookWriter.open()
+	try:
+		if cardPipeline is None:
+			with traceSpan('cropCards'):
+				if bookWriter is not None:
+					cardImages = streamGrimoireCardImages(bookWriter, iterGrimoireCardImages(destinyGrimoireDefinition, sheetStore, cropCacheFolder, cropPoolSize, sheetManifest, reusableCardImages, encodeProfile))
+				else:
+					cardImages = generateGrimoireCardImages(destinyGrimoireDefinition, sheetStore, cropCacheFolder, cropPoolSize, sheetManifest, reusableCardImages, encodeProfile)
+		with traceSpan('assembleBook'):
+			book.toc = addThemeSetsToEbook(bookWriter or book, destinyGrimoireDefinition, cardImages, bookAssets, language)
+			if keywordIndex:
+				book.toc += addKeywordIndexToEbook(bookWriter or book, destinyGrimoireDefinition, bookAssets, language)
+
+			book.add_item(epub.EpubNcx())
+			book.add_item(epub.EpubNav())
+		if cardPipeline is not None:
+			with traceSpan('finishCardPipeline'):
+				sheetManifest = cardPipeline.join()
+
+		with traceSpan('writeEpub'):
+			if bookWriter is not None:
+				bookWriter.close()
+			else:
+				writeGrimoireEpub(bookFile, book, buildTime)
+	except:
+		if cardPipeline is not None:
+			cardPipeline.stop()
+		if bookWriter is not None:
+			bookWriter.abort()
+		raise
+	finally:
+		if reusableCardImages is not None:
+			reusableCardImages.close()
+	saveBuildState(buildStateFile, createGrimoireBuildState(destinyGrimoireDefinition, sheetManifest, cardImages, encodeProfile))
 
-	dowloadGrimoireImages(destinyGrimoireDefinition)
-	book.toc = addThemeSetsToEbook(book, destinyGrimoireDefinition)
+def writeGrimoireEpub(bookFile, book, buildTime=None):
+	if buildTime is None:
+		epub.write_epub(bookFile, book)
+		return
 
+	bookWriter = StreamingEpubWriter(bookFile, book, buildTime=buildTime)
+	bookWriter.open()
+	try:
+		bookWriter.close()
+	except:
+		bookWriter.abort()
+		raise
+
+GrimoireVolume = collections.namedtuple('GrimoireVolume', ['identifier', 'title', 'language', 'bookFile', 'buildStateFile', 'definition'])
+
+def getGrimoireVolumeFile(baseFile, volumeName):
+	fileName, extension = os.path.splitext(baseFile)
+	return '%s.%s%s' % (fileName, volumeName, extension)
+
+def getGrimoireEditionFile(baseFile, locale=None):
+	return getGrimoireVolumeFile(baseFile, locale) if locale else baseFile
+
+def getGrimoireEditionIdentifier(locale=None):
+	return '%s.%s' % (DEFAULT_BOOK_IDENTIFIER, locale) if locale else DEFAULT_BOOK_IDENTIFIER
+
+def splitGrimoireIntoVolumes(destinyGrimoireDefinition, themesPerVolume=1, locale=None):
+	identifier = getGrimoireEditionIdentifier(locale)
+	title = '%s (%s)' % (DEFAULT_BOOK_TITLE, locale) if locale else DEFAULT_BOOK_TITLE
+	bookFile = getGrimoireEditionFile(DEFAULT_BOOK_FILE, locale)
+	buildStateFile = getGrimoireEditionFile(DEFAULT_BUILD_STATE_FILE, locale)
+	if themesPerVolume <= 0:
+		return [GrimoireVolume(identifier, title, locale or 'en', bookFile, buildStateFile, destinyGrimoireDefinition)]
+
+	volumes = []
+	for themeIndex in range(0, len(destinyGrimoireDefinition.themes), themesPerVolume):
+		volumeThemes = destinyGrimoireDefinition.themes[themeIndex:themeIndex + themesPerVolume]
+		volumeName = 'volume%02d' % (len(volumes) + 1)
+		volumes.append(GrimoireVolume(identifier='%s.%s' % (identifier, volumeName),
+									title='%s %d: %s' % (title, len(volumes) + 1, ', '.join(themeData.themeName for themeData in volumeThemes)),
+									language=locale or 'en',
+									bookFile=getGrimoireVolumeFile(bookFile, volumeName),
+									buildStateFile=getGrimoireVolumeFile(buildStateFile, volumeName),
+									definition=GrimoireDefinition(volumeThemes)))
+	return volumes
+
+def buildGrimoireVolume(volumeTask):
+	volume, sheetManifest, buildOptions = volumeTask
+	with traceSpan('buildVolume', 'volume', volume=volume.title):
+		createGrimoireEpub(volume.definition, epub.EpubBook(), bookFile=volume.bookFile, buildStateFile=volume.buildStateFile,
+						bookIdentifier=volume.identifier, bookTitle=volume.title, language=volume.language, sheetManifest=sheetManifest, **buildOptions)
+
+def buildGrimoireVolumePoolTask(volumeTask):
+	buildGrimoireVolume(volumeTask)
+	return activeTracer.drainEvents() if activeTracer is not None else []
+
+def warmCardImageCache(destinyGrimoireDefinition, sheetManifest, cropPoolSize=DEFAULT_CROP_POOL_SIZE, encodeProfile=DEFAULT_ENCODE_PROFILE, sheetStore=None):
+	for cardImage in iterGrimoireCardImages(destinyGrimoireDefinition, sheetStore or DEFAULT_IMAGE_FOLDER, DEFAULT_CROP_CACHE_FOLDER, cropPoolSize, sheetManifest, None, encodeProfile):
+		pass
+
+def createGrimoireEditions(definitionsByLocale, themesPerVolume=0, volumePoolSize=DEFAULT_VOLUME_POOL_SIZE, indexVolume=False, downloadPoolSize=DEFAULT_DOWNLOAD_POOL_SIZE, revalidateCachedSheets=True, sheetManifest=None, **buildOptions):
+	volumesByLocale = collections.OrderedDict((locale, splitGrimoireIntoVolumes(destinyGrimoireDefinition, themesPerVolume, locale)) for locale, destinyGrimoireDefinition in definitionsByLocale.items())
+	volumes = [volume for localeVolumes in volumesByLocale.values() for volume in localeVolumes]
+	packSheets = buildOptions.pop('packSheets', False)
+	if sheetManifest is None:
+		with traceSpan('downloadSheets'):
+			sheetManifest = dowloadGrimoireImages(mergeGrimoireDefinitions(definitionsByLocale.values()),
+												downloadPoolSize, revalidateCachedSheets, packSheets)
+		if packSheets and buildOptions.get('sheetStore') is None:
+			buildOptions['sheetStore'] = PackedSheetStore(os.path.join(DEFAULT_IMAGE_FOLDER, SHEET_PACK_FILE_NAME))
+	if packSheets and buildOptions.get('sheetStore') is None:
+		with traceSpan('packSheets'):
+			buildOptions['sheetStore'] = packGrimoireSheets(DEFAULT_IMAGE_FOLDER, sheetManifest)
+
+	if len(definitionsByLocale) > 1 and buildOptions.get('useCropCache', True):
+		with traceSpan('cropSharedCards'):
+			warmCardImageCache(definitionsByLocale.values()[0], sheetManifest, buildOptions.get('cropPoolSize', DEFAULT_CROP_POOL_SIZE), buildOptions.get('encodeProfile', DEFAULT_ENCODE_PROFILE), buildOptions.get('sheetStore'))
+
+	if volumePoolSize > 1 and len(volumes) > 1:
+		buildOptions = dict(buildOptions, cropPoolSize=1)
+		volumePool = multiprocessing.Pool(min(volumePoolSize, len(volumes)), initializer=clearTraceEvents)
+		try:
+			for traceEvents in volumePool.imap_unordered(buildGrimoireVolumePoolTask, [(volume, sheetManifest, buildOptions) for volume in volumes]):
+				if activeTracer is not None:
+					activeTracer.addEvents(traceEvents)
+		finally:
+			volumePool.close()
+			volumePool.join()
+	else:
+		for volume in volumes:
+			buildGrimoireVolume((volume, sheetManifest, buildOptions))
+
+	if indexVolume:
+		with traceSpan('writeIndexVolume'):
+			for locale, localeVolumes in volumesByLocale.items():
+				createGrimoireIndexVolume(localeVolumes, locale, buildTime=buildOptions.get('buildTime'))
+	return volumes
+
+def createGrimoireVolumes(destinyGrimoireDefinition, themesPerVolume=1, volumePoolSize=DEFAULT_VOLUME_POOL_SIZE, indexVolume=False, **buildOptions):
+	return createGrimoireEditions({ None : destinyGrimoireDefinition }, themesPerVolume, volumePoolSize, indexVolume, **buildOptions)
+
+def generateGrimoireIndexContent(volumes):
+	volumeEntries = []
+	for volume in volumes:
+		themeEntries = u''.join(u'<li>%s<ul>%s</ul></li>' % (cgi.escape(themeData.themeName), u''.join(u'<li>%s</li>' % cgi.escape(pageData.pageName) for pageData in themeData.pages))
+								for themeData in volume.definition.themes)
+		volumeEntries.append(u'<h2><a href="%s">%s</a></h2><ul>%s</ul>' % (cgi.escape(os.path.basename(volume.bookFile), True), cgi.escape(volume.title), themeEntries))
+	return u''.join(volumeEntries)
+
+def createGrimoireIndexVolume(volumes, locale=None, book=None, buildTime=None):
+	book = book or epub.EpubBook()
+	setGrimoireBookMetadata(book, '%s.index' % getGrimoireEditionIdentifier(locale), '%s: Volumes' % DEFAULT_BOOK_TITLE, locale or 'en')
+
+	indexPage = epub.EpubHtml(title='Volumes', file_name='volumes.xhtml', lang=locale or 'en', content=generateGrimoireIndexContent(volumes))
+	book.add_item(indexPage)
+	book.spine.append(indexPage)
+	book.toc = (indexPage,)
 	book.add_item(epub.EpubNcx())
 	book.add_item(epub.EpubNav())
 
-	epub.write_epub(DEFAULT_BOOK_FILE, book)
+	writeGrimoireEpub(getGrimoireVolumeFile(getGrimoireEditionFile(DEFAULT_BOOK_FILE, locale), 'index'), book, buildTime)
+	return book
+
+def getGrimoireDefinitionCachePaths(locale=None):
+	return (os.path.join(DEFAULT_CACHE_FOLDER, getGrimoireEditionFile(GRIMOIRE_DEFINITION_CACHE_FILE_NAME, locale)),
+			os.path.join(DEFAULT_CACHE_FOLDER, getGrimoireEditionFile(GRIMOIRE_DEFINITION_VALIDATORS_FILE_NAME, locale)))
 
-def getDestinyGrimoireFromBungie(apiKey):
+def requestDestinyGrimoireFromBungie(apiKey, stream=False, locale=None):
 	logging.debug('Dowloading Destiny Grimoire from Bungie')
 	if apiKey is None or not apiKey:
 			raise DestinyContentAPIClientError(DestinyContentAPIClientError.NO_API_KEY_PROVIDED_ERROR_MSG)
-	return requests.get('http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/', headers={'X-API-Key': apiKey}).json()
 
-def getDestinyGrimoireDefinitionFromJson(grimoireJson):
-	logging.debug('Extracting grimoire definitions from raw JSON: %s' % grimoireJson)
-	grimoireDefinition = { "themes" : []}
+	cachedDefinitionPath, validatorsPath = getGrimoireDefinitionCachePaths(locale)
+
+	headers = {'X-API-Key': apiKey}
+	if os.path.exists(cachedDefinitionPath):
+		headers.update(getConditionalRequestHeaders(loadCachedValidators(validatorsPath)))
+
+	session = createBungieSession(1)
+	try:
+		return (session, session.get(GRIMOIRE_DEFINITION_URL, params={'lc': locale} if locale else None, headers=headers, stream=stream), cachedDefinitionPath, validatorsPath)
+	except:
+		session.close()
+		raise
+
+def getDestinyGrimoireFromBungie(apiKey, locale=None):
+	session, response, cachedDefinitionPath, validatorsPath = requestDestinyGrimoireFromBungie(apiKey, locale=locale)
+	with contextlib.closing(session):
+		if response.status_code == 304:
+			logging.debug('Destiny Grimoire not modified, using cached copy')
+			with open(cachedDefinitionPath, 'rb') as cachedDefinitionFile:
+				return json.load(cachedDefinitionFile)
+
+		if response.status_code == 200:
+			cacheGrimoireDefinitionResponse(response, cachedDefinitionPath, validatorsPath)
+		return response.json()
+
+def streamDestinyGrimoireFromBungie(apiKey, locale=None):
+	session, response, cachedDefinitionPath, validatorsPath = requestDestinyGrimoireFromBungie(apiKey, stream=True, locale=locale)
+	if response.status_code == 304:
+		logging.debug('Destiny Grimoire not modified, using cached copy')
+		response.close()
+		session.close()
+		return iterFileChunks(cachedDefinitionPath)
+	return iterGrimoireResponseChunks(session, response, cachedDefinitionPath, validatorsPath)
+
+def iterFileChunks(filePath):
+	with open(filePath, 'rb') as chunkedFile:
+		for chunk in iter(lambda: chunkedFile.read(DOWNLOAD_CHUNK_SIZE), b''):
+			yield chunk
+
+def iterGrimoireResponseChunks(session, response, cachedDefinitionPath, validatorsPath):
+	try:
+		if response.status_code != 200:
+			for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+				yield chunk
+			return
+
+		if not os.path.exists(os.path.dirname(cachedDefinitionPath)):
+			os.makedirs(os.path.dirname(cachedDefinitionPath))
+		with open(cachedDefinitionPath + '.part', 'wb') as cachedDefinitionFile:
+			for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+				cachedDefinitionFile.write(chunk)
+				yield chunk
+		os.rename(cachedDefinitionPath + '.part', cachedDefinitionPath)
+		saveCachedValidators(validatorsPath, response)
+	finally:
+		response.close()
+		session.close()
+
+def loadCachedValidators(validatorsPath):
+	try:
+		with open(validatorsPath) as validatorsFile:
+			return json.load(validatorsFile)
+	except (IOError, ValueError):
+		return None
+
+def saveCachedValidators(validatorsPath, response):
+	with open(validatorsPath, 'w') as validatorsFile:
+		json.dump({ 'etag' : response.headers.get('ETag'), 'lastModified' : response.headers.get('Last-Modified') }, validatorsFile)
+
+def cacheGrimoireDefinitionResponse(response, cachedDefinitionPath, validatorsPath):
+	if not os.path.exists(os.path.dirname(cachedDefinitionPath)):
+		os.makedirs(os.path.dirname(cachedDefinitionPath))
+
+	with open(cachedDefinitionPath + '.part', 'wb') as cachedDefinitionFile:
+		cachedDefinitionFile.write(response.content)
+	os.rename(cachedDefinitionPath + '.part', cachedDefinitionPath)
+
+	saveCachedValidators(validatorsPath, response)
+
+class GrimoireRecord(object):
+	__slots__ = ()
+
+	@property
+	def fields(self):
+		return self.__slots__
+
+	def __getitem__(self, key):
+		if key not in self.fields:
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __setitem__(self, key, value):
+		if key not in self.fields:
+			raise KeyError(key)
+		setattr(self, key, value)
+
+	def __contains__(self, key):
+		return key in self.fields
+
+	def __iter__(self):
+		return iter(self.fields)
+
+	def __len__(self):
+		return len(self.fields)
+
+	def get(self, key, default=None):
+		return getattr(self, key) if key in self.fields else default
+
+	def keys(self):
+		return list(self.fields)
+
+	def items(self):
+		return [(field, getattr(self, field)) for field in self.fields]
+
+	def replace(self, **fields):
+		values = dict(self.items())
+		values.update(fields)
+		return type(self)(**values)
+
+	def toDict(self):
+		return dict((field, recordToDict(value)) for field, value in self.items())
+
+	def __eq__(self, other):
+		return type(other) is type(self) and all(getattr(self, field) == getattr(other, field) for field in self.fields)
+
+	def __ne__(self, other):
+		return not self == other
+
+	__hash__ = None
+
+	def __reduce__(self):
+		return (type(self), tuple(getattr(self, field) for field in self.fields))
+
+	def __repr__(self):
+		return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % item for item in self.items()))
+
+def recordToDict(value):
+	if isinstance(value, GrimoireRecord):
+		return value.toDict()
+	if isinstance(value, list):
+		return [recordToDict(item) for item in value]
+	return value
+
+class ImageRegion(GrimoireRecord):
+	__slots__ = ('sourceImage', 'regionXStart', 'regionYStart', 'regionWidth', 'regionHeight')
+
+	def __init__(self, sourceImage, regionXStart=0, regionYStart=0, regionWidth=0, regionHeight=0):
+		self.sourceImage = sourceImage
+		self.regionXStart = regionXStart
+		self.regionYStart = regionYStart
+		self.regionWidth = regionWidth
+		self.regionHeight = regionHeight
+
+class Card(GrimoireRecord):
+	__slots__ = ('cardName', 'cardIntro', 'cardDescription', 'hash', 'image')
+
+	def __init__(self, cardName, cardIntro=u"", cardDescription=u"", hash=None, image=None):
+		self.cardName = cardName
+		self.cardIntro = cardIntro
+		self.cardDescription = cardDescription
+		self.hash = hash
+		self.image = image
+
+class Page(GrimoireRecord):
+	__slots__ = ('pageName', 'cards')
+
+	def __init__(self, pageName, cards=None):
+		self.pageName = pageName
+		self.cards = [] if cards is None else cards
+
+class Theme(GrimoireRecord):
+	__slots__ = ('themeName', 'pages')
+
+	def __init__(self, themeName, pages=None):
+		self.themeName = themeName
+		self.pages = [] if pages is None else pages
+
+class GrimoireDefinition(GrimoireRecord):
+	__slots__ = ('themes', 'sheets')
+	fields = ('themes',)
+
+	def __init__(self, themes=None, sheets=None):
+		self.themes = [] if themes is None else themes
+		self.sheets = sheets
+
+def addCardToSheetIndex(sheetIndex, cardData):
+	sheetIndex.setdefault(cardData.image.sourceImage, []).append(cardData)
+
+def createGrimoireCardDefinition(themeName, pageName, card, sheetURLs=None):
+	sheetImage = card["highResolution"]["image"]
+	sourceImage = "http://www.bungie.net/" + sheetImage["sheetPath"]
+	if sheetURLs is not None:
+		sourceImage = sheetURLs.setdefault(sourceImage, sourceImage)
+	rect = sheetImage["rect"]
+
+	return Card(card["cardName"],
+				card.get("cardIntro", u""),
+				card.get("cardDescription", u""),
+				hashlib.sha1((u'%s.%s.%s' % (themeName, pageName, card["cardName"])).encode('utf8')).hexdigest(),
+				ImageRegion(sourceImage, int(rect["x"]), int(rect["y"]), int(rect["width"]), int(rect["height"])))
+
+def getDestinyGrimoireDefinitionFromJson(grimoireJson, searchIndex=None):
+	logging.debug('Extracting grimoire definitions from raw JSON: %s', grimoireJson)
+	grimoireDefinition = GrimoireDefinition(sheets=collections.OrderedDict())
+	sheetURLs = {}
 
 	for theme in grimoireJson["Response"]["themeCollection"]:
-		themeToAdd = { "themeName" : theme["themeName"] , "pages" : [] }
+		themeToAdd = Theme(theme["themeName"])
 		for page in theme["pageCollection"]:
-			pageToAdd = { "pageName" : page["pageName"], "cards" : [] }
+			pageToAdd = Page(page["pageName"])
 			for card in page["cardCollection"]:
-				logging.debug('Processing grimoire card data: %s' % card)
-				pageToAdd["cards"].append(
-					{ "cardName" : card["cardName"], 
-					"cardIntro" : card.get("cardIntro", u""),
-					"cardDescription" : card.get("cardDescription", u""),
-					"hash": hashlib.sha1('%s.%s.%s' % (theme["themeName"], page["pageName"], card["cardName"])).hexdigest(),
-					"image": { "sourceImage" : "http://www.bungie.net/" + card["highResolution"]["image"]["sheetPath"],
-								"regionXStart" : card["highResolution"]["image"]["rect"]["x"],
-								"regionYStart" : card["highResolution"]["image"]["rect"]["y"],
-								"regionHeight" : card["highResolution"]["image"]["rect"]["height"],
-								"regionWidth" : card["highResolution"]["image"]["rect"]["width"]}})
-			themeToAdd["pages"].append(pageToAdd)
-		grimoireDefinition["themes"].append(themeToAdd)
+				logging.debug('Processing grimoire card data: %s', card)
+				pageToAdd.cards.append(createGrimoireCardDefinition(themeToAdd.themeName, pageToAdd.pageName, card, sheetURLs))
+				addCardToSheetIndex(grimoireDefinition.sheets, pageToAdd.cards[-1])
+				if searchIndex is not None:
+					searchIndex.addCard(themeToAdd.themeName, pageToAdd.pageName, pageToAdd.cards[-1])
+			themeToAdd.pages.append(pageToAdd)
+		grimoireDefinition.themes.append(themeToAdd)
 		
 	return grimoireDefinition
 
-def dowloadGrimoireImages(grimoireDefinition):
-	logging.info('Dowloading Grimoire images')
-	jsonpath_expr = jsonpath_rw.parse('themes[*].pages[*].cards[*].image.sourceImage')
+class JsonStreamReader(object):
+	STRUCTURE_PATTERN = re.compile(r'[{}\[\]:,"]')
+	OBJECT_PATTERN = re.compile(r'[{}"]')
+	STRING_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.buffer = ''
+		self.position = 0
+		self.anchor = None
+
+	def fill(self):
+		chunk = next(self.chunks, None)
+		if chunk is None:
+			return False
+		keepFrom = self.position if self.anchor is None else self.anchor
+		self.buffer = self.buffer[keepFrom:] + chunk
+		self.position -= keepFrom
+		if self.anchor is not None:
+			self.anchor -= keepFrom
+		return True
+
+	def readString(self):
+		stringMatch = self.STRING_PATTERN.match(self.buffer, self.position)
+		while stringMatch is None:
+			if not self.fill():
+				raise ValueError('Unterminated JSON string')
+			stringMatch = self.STRING_PATTERN.match(self.buffer, self.position)
+		self.position = stringMatch.end()
+		return stringMatch.group()
+
+	def nextToken(self):
+		while True:
+			match = self.STRUCTURE_PATTERN.search(self.buffer, self.position)
+			if match is None:
+				if not self.fill():
+					scalar = self.buffer[self.position:].strip()
+					self.position = len(self.buffer)
+					return ('scalar', json.loads(scalar)) if scalar else None
+				continue
+
+			scalar = self.buffer[self.position:match.start()].strip()
+			self.position = match.start()
+			if scalar:
+				return ('scalar', json.loads(scalar))
+			if match.group() == '"':
+				return ('string', json.loads(self.readString()))
+			self.position = match.end()
+			return (match.group(), None)
+
+	def readObject(self):
+		self.anchor = self.position - 1
+		depth = 1
+		while depth:
+			match = self.OBJECT_PATTERN.search(self.buffer, self.position)
+			if match is None:
+				if not self.fill():
+					raise ValueError('Unterminated JSON object')
+			elif match.group() == '"':
+				self.position = match.start()
+				self.readString()
+			else:
+				depth += 1 if match.group() == '{' else -1
+				self.position = match.end()
+
+		objectText = self.buffer[self.anchor:self.position]
+		self.anchor = None
+		return json.loads(objectText)
+
+GRIMOIRE_STREAM_THEME_PATH = (None, 'Response', 'themeCollection', '[]')
+
+GRIMOIRE_STREAM_PAGE_PATH = GRIMOIRE_STREAM_THEME_PATH + ('pageCollection', '[]')
+
+GRIMOIRE_STREAM_CARD_COLLECTION_PATH = GRIMOIRE_STREAM_PAGE_PATH + ('cardCollection',)
+
+def iterGrimoireEventsFromStream(chunks):
+	reader = JsonStreamReader(chunks)
+	containers = []
+
+	token = reader.nextToken()
+	while token is not None:
+		tokenType, value = token
+		parent = containers[-1] if containers else None
+		path = tuple(container['key'] for container in containers)
+
+		if tokenType == '{' and path == GRIMOIRE_STREAM_CARD_COLLECTION_PATH:
+			yield ('card', reader.readObject())
+		elif tokenType in ('{', '['):
+			containers.append({ 'type' : tokenType, 'key' : None if parent is None else parent['currentKey'] if parent['type'] == '{' else '[]', 'currentKey' : None })
+		elif tokenType in ('}', ']'):
+			containers.pop()
+			if tokenType == '}' and path == GRIMOIRE_STREAM_PAGE_PATH:
+				yield ('pageEnd', None)
+			elif tokenType == '}' and path == GRIMOIRE_STREAM_THEME_PATH:
+				yield ('themeEnd', None)
+		elif tokenType == ',' and parent['type'] == '{':
+			parent['currentKey'] = None
+		elif tokenType in ('string', 'scalar') and parent['type'] == '{' and parent['currentKey'] is None:
+			parent['currentKey'] = value
+		elif tokenType in ('string', 'scalar') and parent['type'] == '{':
+			if path == GRIMOIRE_STREAM_THEME_PATH and parent['currentKey'] == 'themeName':
+				yield ('theme', value)
+			elif path == GRIMOIRE_STREAM_PAGE_PATH and parent['currentKey'] == 'pageName':
+				yield ('page', value)
+		token = reader.nextToken()
+
+def addPendingGrimoireCards(grimoireDefinition, themeData, pendingCards, sheetURLs, searchIndex=None):
+	while pendingCards and themeData.themeName is not None and pendingCards[0][0].pageName is not None:
+		pageData, card = pendingCards.popleft()
+		logging.debug('Processing grimoire card data: %s', card)
+		pageData.cards.append(createGrimoireCardDefinition(themeData.themeName, pageData.pageName, card, sheetURLs))
+		addCardToSheetIndex(grimoireDefinition.sheets, pageData.cards[-1])
+		if searchIndex is not None:
+			searchIndex.addCard(themeData.themeName, pageData.pageName, pageData.cards[-1])
+
+def getDestinyGrimoireDefinitionFromStream(chunks, searchIndex=None):
+	logging.debug('Extracting grimoire definitions from streamed JSON')
+	grimoireDefinition = GrimoireDefinition(sheets=collections.OrderedDict())
+	sheetURLs = {}
+	themeData = pageData = None
+	pendingCards = collections.deque()
+
+	for eventType, value in iterGrimoireEventsFromStream(chunks):
+		if eventType == 'themeEnd':
+			addPendingGrimoireCards(grimoireDefinition, themeData, pendingCards, sheetURLs, searchIndex)
+			if pendingCards:
+				raise ValueError('Grimoire card without a theme or page name')
+			themeData = pageData = None
+			continue
+
+		if themeData is None:
+			themeData = Theme(None)
+			grimoireDefinition.themes.append(themeData)
+		if eventType == 'theme':
+			themeData.themeName = value
+		elif eventType == 'pageEnd':
+			pageData = None
+		else:
+			if pageData is None:
+				pageData = Page(None)
+				themeData.pages.append(pageData)
+			if eventType == 'page':
+				pageData.pageName = value
+			else:
+				pendingCards.append((pageData, value))
+		addPendingGrimoireCards(grimoireDefinition, themeData, pendingCards, sheetURLs, searchIndex)
+
+	return grimoireDefinition
+
+CatalogEntry = collections.namedtuple('CatalogEntry', ['locale', 'themeName', 'pageName', 'card'])
+
+class GrimoireCatalog(object):
+	def __init__(self, catalogFile):
+		if not os.path.exists(os.path.dirname(catalogFile)):
+			os.makedirs(os.path.dirname(catalogFile))
+		self.connection = sqlite3.connect(catalogFile, timeout=GRIMOIRE_CATALOG_TIMEOUT)
+		self.connection.row_factory = sqlite3.Row
+		self.connection.executescript(GRIMOIRE_CATALOG_SCHEMA)
+
+	def close(self):
+		self.connection.close()
+
+	def getVersion(self, locale=None):
+		row = self.connection.execute('SELECT version FROM definitions WHERE locale = ?', (locale or '',)).fetchone()
+		return json.loads(row['version']) if row is not None else None
+
+	def save(self, grimoireDefinition, locale=None, version=None):
+		with self.connection:
+			self.connection.execute('DELETE FROM cards WHERE locale = ?', (locale or '',))
+			self.connection.execute('DELETE FROM pages WHERE themeId IN (SELECT id FROM themes WHERE locale = ?)', (locale or '',))
+			self.connection.execute('DELETE FROM themes WHERE locale = ?', (locale or '',))
+			for themePosition, themeData in enumerate(grimoireDefinition.themes):
+				themeId = self.connection.execute('INSERT INTO themes (locale, position, themeName) VALUES (?, ?, ?)', (locale or '', themePosition, themeData.themeName)).lastrowid
+				for pagePosition, pageData in enumerate(themeData.pages):
+					pageId = self.connection.execute('INSERT INTO pages (themeId, position, pageName) VALUES (?, ?, ?)', (themeId, pagePosition, pageData.pageName)).lastrowid
+					self.connection.executemany('INSERT INTO cards (pageId, position, locale, hash, cardName, cardIntro, cardDescription, sourceImage, regionXStart, regionYStart, regionWidth, regionHeight) '
+												'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+												((pageId, cardPosition, locale or '', cardData.hash, cardData.cardName, cardData.cardIntro, cardData.cardDescription, cardData.image.sourceImage) + getCardImageDimensions(cardData.image)
+												for cardPosition, cardData in enumerate(pageData.cards)))
+			self.connection.execute('INSERT OR REPLACE INTO definitions (locale, version) VALUES (?, ?)', (locale or '', json.dumps(version, sort_keys=True)))
+
+	def load(self, locale=None):
+		if self.connection.execute('SELECT 1 FROM definitions WHERE locale = ?', (locale or '',)).fetchone() is None:
+			return None
+
+		grimoireDefinition = GrimoireDefinition(sheets=collections.OrderedDict())
+		sheetURLs = {}
+		themeId = pageId = None
+		for row in self.connection.execute('SELECT themes.id AS themeId, themeName, pages.id AS pageId, pageName, cards.id AS cardId, ' + CATALOG_CARD_COLUMNS + ' FROM themes '
+											'LEFT JOIN pages ON pages.themeId = themes.id LEFT JOIN cards ON cards.pageId = pages.id '
+											'WHERE themes.locale = ? ORDER BY themes.position, pages.position, cards.position', (locale or '',)):
+			if row['themeId'] != themeId:
+				themeId, pageId = row['themeId'], None
+				grimoireDefinition.themes.append(Theme(row['themeName']))
+			if row['pageId'] is not None and row['pageId'] != pageId:
+				pageId = row['pageId']
+				grimoireDefinition.themes[-1].pages.append(Page(row['pageName']))
+			if row['cardId'] is not None:
+				grimoireDefinition.themes[-1].pages[-1].cards.append(createCatalogCard(row, sheetURLs))
+				addCardToSheetIndex(grimoireDefinition.sheets, grimoireDefinition.themes[-1].pages[-1].cards[-1])
+		return grimoireDefinition
+
+	def findCards(self, hash=None, themeName=None, pageName=None, cardName=None, locale=None):
+		conditions = [(column, value) for column, value in (('cards.hash', hash), ('themes.themeName', themeName), ('pages.pageName', pageName), ('cards.cardName', cardName), ('cards.locale', locale)) if value is not None]
+		query = 'SELECT themeName, pageName, cards.locale, ' + CATALOG_CARD_COLUMNS + ' FROM cards JOIN pages ON cards.pageId = pages.id JOIN themes ON pages.themeId = themes.id'
+		if conditions:
+			query += ' WHERE ' + ' AND '.join('%s = ?' % column for column, value in conditions)
+		query += ' ORDER BY cards.locale, themes.position, pages.position, cards.position'
+		return [CatalogEntry(row['locale'] or None, row['themeName'], row['pageName'], createCatalogCard(row))
+				for row in self.connection.execute(query, [value for column, value in conditions])]
+
+def createCatalogCard(row, sheetURLs=None):
+	sourceImage = row['sourceImage']
+	if sheetURLs is not None:
+		sourceImage = sheetURLs.setdefault(sourceImage, sourceImage)
+	return Card(row['cardName'], row['cardIntro'], row['cardDescription'], str(row['hash']),
+				ImageRegion(sourceImage, row['regionXStart'], row['regionYStart'], row['regionWidth'], row['regionHeight']))
+
+def loadCatalogedGrimoireDefinition(apiKey, locale=None, searchIndex=None):
+	session, response, cachedDefinitionPath, validatorsPath = requestDestinyGrimoireFromBungie(apiKey, stream=True, locale=locale)
+	with contextlib.closing(GrimoireCatalog(os.path.join(DEFAULT_CACHE_FOLDER, GRIMOIRE_CATALOG_FILE_NAME))) as catalog:
+		if response.status_code == 304:
+			response.close()
+			session.close()
+			if catalog.getVersion(locale) == loadCachedValidators(validatorsPath):
+				logging.debug('Destiny Grimoire not modified, using cataloged copy')
+				grimoireDefinition = catalog.load(locale)
+				if searchIndex is not None:
+					indexGrimoireDefinition(grimoireDefinition, searchIndex)
+				return grimoireDefinition
+			chunks = iterFileChunks(cachedDefinitionPath)
+		else:
+			chunks = iterGrimoireResponseChunks(session, response, cachedDefinitionPath, validatorsPath)
+
+		grimoireDefinition = getDestinyGrimoireDefinitionFromStream(chunks, searchIndex)
+		with traceSpan('updateCatalog', locale=locale):
+			catalog.save(grimoireDefinition, locale, loadCachedValidators(validatorsPath))
+		return grimoireDefinition
+
+SearchHit = collections.namedtuple('SearchHit', ['hash', 'themeName', 'pageName', 'cardName'])
+
+def getLoreTerms(text):
+	return [term for term in LORE_TERM_PATTERN.findall(LORE_MARKUP_PATTERN.sub(u' ', text or u'').lower()) if len(term) >= SEARCH_TERM_MIN_LENGTH]
+
+def encodeVarint(value):
+	encoded = bytearray()
+	while value >= 0x80:
+		encoded.append(value & 0x7f | 0x80)
+		value >>= 7
+	encoded.append(value)
+	return bytes(encoded)
+
+def decodeVarint(data, offset):
+	value = shift = 0
+	while True:
+		byte = ord(data[offset])
+		offset += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return value, offset
+		shift += 7
+
+def encodeIndexString(value):
+	encoded = value.encode('utf8')
+	return encodeVarint(len(encoded)) + encoded
+
+def decodeIndexString(data, offset):
+	length, offset = decodeVarint(data, offset)
+	return data[offset:offset + length].decode('utf8'), offset + length
+
+def searchGrimoireIndex(searchIndex, query):
+	if isinstance(query, str):
+		query = query.decode('utf8')
+	matches = None
+	for term, prefix in SEARCH_QUERY_TERM_PATTERN.findall(query.lower()):
+		if len(term) < SEARCH_TERM_MIN_LENGTH and not prefix:
+			continue
+		termMatches = set(searchIndex.getTermPostings(term, bool(prefix)))
+		matches = termMatches if matches is None else matches & termMatches
+	return [searchIndex.cards[cardId] for cardId in sorted(matches or ())]
+
+class GrimoireSearchIndex(object):
+	def __init__(self):
+		self.cards = []
+		self.postings = collections.defaultdict(list)
+
+	def addCard(self, themeName, pageName, card):
+		cardId = len(self.cards)
+		self.cards.append(SearchHit(card.hash, themeName, pageName, card.cardName))
+		for term in set(getLoreTerms(card.cardName) + getLoreTerms(card.cardIntro) + getLoreTerms(card.cardDescription)):
+			self.postings[term].append(cardId)
+
+	def getTermPostings(self, term, prefix=False):
+		if prefix:
+			return set(cardId for indexedTerm, postings in self.postings.items() if indexedTerm.startswith(term) for cardId in postings)
+		return self.postings.get(term, ())
+
+	def search(self, query):
+		return searchGrimoireIndex(self, query)
+
+	def save(self, indexFile):
+		pageIds = collections.OrderedDict()
+		for hit in self.cards:
+			pageIds.setdefault((hit.themeName, hit.pageName), len(pageIds))
+		terms = sorted(self.postings)
+
+		chunks = [struct.pack(SEARCH_INDEX_HEADER_FORMAT, SEARCH_INDEX_MAGIC, SEARCH_INDEX_FORMAT_VERSION, len(pageIds), len(self.cards), len(terms))]
+		for themeName, pageName in pageIds:
+			chunks.extend((encodeIndexString(themeName), encodeIndexString(pageName)))
+		for hit in self.cards:
+			chunks.extend((binascii.unhexlify(hit.hash), encodeVarint(pageIds[(hit.themeName, hit.pageName)]), encodeIndexString(hit.cardName)))
+		for term in terms:
+			previousCardId = 0
+			postings = bytearray()
+			for cardId in self.postings[term]:
+				postings.extend(encodeVarint(cardId - previousCardId))
+				previousCardId = cardId
+			chunks.extend((encodeIndexString(term), encodeVarint(len(self.postings[term])), encodeVarint(len(postings)), bytes(postings)))
 
-	imagesToDownload = Set([match.value for match in jsonpath_expr.find(grimoireDefinition)])
+		if not os.path.exists(os.path.dirname(indexFile)):
+			os.makedirs(os.path.dirname(indexFile))
+		with open(indexFile + '.part', 'wb') as searchIndexFile:
+			searchIndexFile.write(b''.join(chunks))
+		os.rename(indexFile + '.part', indexFile)
+
+class StoredSearchIndex(object):
+	def __init__(self, indexFile):
+		with open(indexFile, 'rb') as searchIndexFile:
+			self.data = searchIndexFile.read()
+		if len(self.data) < struct.calcsize(SEARCH_INDEX_HEADER_FORMAT):
+			raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SEARCH_INDEX_ERROR_MSG % (indexFile, 'truncated file'))
+		magic, version, pageCount, cardCount, termCount = struct.unpack_from(SEARCH_INDEX_HEADER_FORMAT, self.data)
+		if magic != SEARCH_INDEX_MAGIC or version != SEARCH_INDEX_FORMAT_VERSION:
+			raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SEARCH_INDEX_ERROR_MSG % (indexFile, 'unsupported format'))
+
+		offset = struct.calcsize(SEARCH_INDEX_HEADER_FORMAT)
+		pages = []
+		for pageId in range(pageCount):
+			themeName, offset = decodeIndexString(self.data, offset)
+			pageName, offset = decodeIndexString(self.data, offset)
+			pages.append((themeName, pageName))
+
+		self.cards = []
+		for cardId in range(cardCount):
+			cardHash = binascii.hexlify(self.data[offset:offset + SEARCH_INDEX_HASH_SIZE])
+			pageId, offset = decodeVarint(self.data, offset + SEARCH_INDEX_HASH_SIZE)
+			cardName, offset = decodeIndexString(self.data, offset)
+			self.cards.append(SearchHit(cardHash, pages[pageId][0], pages[pageId][1], cardName))
+
+		self.terms = []
+		self.postingOffsets = []
+		for termId in range(termCount):
+			term, offset = decodeIndexString(self.data, offset)
+			postingCount, offset = decodeVarint(self.data, offset)
+			postingSize, offset = decodeVarint(self.data, offset)
+			self.terms.append(term)
+			self.postingOffsets.append((offset, postingCount))
+			offset += postingSize
+
+	def readPostings(self, termId):
+		offset, postingCount = self.postingOffsets[termId]
+		postings = []
+		cardId = 0
+		for posting in range(postingCount):
+			delta, offset = decodeVarint(self.data, offset)
+			cardId += delta
+			postings.append(cardId)
+		return postings
+
+	def getTermPostings(self, term, prefix=False):
+		termId = bisect.bisect_left(self.terms, term)
+		if not prefix:
+			return self.readPostings(termId) if termId < len(self.terms) and self.terms[termId] == term else ()
+		postings = set()
+		while termId < len(self.terms) and self.terms[termId].startswith(term):
+			postings.update(self.readPostings(termId))
+			termId += 1
+		return postings
+
+	def search(self, query):
+		return searchGrimoireIndex(self, query)
+
+def indexGrimoireDefinition(grimoireDefinition, searchIndex=None):
+	searchIndex = searchIndex or GrimoireSearchIndex()
+	for themeData in grimoireDefinition.themes:
+		for pageData in themeData.pages:
+			for cardData in pageData.cards:
+				searchIndex.addCard(themeData.themeName, pageData.pageName, cardData)
+	return searchIndex
+
+def getSearchIndexFile(locale=None):
+	return os.path.join(DEFAULT_CACHE_FOLDER, getGrimoireEditionFile(SEARCH_INDEX_FILE_NAME, locale))
+
+def searchGrimoireLore(query, locale=None):
+	indexFile = getSearchIndexFile(locale)
+	if not os.path.exists(indexFile):
+		raise DestinyContentAPIClientError(DestinyContentAPIClientError.NO_SEARCH_INDEX_ERROR_MSG % indexFile)
+	return StoredSearchIndex(indexFile).search(query)
+
+def printGrimoireSearchResults(query, locales=None):
+	for locale in (locales or [None]):
+		for hit in searchGrimoireLore(query, locale):
+			print (u'\t'.join(([locale] if locale else []) + [hit.hash, '%s.xhtml' % getGrimoireCardFileName(hit), u'%s / %s / %s' % (hit.themeName, hit.pageName, hit.cardName)])).encode('utf8')
+
+def parseRetryAfter(retryAfter):
+	if not retryAfter:
+		return 0
+	if retryAfter.strip().isdigit():
+		return int(retryAfter)
+	retryDate = emailUtils.parsedate_tz(retryAfter)
+	if retryDate is None:
+		return 0
+	return max(0, emailUtils.mktime_tz(retryDate) - time.time())
+
+def readBungieErrorResponse(response):
+	contentLength = response.headers.get('Content-Length')
+	if 'json' not in response.headers.get('Content-Type', '') or contentLength is None or not contentLength.isdigit() or int(contentLength) > BUNGIE_ERROR_RESPONSE_SIZE_LIMIT:
+		return None
+	try:
+		errorResponse = response.json()
+	except ValueError:
+		return None
+	return errorResponse if isinstance(errorResponse, dict) else None
+
+def getBungieRetryDelay(response):
+	if response.status_code in RETRYABLE_STATUS_CODES:
+		return parseRetryAfter(response.headers.get('Retry-After'))
+	errorResponse = readBungieErrorResponse(response)
+	if errorResponse is None:
+		return None
+	throttleSeconds = errorResponse.get('ThrottleSeconds') or 0
+	if throttleSeconds > 0 or errorResponse.get('ErrorCode') in BUNGIE_THROTTLE_ERROR_CODES:
+		return throttleSeconds
+	return None
+
+class BungieRequestScheduler(object):
+	def __init__(self, concurrency=DEFAULT_DOWNLOAD_POOL_SIZE, maxConcurrency=MAX_REQUEST_CONCURRENCY, retries=DEFAULT_REQUEST_RETRIES, backoffBase=REQUEST_BACKOFF_BASE, backoffCap=REQUEST_BACKOFF_CAP):
+		self.concurrency = float(concurrency)
+		self.maxConcurrency = maxConcurrency
+		self.retries = retries
+		self.backoffBase = backoffBase
+		self.backoffCap = backoffCap
+		self.inFlight = 0
+		self.resumeTime = 0
+		self.backoffEpoch = 0
+		self.condition = threading.Condition()
+
+	def acquire(self):
+		with self.condition:
+			while True:
+				pause = self.resumeTime - time.time()
+				if pause > 0:
+					self.condition.wait(pause)
+				elif self.inFlight < int(self.concurrency):
+					break
+				else:
+					self.condition.wait()
+			self.inFlight += 1
+			return (self.backoffEpoch, self.inFlight >= int(self.concurrency))
+
+	def release(self, ticket, failed=False, retryAfter=0):
+		epoch, windowLimited = ticket
+		with self.condition:
+			self.inFlight -= 1
+			if not failed:
+				if windowLimited:
+					self.concurrency = min(self.maxConcurrency, self.concurrency + 1 / self.concurrency)
+			elif epoch == self.backoffEpoch:
+				self.concurrency = max(1.0, self.concurrency / 2)
+				self.backoffEpoch += 1
+				logging.debug('Bungie request concurrency lowered to %d', self.concurrency)
+			if retryAfter > 0:
+				self.resumeTime = max(self.resumeTime, time.time() + retryAfter)
+			self.condition.notify_all()
+
+	def getBackoff(self, attempt):
+		return random.uniform(0, min(self.backoffCap, self.backoffBase * 2 ** attempt))
+
+	def send(self, sendRequest, url, stream=False):
+		attempt = 0
+		while True:
+			ticket = self.acquire()
+			try:
+				response = sendRequest()
+			except (requests.ConnectionError, requests.Timeout) as error:
+				self.release(ticket, True)
+				if attempt >= self.retries:
+					raise
+				logging.warning('Request to %s failed (%s), retrying', url, error)
+			else:
+				retryAfter = getBungieRetryDelay(response)
+				if retryAfter is None and stream and not response._content_consumed:
+					response.releaseSlot = lambda: self.release(ticket)
+					return response
+				self.release(ticket, retryAfter is not None, retryAfter or 0)
+				if retryAfter is None or attempt >= self.retries:
+					return response
+				logging.warning('Request to %s throttled with status %d, retrying', url, response.status_code)
+				response.close()
+			time.sleep(self.getBackoff(attempt))
+			attempt += 1
+
+bungieRequestScheduler = BungieRequestScheduler()
+
+bungieSessionType = None
+
+def getBungieSessionType():
+	global bungieSessionType
+	if bungieSessionType is not None:
+		return bungieSessionType
+
+	class BungieResponse(requests.Response):
+		releaseSlot = None
+
+		def iter_content(self, *args, **kwargs):
+			for chunk in super(BungieResponse, self).iter_content(*args, **kwargs):
+				yield chunk
+			self.releaseScheduledSlot()
+
+		def close(self):
+			try:
+				super(BungieResponse, self).close()
+			finally:
+				self.releaseScheduledSlot()
+
+		def releaseScheduledSlot(self):
+			releaseSlot, self.releaseSlot = self.releaseSlot, None
+			if releaseSlot is not None:
+				releaseSlot()
+
+	class BungieAdapter(requests.adapters.HTTPAdapter):
+		def build_response(self, request, rawResponse):
+			response = BungieResponse()
+			response.__dict__.update(super(BungieAdapter, self).build_response(request, rawResponse).__dict__)
+			return response
+
+	class BungieSession(requests.Session):
+		def __init__(self, poolSize=DEFAULT_DOWNLOAD_POOL_SIZE, scheduler=None):
+			super(BungieSession, self).__init__()
+			self.scheduler = scheduler
+			adapter = BungieAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+			self.mount('http://', adapter)
+			self.mount('https://', adapter)
+
+		def request(self, method, url, *args, **kwargs):
+			sendRequest = super(BungieSession, self).request
+			return (self.scheduler or bungieRequestScheduler).send(lambda: sendRequest(method, url, *args, **kwargs), url, kwargs.get('stream', False))
+
+	bungieSessionType = BungieSession
+	return bungieSessionType
+
+def createBungieSession(poolSize=DEFAULT_DOWNLOAD_POOL_SIZE, scheduler=None):
+	return getBungieSessionType()(poolSize, scheduler)
+
+def mergeGrimoireDefinitions(grimoireDefinitions):
+	mergedDefinition = GrimoireDefinition(sheets=collections.OrderedDict())
+	for grimoireDefinition in grimoireDefinitions:
+		mergedDefinition.themes.extend(grimoireDefinition.themes)
+		for sheetURL, sheetCards in groupGrimoireCardsBySheet(grimoireDefinition).items():
+			mergedDefinition.sheets.setdefault(sheetURL, []).extend(sheetCards)
+	return mergedDefinition
+
+def getGrimoireSheetsBySize(grimoireDefinition):
+	sheetExtents = {}
+	for sheetURL, sheetCards in groupGrimoireCardsBySheet(grimoireDefinition).items():
+		sheetExtents[sheetURL] = (max(cardData.image.regionXStart + cardData.image.regionWidth for cardData in sheetCards),
+									max(cardData.image.regionYStart + cardData.image.regionHeight for cardData in sheetCards))
+
+	return sorted(sheetExtents, key=lambda imageURL: (-sheetExtents[imageURL][0] * sheetExtents[imageURL][1], imageURL))
+
+def getSheetPath(imageURL, imagesFolder):
+	return os.path.join(imagesFolder, urlparse.urlsplit(imageURL).path.split('/')[-1])
+
+class FolderSheetStore(object):
+	def __init__(self, imagesFolder):
+		self.imagesFolder = imagesFolder
+
+	def getSheetSource(self, sheetURL):
+		return os.path.join(self.imagesFolder, os.path.basename(sheetURL))
+
+def getSheetStore(sheetStore):
+	return FolderSheetStore(sheetStore) if isinstance(sheetStore, basestring) else sheetStore
+
+mappedStoreFiles = {}
+
+mappedStoreFilesLock = threading.Lock()
+
+def getMappedStoreFile(storeFile):
+	with mappedStoreFilesLock:
+		if storeFile not in mappedStoreFiles:
+			with open(storeFile, 'rb') as mappedFile:
+				mappedStoreFiles[storeFile] = mmap.mmap(mappedFile.fileno(), 0, access=mmap.ACCESS_READ)
+		return mappedStoreFiles[storeFile]
+
+def releaseMappedStoreFile(storeFile):
+	with mappedStoreFilesLock:
+		mappedFile = mappedStoreFiles.pop(storeFile, None)
+	if mappedFile is not None:
+		mappedFile.close()
+
+class StoredSheet(collections.namedtuple('StoredSheet', ['storeFile', 'fileName', 'offset', 'size'])):
+	__slots__ = ()
+
+	def read(self):
+		return getMappedStoreFile(self.storeFile)[self.offset:self.offset + self.size]
+
+	def __str__(self):
+		return '%s:%s' % (self.storeFile, self.fileName)
+
+class PackedSheetStore(object):
+	def __init__(self, packFile):
+		self.packFile = packFile
+		self.sheets = loadSheetPackIndex(packFile)
+
+	def getSheetSource(self, sheetURL):
+		packedSheet = self.sheets[sheetURL]
+		return StoredSheet(self.packFile, packedSheet['fileName'], packedSheet['offset'], packedSheet['size'])
+
+def loadSheetPackIndex(packFile):
+	try:
+		with open(packFile, 'rb') as sheetPack:
+			if sheetPack.read(len(SHEET_PACK_MAGIC)) != SHEET_PACK_MAGIC:
+				return {}
+			trailerSize = struct.calcsize(SHEET_PACK_TRAILER_FORMAT)
+			sheetPack.seek(-trailerSize, os.SEEK_END)
+			indexEnd = sheetPack.tell()
+			indexOffset, = struct.unpack(SHEET_PACK_TRAILER_FORMAT, sheetPack.read(trailerSize))
+			sheetPack.seek(indexOffset)
+			packIndex = json.loads(sheetPack.read(indexEnd - indexOffset))
+	except (IOError, ValueError, struct.error):
+		return {}
+	return packIndex['sheets'] if packIndex.get('version') == SHEET_PACK_FORMAT_VERSION else {}
+
+def packGrimoireSheets(imagesFolder, sheetManifest, packFile=None):
+	packFile = packFile or os.path.join(imagesFolder, SHEET_PACK_FILE_NAME)
+	previousSheets = loadSheetPackIndex(packFile)
+	if all(sheetURL in previousSheets and previousSheets[sheetURL]['checksum'] == sheetManifest[sheetURL].get('checksum') for sheetURL in sheetManifest):
+		logging.debug('Sheet pack %s is up to date' % packFile)
+		return PackedSheetStore(packFile)
+
+	logging.info('Packing %d Grimoire image sheets into %s' % (len(sheetManifest), packFile))
+	packedSheets = {}
+	with open(packFile + '.part', 'wb') as sheetPack:
+		sheetPack.write(SHEET_PACK_MAGIC)
+		for sheetURL in sorted(sheetManifest):
+			sheetPath = getSheetPath(sheetURL, imagesFolder)
+			previousSheet = previousSheets.get(sheetURL)
+			packedSheets[sheetURL] = { 'fileName' : os.path.basename(sheetPath), 'offset' : sheetPack.tell(), 'checksum' : sheetManifest[sheetURL].get('checksum') }
+			if previousSheet is not None and previousSheet['checksum'] == sheetManifest[sheetURL].get('checksum'):
+				sheetPack.write(StoredSheet(packFile, previousSheet['fileName'], previousSheet['offset'], previousSheet['size']).read())
+			else:
+				with open(sheetPath, 'rb') as sheetFile:
+					shutil.copyfileobj(sheetFile, sheetPack, DOWNLOAD_CHUNK_SIZE)
+			packedSheets[sheetURL]['size'] = sheetPack.tell() - packedSheets[sheetURL]['offset']
+		indexOffset = sheetPack.tell()
+		json.dump({ 'version' : SHEET_PACK_FORMAT_VERSION, 'sheets' : packedSheets }, sheetPack, sort_keys=True)
+		sheetPack.write(struct.pack(SHEET_PACK_TRAILER_FORMAT, indexOffset))
+	releaseMappedStoreFile(packFile)
+	os.rename(packFile + '.part', packFile)
+	return PackedSheetStore(packFile)
+
+class SheetPackWriter(object):
+	def __init__(self, packFile, imagesFolder):
+		self.packFile = packFile
+		self.imagesFolder = imagesFolder
+		self.previousSheets = loadSheetPackIndex(packFile)
+		self.looseSheets = {}
+		self.keptSheets = set()
+		self.sheets = {}
+		self.sheetPack = None
+		self.lock = threading.Lock()
+
+	def getValidManifestEntry(self, sheetURL, manifestEntry):
+		packedSheet = self.previousSheets.get(sheetURL)
+		if manifestEntry is not None and packedSheet is not None and packedSheet['checksum'] == manifestEntry.get('checksum'):
+			return manifestEntry
+		manifestEntry = getValidSheetManifestEntry(manifestEntry, getSheetPath(sheetURL, self.imagesFolder))
+		if manifestEntry is not None:
+			self.looseSheets[sheetURL] = getSheetPath(sheetURL, self.imagesFolder)
+		return manifestEntry
+
+	def keepSheet(self, sheetURL, manifestEntry):
+		if sheetURL in self.looseSheets:
+			with open(self.looseSheets[sheetURL], 'rb') as sheetFile:
+				self.addSheet(sheetURL, sheetFile, manifestEntry['checksum'])
+		else:
+			with self.lock:
+				self.keptSheets.add(sheetURL)
+
+	def addSheet(self, sheetURL, sheetFile, checksum):
+		with self.lock:
+			if self.sheetPack is None:
+				self.sheetPack = open(self.packFile + '.part', 'wb')
+				self.sheetPack.write(SHEET_PACK_MAGIC)
+			offset = self.sheetPack.tell()
+			shutil.copyfileobj(sheetFile, self.sheetPack, DOWNLOAD_CHUNK_SIZE)
+			self.sheets[sheetURL] = { 'fileName' : getSheetPath(sheetURL, ''), 'offset' : offset, 'size' : self.sheetPack.tell() - offset, 'checksum' : checksum }
+
+	def close(self):
+		if self.sheetPack is None:
+			logging.debug('Sheet pack %s is up to date' % self.packFile)
+			return
+
+		logging.info('Packing %d Grimoire image sheets into %s' % (len(self.sheets) + len(self.keptSheets), self.packFile))
+		with self.sheetPack as sheetPack:
+			for sheetURL in sorted(self.keptSheets):
+				packedSheet = self.previousSheets[sheetURL]
+				self.sheets[sheetURL] = dict(packedSheet, offset=sheetPack.tell())
+				sheetPack.write(StoredSheet(self.packFile, packedSheet['fileName'], packedSheet['offset'], packedSheet['size']).read())
+			indexOffset = sheetPack.tell()
+			json.dump({ 'version' : SHEET_PACK_FORMAT_VERSION, 'sheets' : self.sheets }, sheetPack, sort_keys=True)
+			sheetPack.write(struct.pack(SHEET_PACK_TRAILER_FORMAT, indexOffset))
+		releaseMappedStoreFile(self.packFile)
+		os.rename(self.packFile + '.part', self.packFile)
+
+	def abort(self):
+		if self.sheetPack is not None:
+			self.sheetPack.close()
+			os.remove(self.packFile + '.part')
+
+def openSheetImage(sheetSource):
+	if isinstance(sheetSource, basestring):
+		return Image.open(sheetSource)
+	return Image.open(io.BytesIO(sheetSource.read()))
+
+def getSheetSourceExtension(sheetSource):
+	return os.path.splitext(sheetSource if isinstance(sheetSource, basestring) else sheetSource.fileName)[1]
+
+def getSheetSourceChecksum(sheetSource):
+	if isinstance(sheetSource, basestring):
+		return getFileChecksum(sheetSource)
+	return hashlib.sha1(sheetSource.read()).hexdigest()
+
+def getFileChecksum(filePath):
+	checksum = hashlib.sha1()
+	with open(filePath, 'rb') as checkedFile:
+		for chunk in iter(lambda: checkedFile.read(DOWNLOAD_CHUNK_SIZE), b''):
+			checksum.update(chunk)
+	return checksum.hexdigest()
+
+def loadSheetManifest(imagesFolder):
+	try:
+		with open(os.path.join(imagesFolder, SHEET_MANIFEST_FILE_NAME)) as manifestFile:
+			return json.load(manifestFile)
+	except (IOError, ValueError):
+		return {}
+
+def saveSheetManifest(imagesFolder, manifest):
+	manifestPath = os.path.join(imagesFolder, SHEET_MANIFEST_FILE_NAME)
+	with open(manifestPath + '.part', 'w') as manifestFile:
+		json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+	os.rename(manifestPath + '.part', manifestPath)
+
+def unpackGrimoireSheets(imagesFolder, manifest, sheetURLs):
+	packFile = os.path.join(imagesFolder, SHEET_PACK_FILE_NAME)
+	packedSheets = None
+	for sheetURL in sheetURLs:
+		manifestEntry = manifest.get(sheetURL)
+		if manifestEntry is None or not manifestEntry.get('packed'):
+			continue
+		if packedSheets is None:
+			packedSheets = loadSheetPackIndex(packFile)
+		packedSheet = packedSheets.get(sheetURL)
+		if packedSheet is None or packedSheet['checksum'] != manifestEntry['checksum']:
+			manifest.pop(sheetURL)
+			continue
+
+		logging.debug('Unpacking %s from %s' % (sheetURL, packFile))
+		sheetPath = getSheetPath(sheetURL, imagesFolder)
+		with open(sheetPath + '.part', 'wb') as sheetFile:
+			sheetFile.write(StoredSheet(packFile, packedSheet['fileName'], packedSheet['offset'], packedSheet['size']).read())
+		os.rename(sheetPath + '.part', sheetPath)
+		manifest[sheetURL] = dict((key, value) for key, value in manifestEntry.items() if key != 'packed')
+		manifest[sheetURL].update(size=os.path.getsize(sheetPath), mtime=os.path.getmtime(sheetPath))
+	if packedSheets is not None:
+		releaseMappedStoreFile(packFile)
+
+def getValidSheetManifestEntry(manifestEntry, sheetPath):
+	if manifestEntry is None or not os.path.exists(sheetPath):
+		return None
+
+	sheetStat = os.stat(sheetPath)
+	if sheetStat.st_size != manifestEntry['size']:
+		return None
+	if sheetStat.st_mtime != manifestEntry.get('mtime'):
+		if getFileChecksum(sheetPath) != manifestEntry['checksum']:
+			return None
+		return dict(manifestEntry, mtime=sheetStat.st_mtime)
+	return manifestEntry
+
+def getConditionalRequestHeaders(cacheEntry):
+	headers = {}
+	if cacheEntry is not None and cacheEntry.get('etag'):
+		headers['If-None-Match'] = cacheEntry['etag']
+	if cacheEntry is not None and cacheEntry.get('lastModified'):
+		headers['If-Modified-Since'] = cacheEntry['lastModified']
+	return headers
+
+def downloadGrimoireSheet(session, imageURL, imagesFolder, manifestEntry=None, sheetPack=None):
+	logging.debug("Downloading %s" % imageURL)
+	sheetPath = getSheetPath(imageURL, imagesFolder)
+
+	with traceSpan('downloadSheet', 'sheet', sheet=imageURL):
+		response = session.get(imageURL, headers=getConditionalRequestHeaders(manifestEntry), stream=True)
+		try:
+			if response.status_code == 304:
+				logging.debug("%s not modified since last download" % imageURL)
+				if sheetPack is not None:
+					sheetPack.keepSheet(imageURL, manifestEntry)
+				return manifestEntry
+			response.raise_for_status()
+			checksum = hashlib.sha1()
+			with tempfile.SpooledTemporaryFile(SHEET_PACK_SPOOL_SIZE) if sheetPack is not None else open(sheetPath + '.part', 'wb') as sheetFile:
+				for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+					checksum.update(chunk)
+					sheetFile.write(chunk)
+				sheetSize = sheetFile.tell()
+				if sheetPack is not None:
+					sheetFile.seek(0)
+					sheetPack.addSheet(imageURL, sheetFile, checksum.hexdigest())
+		finally:
+			response.close()
+		if sheetPack is None:
+			os.rename(sheetPath + '.part', sheetPath)
+
+	manifestEntry = { 'etag' : response.headers.get('ETag'),
+					'lastModified' : response.headers.get('Last-Modified'),
+					'size' : sheetSize,
+					'checksum' : checksum.hexdigest() }
+	if sheetPack is None:
+		manifestEntry['mtime'] = os.path.getmtime(sheetPath)
+	return manifestEntry
+
+def tryDownloadGrimoireSheet(session, imageURL, imagesFolder, manifestEntry=None, revalidate=True, sheetPack=None):
+	try:
+		if sheetPack is None:
+			manifestEntry = getValidSheetManifestEntry(manifestEntry, getSheetPath(imageURL, imagesFolder))
+		else:
+			manifestEntry = sheetPack.getValidManifestEntry(imageURL, manifestEntry)
+		if manifestEntry is not None and not revalidate:
+			logging.debug("Using cached %s" % imageURL)
+			if sheetPack is not None:
+				sheetPack.keepSheet(imageURL, manifestEntry)
+			return (imageURL, manifestEntry, None)
+		if sheetPack is None:
+			return (imageURL, downloadGrimoireSheet(session, imageURL, imagesFolder, manifestEntry), None)
+		return (imageURL, downloadGrimoireSheet(session, imageURL, imagesFolder, manifestEntry, sheetPack), None)
+	except (IOError, OSError) as error:
+		logging.warning("Failed to download %s: %s" % (imageURL, error))
+		return (imageURL, None, error)
+
+def dowloadGrimoireImages(grimoireDefinition, poolSize=DEFAULT_DOWNLOAD_POOL_SIZE, revalidateCachedSheets=True, packSheets=False):
+	logging.info('Dowloading Grimoire images')
+	imagesToDownload = getGrimoireSheetsBySize(grimoireDefinition)
 
 	if not os.path.exists(DEFAULT_IMAGE_FOLDER):
 		os.makedirs(DEFAULT_IMAGE_FOLDER)
 
-	for imageURL in imagesToDownload:
-		logging.debug("Downloading %s" % imageURL)
-		urllib.urlretrieve(imageURL, os.path.join(DEFAULT_IMAGE_FOLDER, urlparse.urlsplit(imageURL).path.split('/')[-1]))
+	manifest = loadSheetManifest(DEFAULT_IMAGE_FOLDER)
+	failedDownloads = {}
+	sheetPack = SheetPackWriter(os.path.join(DEFAULT_IMAGE_FOLDER, SHEET_PACK_FILE_NAME), DEFAULT_IMAGE_FOLDER) if packSheets else None
+	if sheetPack is None:
+		unpackGrimoireSheets(DEFAULT_IMAGE_FOLDER, manifest, imagesToDownload)
+
+	session = createBungieSession(poolSize)
+	downloadPool = ThreadPool(max(1, min(poolSize, len(imagesToDownload))))
+	try:
+		downloads = downloadPool.imap_unordered(lambda imageURL: tryDownloadGrimoireSheet(session, imageURL, DEFAULT_IMAGE_FOLDER, manifest.get(imageURL), revalidateCachedSheets, sheetPack), imagesToDownload)
+		for imageURL, manifestEntry, error in downloads:
+			if error is None:
+				manifest[imageURL] = dict(manifestEntry, packed=True) if sheetPack is not None else manifestEntry
+			else:
+				failedDownloads[imageURL] = error
+				manifest.pop(imageURL, None)
+	except:
+		if sheetPack is not None:
+			sheetPack.abort()
+		raise
+	finally:
+		downloadPool.close()
+		downloadPool.join()
+		session.close()
+
+	if sheetPack is not None:
+		sheetPack.close()
+	manifest = dict((imageURL, manifest[imageURL]) for imageURL in imagesToDownload if imageURL in manifest)
+	saveSheetManifest(DEFAULT_IMAGE_FOLDER, manifest)
+
+	if failedDownloads:
+		raise DestinyContentAPIClientError(DestinyContentAPIClientError.SHEET_DOWNLOAD_FAILED_ERROR_MSG % (len(failedDownloads), ', '.join(sorted(failedDownloads))))
+
+	return manifest
+
+def getGrimoireCardFileName(cardData):
+	return '%s-%s' % (cardData.hash, re.sub(r"[^\d\w]","_", cardData.cardName))
+
+def getCardImageDimensions(imageData):
+	return (imageData.regionXStart, imageData.regionYStart, imageData.regionWidth, imageData.regionHeight)
+
+def iterGrimoireCards(grimoireDefinition):
+	for themeData in grimoireDefinition.themes:
+		for pageData in themeData.pages:
+			for cardData in pageData.cards:
+				yield cardData
+
+def groupGrimoireCardsBySheet(grimoireDefinition):
+	if grimoireDefinition.sheets is not None:
+		return grimoireDefinition.sheets
+
+	cardsBySheet = collections.OrderedDict()
+	for cardData in iterGrimoireCards(grimoireDefinition):
+		addCardToSheetIndex(cardsBySheet, cardData)
+	return cardsBySheet
+
+CardImage = collections.namedtuple('CardImage', ['fileName', 'content'])
+
+def createCardImage(content, imageExtension):
+	return CardImage(fileName='%s%s' % (hashlib.sha1(content).hexdigest(), imageExtension), content=content)
+
+def getCardImageFormat(cardImage, sheetFormat):
+	if sheetFormat != 'PNG':
+		return sheetFormat
+	if cardImage.mode in ('RGBA', 'LA'):
+		isOpaque = cardImage.split()[-1].getextrema() == (255, 255)
+	else:
+		isOpaque = 'transparency' not in cardImage.info
+	return 'JPEG' if isOpaque else sheetFormat
 
-def generateCardImageFromImageSheet(imageBaseFileName, sheetImagePath, localImageFolder, dimensions_tuple):
-	generatedImagePath = os.path.join(localImageFolder, '%s%s' % (imageBaseFileName, os.path.splitext(sheetImagePath)[1]))
+def generateCardImagesFromImageSheet(sheetImagePath, cardRegions, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	logging.debug('Cutting %d card images from %s' % (len(cardRegions), sheetImagePath))
+	cardImages = {}
 
-	sheetImage = Image.open(sheetImagePath)
-	cardImage = sheetImage.crop((dimensions_tuple[0], dimensions_tuple[1], dimensions_tuple[0] + dimensions_tuple[2], dimensions_tuple[1] + dimensions_tuple[3]))
-	cardImage.save(generatedImagePath, optimize=True)
+	with traceSpan('decodeSheet', 'sheet', sheet=str(sheetImagePath)):
+		sheetImage = openSheetImage(sheetImagePath)
+		sheetImage.load()
+	try:
+		for imageBaseFileName, dimensions_tuple in cardRegions:
+			with traceSpan('cropCard', 'card', card=imageBaseFileName):
+				cardImage = sheetImage.crop((dimensions_tuple[0], dimensions_tuple[1], dimensions_tuple[0] + dimensions_tuple[2], dimensions_tuple[1] + dimensions_tuple[3]))
+				cardImageFormat = getCardImageFormat(cardImage, sheetImage.format)
+				if cardImageFormat != sheetImage.format and cardImage.mode not in ('RGB', 'L'):
+					cardImage = cardImage.convert('RGB')
+				cardImageBuffer = io.BytesIO()
+				cardImage.save(cardImageBuffer, format=cardImageFormat, **CARD_IMAGE_ENCODE_PROFILES[encodeProfile].get(cardImageFormat, {}))
+				cardImages[imageBaseFileName] = createCardImage(cardImageBuffer.getvalue(), CARD_IMAGE_FORMAT_EXTENSIONS.get(cardImageFormat, getSheetSourceExtension(sheetImagePath)))
+	finally:
+		sheetImage.close()
 
-	return generatedImagePath
+	return cardImages
+
+def generateCardImageFromImageSheet(imageBaseFileName, sheetImagePath, dimensions_tuple):
+	return generateCardImagesFromImageSheet(sheetImagePath, [(imageBaseFileName, dimensions_tuple)])[imageBaseFileName]
+
+def getCardImageCacheKey(sheetChecksum, dimensions_tuple, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	return hashlib.sha1('%s.%d.%d.%d.%d.%s' % ((sheetChecksum,) + tuple(dimensions_tuple) + (json.dumps(CARD_IMAGE_ENCODE_PROFILES[encodeProfile], sort_keys=True),))).hexdigest()
+
+def getCachedCardImageExtension(cachedImage, sheetImageExtension):
+	cachedImageFormat = imghdr.what(None, cachedImage)
+	return CARD_IMAGE_FORMAT_EXTENSIONS.get(cachedImageFormat.upper() if cachedImageFormat else None, sheetImageExtension)
+
+def generateCachedCardImagesFromImageSheet(sheetImagePath, cardRegions, cropCacheFolder=None, sheetChecksum=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	if cropCacheFolder is None:
+		return generateCardImagesFromImageSheet(sheetImagePath, cardRegions, encodeProfile)
+	if sheetChecksum is None:
+		sheetChecksum = getSheetSourceChecksum(sheetImagePath)
+
+	imageExtension = getSheetSourceExtension(sheetImagePath)
+	cardImages = {}
+	cachedImagePaths = {}
+	regionsToGenerate = []
+	for imageBaseFileName, dimensions_tuple in cardRegions:
+		cachedImagePaths[imageBaseFileName] = os.path.join(cropCacheFolder, '%s%s' % (getCardImageCacheKey(sheetChecksum, dimensions_tuple, encodeProfile), imageExtension))
+		if os.path.exists(cachedImagePaths[imageBaseFileName]):
+			with open(cachedImagePaths[imageBaseFileName], 'rb') as cachedImageFile:
+				cachedImage = cachedImageFile.read()
+				cardImages[imageBaseFileName] = createCardImage(cachedImage, getCachedCardImageExtension(cachedImage, imageExtension))
+		else:
+			regionsToGenerate.append((imageBaseFileName, dimensions_tuple))
+
+	if regionsToGenerate:
+		for imageBaseFileName, cardImage in generateCardImagesFromImageSheet(sheetImagePath, regionsToGenerate, encodeProfile).items():
+			partialImagePath = '%s.%d.part' % (cachedImagePaths[imageBaseFileName], os.getpid())
+			with open(partialImagePath, 'wb') as cachedImageFile:
+				cachedImageFile.write(cardImage.content)
+			os.rename(partialImagePath, cachedImagePaths[imageBaseFileName])
+			cardImages[imageBaseFileName] = cardImage
+
+	return cardImages
+
+def generateCardImagesFromImageSheetTask(sheetTask):
+	with traceSpan('cropSheet', 'sheet', sheet=str(sheetTask[0]), cards=len(sheetTask[1])):
+		return generateCachedCardImagesFromImageSheet(*sheetTask)
+
+def generateCardImagesFromImageSheetPoolTask(sheetTask):
+	sheetCardImages = generateCardImagesFromImageSheetTask(sheetTask)
+	return (sheetCardImages, activeTracer.drainEvents() if activeTracer is not None else [])
+
+def getSheetCardRegions(sheetCards, reusableCardImages):
+	cardRegions = []
+	cardHashes = {}
+	regionImages = {}
+	for cardData in sheetCards:
+		if cardData.hash not in reusableCardImages:
+			dimensions_tuple = getCardImageDimensions(cardData.image)
+			if dimensions_tuple not in regionImages:
+				regionImages[dimensions_tuple] = '%s_img' % getGrimoireCardFileName(cardData)
+				cardRegions.append((regionImages[dimensions_tuple], dimensions_tuple))
+			cardHashes.setdefault(regionImages[dimensions_tuple], []).append(cardData.hash)
+	return cardRegions, cardHashes
+
+def iterGrimoireCardImages(grimoireDefinition, imagesFolder, cropCacheFolder=None, poolSize=DEFAULT_CROP_POOL_SIZE, sheetManifest=None, reusableCardImages=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	logging.info('Generating Grimoire card images')
+	sheetStore = getSheetStore(imagesFolder)
+	reusableCardImages = reusableCardImages or {}
+	cardHashes = {}
+	sheetTasks = []
+
+	if cropCacheFolder is not None and not os.path.exists(cropCacheFolder):
+		os.makedirs(cropCacheFolder)
+
+	for sheetURL, sheetCards in groupGrimoireCardsBySheet(grimoireDefinition).items():
+		cardRegions, sheetCardHashes = getSheetCardRegions(sheetCards, reusableCardImages)
+		cardHashes.update(sheetCardHashes)
+		if cardRegions:
+			sheetChecksum = (sheetManifest or {}).get(sheetURL, {}).get('checksum')
+			sheetTasks.append((sheetStore.getSheetSource(sheetURL), cardRegions, cropCacheFolder, sheetChecksum, encodeProfile))
+	sheetTasks.sort(key=lambda sheetTask: len(sheetTask[1]), reverse=True)
+
+	for cardHash, cardImage in reusableCardImages.items():
+		yield cardHash, cardImage
+
+	if poolSize > 1:
+		cropPool = multiprocessing.Pool(min(poolSize, len(sheetTasks)) or 1, initializer=clearTraceEvents)
+		try:
+			for sheetCardImages, traceEvents in cropPool.imap_unordered(generateCardImagesFromImageSheetPoolTask, sheetTasks):
+				if activeTracer is not None:
+					activeTracer.addEvents(traceEvents)
+				for imageBaseFileName, cardImage in sheetCardImages.items():
+					for cardHash in cardHashes[imageBaseFileName]:
+						yield cardHash, cardImage
+		finally:
+			cropPool.close()
+			cropPool.join()
+	else:
+		for sheetTask in sheetTasks:
+			for imageBaseFileName, cardImage in generateCardImagesFromImageSheetTask(sheetTask).items():
+				for cardHash in cardHashes[imageBaseFileName]:
+					yield cardHash, cardImage
+
+def generateGrimoireCardImages(grimoireDefinition, imagesFolder, cropCacheFolder=None, poolSize=DEFAULT_CROP_POOL_SIZE, sheetManifest=None, reusableCardImages=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	return dict(iterGrimoireCardImages(grimoireDefinition, imagesFolder, cropCacheFolder, poolSize, sheetManifest, reusableCardImages, encodeProfile))
+
+def streamGrimoireCardImages(bookWriter, cardImages):
+	writtenCardImages = {}
+	for cardHash, cardImage in cardImages:
+		bookWriter.add_item(createCardImageItem(os.path.splitext(cardImage.fileName)[0], cardImage))
+		writtenCardImages[cardHash] = cardImage._replace(content=None)
+	return writtenCardImages
+
+def getGrimoireCardDigest(cardData, sheetManifest=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	return hashlib.sha1(json.dumps([cardData.cardName, cardData.cardIntro, cardData.cardDescription,
+									cardData.image.sourceImage, getCardImageDimensions(cardData.image),
+									(sheetManifest or {}).get(cardData.image.sourceImage, {}).get('checksum'),
+									CARD_IMAGE_ENCODE_PROFILES[encodeProfile]], sort_keys=True)).hexdigest()
+
+def loadBuildState(buildStateFile):
+	try:
+		with open(buildStateFile) as buildStateData:
+			return json.load(buildStateData)
+	except (IOError, ValueError):
+		return { 'cards' : {} }
+
+def saveBuildState(buildStateFile, buildState):
+	if not os.path.exists(os.path.dirname(buildStateFile)):
+		os.makedirs(os.path.dirname(buildStateFile))
+
+	with open(buildStateFile + '.part', 'w') as buildStateData:
+		json.dump(buildState, buildStateData, sort_keys=True)
+	os.rename(buildStateFile + '.part', buildStateFile)
+
+def createGrimoireBuildState(grimoireDefinition, sheetManifest, cardImages, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	return { 'cards' : dict((cardData.hash, { 'digest' : getGrimoireCardDigest(cardData, sheetManifest, encodeProfile),
+												'page' : '%s.xhtml' % getGrimoireCardFileName(cardData),
+												'image' : os.path.join('images', cardImages[cardData.hash].fileName) })
+							for cardData in iterGrimoireCards(grimoireDefinition)) }
+
+def openPreviousBook(bookFile):
+	try:
+		return zipfile.ZipFile(bookFile)
+	except (IOError, zipfile.BadZipfile):
+		return None
+
+def findReusableCardImageFiles(cards, buildState, previousBook, sheetManifest=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	reusableCardImageFiles = collections.OrderedDict()
+	for cardData in cards:
+		previousCard = buildState['cards'].get(cardData.hash)
+		if previousCard is not None and 'EPUB/%s' % previousCard['image'] in previousBook.NameToInfo and previousCard['digest'] == getGrimoireCardDigest(cardData, sheetManifest, encodeProfile):
+			reusableCardImageFiles[cardData.hash] = previousCard['image']
+	return reusableCardImageFiles
+
+def readReusableCardImages(cards, buildState, previousBook, sheetManifest=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	return dict(ReusableCardImages(previousBook, findReusableCardImageFiles(cards, buildState, previousBook, sheetManifest, encodeProfile)).items())
+
+class ReusableCardImages(object):
+	def __init__(self, previousBook=None, cardImageFiles=None):
+		self.previousBook = previousBook
+		self.cardImageFiles = cardImageFiles or {}
+
+	def __contains__(self, cardHash):
+		return cardHash in self.cardImageFiles
+
+	def __len__(self):
+		return len(self.cardImageFiles)
+
+	def items(self):
+		for cardHash, cardImageFile in self.cardImageFiles.items():
+			yield cardHash, CardImage(fileName=os.path.basename(cardImageFile), content=self.previousBook.read('EPUB/%s' % cardImageFile))
+
+	def close(self):
+		if self.previousBook is not None:
+			self.previousBook.close()
+
+def loadReusableCardImages(grimoireDefinition, buildState, bookFile, sheetManifest=None, encodeProfile=DEFAULT_ENCODE_PROFILE):
+	previousBook = openPreviousBook(bookFile)
+	if previousBook is None:
+		logging.info('No previous Grimoire ebook to reuse, rebuilding every card')
+		return ReusableCardImages()
+
+	reusableCardImages = ReusableCardImages(previousBook, findReusableCardImageFiles(iterGrimoireCards(grimoireDefinition), buildState, previousBook, sheetManifest, encodeProfile))
+
+	currentCards = set(cardData.hash for cardData in iterGrimoireCards(grimoireDefinition))
+	addedCards = len(currentCards - set(buildState['cards']))
+	logging.info('Incremental rebuild: %d cards added, %d changed, %d removed, %d reused' % (addedCards, len(currentCards) - addedCards - len(reusableCardImages), len(set(buildState['cards']) - currentCards), len(reusableCardImages)))
+	return reusableCardImages
+
+class PendingCardImages(object):
+	def __init__(self):
+		self.cardImages = {}
+		self.condition = threading.Condition()
+		self.finished = False
+		self.error = None
+
+	def add(self, cardImages):
+		with self.condition:
+			self.cardImages.update(cardImages)
+			self.condition.notify_all()
+
+	def finish(self, error=None):
+		with self.condition:
+			self.finished = True
+			self.error = error
+			self.condition.notify_all()
+
+	def get(self, cardHash, default=None):
+		with self.condition:
+			while cardHash not in self.cardImages and not self.finished:
+				self.condition.wait(PIPELINE_WAIT_INTERVAL)
+			if cardHash not in self.cardImages:
+				if self.error is not None:
+					raise self.error
+				return default
+			cardImage = self.cardImages[cardHash]
+			self.cardImages[cardHash] = cardImage._replace(content=None)
+			return cardImage
+
+	def __getitem__(self, cardHash):
+		cardImage = self.get(cardHash)
+		if cardImage is None:
+			raise KeyError(cardHash)
+		return cardImage
+
+class GrimoireCardPipeline(object):
+	def __init__(self, grimoireDefinition, imagesFolder, cropCacheFolder=None, downloadPoolSize=DEFAULT_DOWNLOAD_POOL_SIZE, cropPoolSize=DEFAULT_CROP_POOL_SIZE,
+				revalidateCachedSheets=True, buildState=None, bookFile=None, encodeProfile=DEFAULT_ENCODE_PROFILE, queueSize=DEFAULT_PIPELINE_QUEUE_SIZE):
+		self.cardsBySheet = groupGrimoireCardsBySheet(grimoireDefinition)
+		self.imagesFolder = imagesFolder
+		self.cropCacheFolder = cropCacheFolder
+		self.downloadPoolSize = max(1, min(downloadPoolSize, len(self.cardsBySheet)))
+		self.cropPoolSize = max(1, cropPoolSize)
+		self.revalidateCachedSheets = revalidateCachedSheets
+		self.buildState = buildState
+		self.bookFile = bookFile
+		self.encodeProfile = encodeProfile
+		self.cardImages = PendingCardImages()
+		self.sheetURLs = Queue.Queue()
+		self.downloadedSheets = Queue.Queue(queueSize)
+		self.stopped = threading.Event()
+		self.manifestLock = threading.Lock()
+		self.previousBookLock = threading.Lock()
+		self.failedDownloads = {}
+		self.cropErrors = []
+		self.threads = []
+
+	def start(self):
+		logging.info('Downloading Grimoire images and cutting card images as they arrive')
+		if not os.path.exists(self.imagesFolder):
+			os.makedirs(self.imagesFolder)
+		if self.cropCacheFolder is not None and not os.path.exists(self.cropCacheFolder):
+			os.makedirs(self.cropCacheFolder)
+
+		self.manifest = loadSheetManifest(self.imagesFolder)
+		unpackGrimoireSheets(self.imagesFolder, self.manifest, self.cardsBySheet)
+		self.previousBook = openPreviousBook(self.bookFile) if self.buildState is not None and self.bookFile is not None else None
+		self.session = createBungieSession(self.downloadPoolSize)
+		self.cropPool = multiprocessing.Pool(self.cropPoolSize, initializer=clearTraceEvents) if self.cropPoolSize > 1 else None
+		for sheetURL in self.cardsBySheet:
+			self.sheetURLs.put(sheetURL)
+
+		self.downloadThreads = [threading.Thread(target=self.downloadSheets) for downloadThread in range(self.downloadPoolSize)]
+		self.cropThreads = [threading.Thread(target=self.cropSheets) for cropThread in range(self.cropPoolSize)]
+		self.threads = self.downloadThreads + self.cropThreads + [threading.Thread(target=self.finish)]
+		for thread in self.threads:
+			thread.daemon = True
+			thread.start()
+
+	def downloadSheets(self):
+		while not self.stopped.is_set():
+			try:
+				sheetURL = self.sheetURLs.get_nowait()
+			except Queue.Empty:
+				return
+			self.downloadedSheets.put(tryDownloadGrimoireSheet(self.session, sheetURL, self.imagesFolder, self.manifest.get(sheetURL), self.revalidateCachedSheets))
+
+	def cropSheets(self):
+		while True:
+			downloadedSheet = self.downloadedSheets.get()
+			if downloadedSheet is None:
+				return
+			sheetURL, manifestEntry, error = downloadedSheet
+			with self.manifestLock:
+				if error is None:
+					self.manifest[sheetURL] = manifestEntry
+				else:
+					self.failedDownloads[sheetURL] = error
+					self.manifest.pop(sheetURL, None)
+			if error is None and not self.stopped.is_set():
+				try:
+					self.cardImages.add(self.cropSheet(sheetURL, manifestEntry))
+				except Exception as cropError:
+					logging.exception('Failed to cut card images from %s' % sheetURL)
+					self.cropErrors.append(cropError)
+
+	def cropSheet(self, sheetURL, manifestEntry):
+		sheetCards = self.cardsBySheet[sheetURL]
+		cardImages = {}
+		if self.previousBook is not None:
+			with self.previousBookLock:
+				cardImages.update(readReusableCardImages(sheetCards, self.buildState, self.previousBook, { sheetURL : manifestEntry }, self.encodeProfile))
+
+		cardRegions, cardHashes = getSheetCardRegions(sheetCards, cardImages)
+		if cardRegions:
+			sheetTask = (os.path.join(self.imagesFolder, os.path.basename(sheetURL)), cardRegions, self.cropCacheFolder, manifestEntry.get('checksum'), self.encodeProfile)
+			if self.cropPool is not None:
+				sheetCardImages, traceEvents = self.cropPool.apply(generateCardImagesFromImageSheetPoolTask, (sheetTask,))
+				if activeTracer is not None:
+					activeTracer.addEvents(traceEvents)
+			else:
+				sheetCardImages = generateCardImagesFromImageSheetTask(sheetTask)
+			for imageBaseFileName, cardImage in sheetCardImages.items():
+				cardImages.update((cardHash, cardImage) for cardHash in cardHashes[imageBaseFileName])
+		return cardImages
+
+	def finish(self):
+		error = None
+		try:
+			for downloadThread in self.downloadThreads:
+				downloadThread.join()
+			for cropThread in self.cropThreads:
+				self.downloadedSheets.put(None)
+			for cropThread in self.cropThreads:
+				cropThread.join()
+		finally:
+			if self.cropPool is not None:
+				self.cropPool.close()
+				self.cropPool.join()
+			if self.previousBook is not None:
+				self.previousBook.close()
+			self.session.close()
+			self.manifest = dict((sheetURL, self.manifest[sheetURL]) for sheetURL in self.cardsBySheet if sheetURL in self.manifest)
+			saveSheetManifest(self.imagesFolder, self.manifest)
+			if self.failedDownloads:
+				error = DestinyContentAPIClientError(DestinyContentAPIClientError.SHEET_DOWNLOAD_FAILED_ERROR_MSG % (len(self.failedDownloads), ', '.join(sorted(self.failedDownloads))))
+			elif self.cropErrors:
+				error = self.cropErrors[0]
+			self.cardImages.finish(error)
+
+	def join(self):
+		for thread in self.threads:
+			thread.join()
+		if self.cardImages.error is not None:
+			raise self.cardImages.error
+		return self.manifest
+
+	def stop(self):
+		self.stopped.set()
+		for thread in self.threads:
+			thread.join()
 
 def generateGrimoirePageContent(pageData, pageImagePath):
 	return u'''<cardname">%s</cardname>
@@ -123,46 +1978,273 @@ def generateGrimoirePageContent(pageData, pageImagePath):
 			   <container>
 				<cardimage><img src="%s"/></cardimage>
 				<carddescription">%s</carddescription>
-			   </container>''' % ( pageData["cardName"], pageData["cardIntro"], pageImagePath, pageData["cardDescription"] )
+			   </container>''' % ( pageData.cardName, pageData.cardIntro, pageImagePath, pageData.cardDescription )
 
-def generateGrimoirePageImage(cardFileName, imageData, imagesFolder):
+def generateGrimoirePageImage(cardFileName, imageData, imagesFolder, cardImage=None):
 	imageBaseFileName = '%s_img' % (cardFileName)
-	imagePath = generateCardImageFromImageSheet(imageBaseFileName, os.path.join(imagesFolder, os.path.basename(imageData["sourceImage"])),imagesFolder, (imageData["regionXStart"], imageData["regionYStart"], imageData["regionWidth"], imageData["regionHeight"]))
-	epubImageFile = os.path.join('images', os.path.basename(imagePath))
-	return epub.EpubItem(uid=imageBaseFileName, file_name=epubImageFile, content=open(imagePath, 'rb').read())
+	if cardImage is None:
+		cardImage = generateCardImageFromImageSheet(imageBaseFileName, os.path.join(imagesFolder, os.path.basename(imageData.sourceImage)), getCardImageDimensions(imageData))
+	return createCardImageItem(imageBaseFileName, cardImage)
 
-def createGrimoireCardPage(cardData, bookPageCSS):
-	fileName = '%s-%s' % (cardData["hash"], re.sub(r"[^\d\w]","_", cardData["cardName"]))
-	bookPage = epub.EpubHtml(title=cardData["cardName"], file_name='%s.%s' % (fileName, 'xhtml'), lang='en', content="")
+def createCardImageItem(imageBaseFileName, cardImage):
+	return epub.EpubItem(uid=imageBaseFileName, file_name=os.path.join('images', cardImage.fileName), content=cardImage.content)
+
+def createGrimoireCardPage(cardData, bookPageCSS, cardImages=None, language='en'):
+	fileName = getGrimoireCardFileName(cardData)
+	bookPage = epub.EpubHtml(title=cardData.cardName, file_name='%s.%s' % (fileName, 'xhtml'), lang=language, content="")
 	bookPage.add_item(bookPageCSS)
-	pageImage = generateGrimoirePageImage(fileName, cardData["image"], DEFAULT_IMAGE_FOLDER)
+	pageImage = generateGrimoirePageImage(fileName, cardData.image, DEFAULT_IMAGE_FOLDER, (cardImages or {}).get(cardData.hash))
 	bookPage.content = generateGrimoirePageContent(cardData, pageImage.file_name)
 	return collections.namedtuple('GrimoirePage', ['page', 'image'])(page=bookPage, image=pageImage)
 
-def addPageItemsToEbook(ebook, pageData):
-	pageCards = ()
-	for cardData in pageData['cards']:
-		cardPageData = createGrimoireCardPage(cardData, epub.EpubItem(uid="style_default", file_name="style/default.css", media_type="text/css", content=DEFAULT_PAGE_STYLE))
+BookAssets = collections.namedtuple('BookAssets', ['style', 'addedFiles'])
+
+def createBookAssets():
+	return BookAssets(style=epub.EpubItem(uid="style_default", file_name="style/default.css", media_type="text/css", content=DEFAULT_PAGE_STYLE), addedFiles=set())
+
+def addPageItemsToEbook(ebook, pageData, cardImages=None, bookAssets=None, language='en'):
+	bookAssets = bookAssets or createBookAssets()
+	pageCards = []
+	for cardData in pageData.cards:
+		cardPageData = createGrimoireCardPage(cardData, bookAssets.style, cardImages, language)
 		ebook.add_item(cardPageData.page)
-		ebook.add_item(cardPageData.image)
+		if cardPageData.image.file_name not in bookAssets.addedFiles:
+			bookAssets.addedFiles.add(cardPageData.image.file_name)
+			ebook.add_item(cardPageData.image)
 		ebook.spine.append(cardPageData.page)
-		pageCards = pageCards + (cardPageData.page,)
-	return pageCards
+		pageCards.append(cardPageData.page)
+	return tuple(pageCards)
+
+def addThemePagesToEbook(ebook, themeData, cardImages=None, bookAssets=None, language='en'):
+	bookAssets = bookAssets or createBookAssets()
+	themePages = []
+	for pageData in themeData.pages:
+		themePages.append((epub.Section(pageData.pageName), addPageItemsToEbook(ebook, pageData, cardImages, bookAssets, language)))
+	return tuple(themePages)
+
+def addThemeSetsToEbook(ebook, grimoireData, cardImages=None, bookAssets=None, language='en'):
+	bookAssets = bookAssets or createBookAssets()
+	themes = []
+	for themeData in grimoireData.themes:
+		themes.append((epub.Section(themeData.themeName), addThemePagesToEbook(ebook, themeData, cardImages, bookAssets, language)))
+	return tuple(themes)
+
+def iterGrimoireKeywords(searchIndex):
+	for term in sorted(searchIndex.postings):
+		postings = searchIndex.postings[term]
+		if len(term) >= KEYWORD_INDEX_MIN_TERM_LENGTH and len(postings) <= KEYWORD_INDEX_MAX_CARDS and not term.isdigit():
+			yield term, [searchIndex.cards[cardId] for cardId in postings]
+
+def generateKeywordIndexContent(initial, keywords):
+	keywordEntries = u''.join(u'<p><b>%s</b>: %s</p>' % (cgi.escape(term), u', '.join(u'<a href="%s.xhtml">%s</a>' % (cgi.escape(getGrimoireCardFileName(hit), True), cgi.escape(hit.cardName)) for hit in hits))
+								for term, hits in keywords)
+	return u'<h2>%s</h2>%s' % (cgi.escape(initial), keywordEntries)
+
+def addKeywordIndexToEbook(ebook, grimoireData, bookAssets=None, language='en'):
+	bookAssets = bookAssets or createBookAssets()
+	keywordsByInitial = collections.OrderedDict()
+	for term, hits in iterGrimoireKeywords(indexGrimoireDefinition(grimoireData)):
+		keywordsByInitial.setdefault(term[0].upper() if term[0].isalpha() else u'#', []).append((term, hits))
+
+	keywordPages = []
+	for initial, keywords in keywordsByInitial.items():
+		keywordPage = epub.EpubHtml(title=u'Keywords: %s' % initial, file_name='keywords_%02d.xhtml' % (len(keywordPages) + 1), lang=language, content=generateKeywordIndexContent(initial, keywords))
+		keywordPage.add_item(bookAssets.style)
+		ebook.add_item(keywordPage)
+		ebook.spine.append(keywordPage)
+		keywordPages.append(keywordPage)
+	return ((epub.Section('Keyword index'), tuple(keywordPages)),) if keywordPages else ()
+
+class PinnedTimeZipFile(zipfile.ZipFile):
+	OPF_MODIFIED_PATTERN = re.compile(r'(<meta property="dcterms:modified">)[^<]*(</meta>)')
+
+	def __init__(self, buildTime, *args, **kwargs):
+		zipfile.ZipFile.__init__(self, *args, **kwargs)
+		self.dateTime = time.gmtime(buildTime)[:6]
+		self.modified = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(buildTime))
+
+	def writestr(self, zinfo_or_arcname, bytes, compress_type=None):
+		if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+			zinfo_or_arcname = zipfile.ZipInfo(zinfo_or_arcname, self.dateTime)
+			zinfo_or_arcname.compress_type = self.compression if compress_type is None else compress_type
+			zinfo_or_arcname.external_attr = 0644 << 16
+			compress_type = None
+		if zinfo_or_arcname.filename.endswith('.opf'):
+			bytes = self.OPF_MODIFIED_PATTERN.sub(r'\g<1>%s\g<2>' % self.modified, bytes)
+		zipfile.ZipFile.writestr(self, zinfo_or_arcname, bytes, compress_type)
+
+def openArchive(archiveFile, buildTime=None):
+	if buildTime is None:
+		return zipfile.ZipFile(archiveFile, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+	return PinnedTimeZipFile(buildTime, archiveFile, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+class StreamingEpubWriter(object):
+	def __init__(self, name, book, options=None, buildTime=None):
+		self.epubWriter = epub.EpubWriter(name, book, options)
+		self.file_name = name
+		self.book = book
+		self.partialFileName = name + '.part'
+		self.writtenFiles = set()
+		self.buildTime = buildTime
+
+	@property
+	def spine(self):
+		return self.book.spine
+
+	def open(self):
+		if not os.path.exists(os.path.dirname(self.file_name)):
+			os.makedirs(os.path.dirname(self.file_name))
 
-def addThemePagesToEbook(ebook, themeData):
-	themePages = ()
-	for pageData in themeData['pages']:
-		themePages = themePages + ((epub.Section(pageData['pageName']), addPageItemsToEbook(ebook, pageData)),)
-	return themePages
+		self.out = self.epubWriter.out = openArchive(self.partialFileName, self.buildTime)
+		self.out.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+		self.epubWriter._write_container()
 
-def addThemeSetsToEbook(ebook, grimoireData):
-	themes = ()
-	for themeData in grimoireData['themes']:
-		themes = themes + ((epub.Section(themeData['themeName']), addThemePagesToEbook(ebook, themeData)),)
-	return themes
+	def add_item(self, item):
+		if item.file_name in self.writtenFiles:
+			return
+		self.book.add_item(item)
+		self.writeItem(item)
+
+	def writeItem(self, item):
+		self.out.writestr('%s/%s' % (self.book.FOLDER_NAME, item.file_name), item.get_content())
+		self.writtenFiles.add(item.file_name)
+		item.content = None
+
+	def close(self):
+		self.epubWriter._write_opf_file()
+		for item in self.book.get_items():
+			if item.file_name in self.writtenFiles:
+				continue
+			if isinstance(item, epub.EpubNcx):
+				self.out.writestr('%s/%s' % (self.book.FOLDER_NAME, item.file_name), self.epubWriter._get_ncx())
+			elif isinstance(item, epub.EpubNav):
+				self.out.writestr('%s/%s' % (self.book.FOLDER_NAME, item.file_name), self.epubWriter._get_nav(item))
+			else:
+				self.writeItem(item)
+		self.out.close()
+		os.rename(self.partialFileName, self.file_name)
+
+	def abort(self):
+		self.out.close()
+		if os.path.exists(self.partialFileName):
+			os.remove(self.partialFileName)
+
+def getStoredEntryOffset(archive, entryInfo):
+	if entryInfo.compress_type != zipfile.ZIP_STORED:
+		raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SNAPSHOT_ERROR_MSG % (archive.filename, '%s is compressed' % entryInfo.filename))
+	archive.fp.seek(entryInfo.header_offset)
+	fileHeader = struct.unpack(zipfile.structFileHeader, archive.fp.read(zipfile.sizeFileHeader))
+	return entryInfo.header_offset + zipfile.sizeFileHeader + fileHeader[zipfile._FH_FILENAME_LENGTH] + fileHeader[zipfile._FH_EXTRA_FIELD_LENGTH]
+
+class GrimoireSnapshot(object):
+	def __init__(self, snapshotFile):
+		self.snapshotFile = snapshotFile
+		try:
+			with zipfile.ZipFile(snapshotFile) as snapshot:
+				index = json.loads(snapshot.read(SNAPSHOT_INDEX_ENTRY_NAME))
+				if index.get('version') != SNAPSHOT_FORMAT_VERSION:
+					raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SNAPSHOT_ERROR_MSG % (snapshotFile, 'unsupported version %s' % index.get('version')))
+				self.created = index['created']
+				self.definitions = index['definitions']
+				self.sheets = dict((sheetURL, StoredSheet(snapshotFile, sheetEntry['entry'], getStoredEntryOffset(snapshot, snapshot.getinfo(sheetEntry['entry'])), sheetEntry['size']))
+								for sheetURL, sheetEntry in index['sheets'].items())
+				self.checksums = dict((sheetURL, sheetEntry['checksum']) for sheetURL, sheetEntry in index['sheets'].items())
+		except (IOError, KeyError, ValueError, zipfile.BadZipfile) as error:
+			raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SNAPSHOT_ERROR_MSG % (snapshotFile, error))
+
+	def getLocales(self):
+		return [locale or None for locale in sorted(self.definitions)]
+
+	def loadDefinitions(self, locales=None, searchIndexes=None):
+		definitionsByLocale = collections.OrderedDict()
+		with zipfile.ZipFile(self.snapshotFile) as snapshot:
+			for locale in (locales or [None]):
+				if (locale or '') not in self.definitions:
+					raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SNAPSHOT_ERROR_MSG % (self.snapshotFile, 'no definition for locale %s, it holds %s' % (locale, ', '.join(str(snapshotLocale) for snapshotLocale in self.getLocales()))))
+				with traceSpan('parseDefinition', locale=locale), contextlib.closing(snapshot.open(self.definitions[locale or ''])) as definitionFile:
+					definitionsByLocale[locale] = getDestinyGrimoireDefinitionFromStream(iter(lambda: definitionFile.read(DOWNLOAD_CHUNK_SIZE), b''), (searchIndexes or {}).get(locale))
+		return definitionsByLocale
+
+	def getSheetManifest(self):
+		return dict((sheetURL, { 'checksum' : checksum, 'size' : self.sheets[sheetURL].size }) for sheetURL, checksum in self.checksums.items())
+
+	def getSheetSource(self, sheetURL):
+		try:
+			return self.sheets[sheetURL]
+		except KeyError:
+			raise DestinyContentAPIClientError(DestinyContentAPIClientError.INVALID_SNAPSHOT_ERROR_MSG % (self.snapshotFile, 'missing sheet %s' % sheetURL))
+
+def getSnapshotSheetEntryName(sheetURL):
+	sheetLocation = urlparse.urlsplit(sheetURL)
+	return '%s/%s%s' % (SNAPSHOT_SHEETS_FOLDER_NAME, sheetLocation.netloc, sheetLocation.path)
+
+def exportGrimoireSnapshot(apiKey, snapshotFile, locales=None, streamDefinition=False, downloadPoolSize=DEFAULT_DOWNLOAD_POOL_SIZE, revalidateCachedSheets=True):
+	definitionsByLocale = loadDestinyGrimoireDefinitions(apiKey, locales or [None], streamDefinition)
+	mergedDefinition = mergeGrimoireDefinitions(definitionsByLocale.values())
+	with traceSpan('downloadSheets'):
+		sheetManifest = dowloadGrimoireImages(mergedDefinition, downloadPoolSize, revalidateCachedSheets)
+
+	created = int(time.time())
+	index = { 'version' : SNAPSHOT_FORMAT_VERSION, 'created' : created, 'definitions' : {}, 'sheets' : {} }
+	with traceSpan('writeSnapshot'), contextlib.closing(openArchive(snapshotFile + '.part', created)) as snapshot:
+		for locale in definitionsByLocale:
+			index['definitions'][locale or ''] = getGrimoireEditionFile(SNAPSHOT_DEFINITION_ENTRY_NAME, locale)
+			with open(getGrimoireDefinitionCachePaths(locale)[0], 'rb') as definitionFile:
+				snapshot.writestr(index['definitions'][locale or ''], definitionFile.read())
+		for sheetURL in sorted(groupGrimoireCardsBySheet(mergedDefinition)):
+			sheetEntryName = getSnapshotSheetEntryName(sheetURL)
+			with open(getSheetPath(sheetURL, DEFAULT_IMAGE_FOLDER), 'rb') as sheetFile:
+				snapshot.writestr(sheetEntryName, sheetFile.read(), zipfile.ZIP_STORED)
+			index['sheets'][sheetURL] = { 'entry' : sheetEntryName, 'checksum' : sheetManifest[sheetURL]['checksum'], 'size' : sheetManifest[sheetURL]['size'] }
+		snapshot.writestr(SNAPSHOT_INDEX_ENTRY_NAME, json.dumps(index, indent=1, sort_keys=True))
+	os.rename(snapshotFile + '.part', snapshotFile)
+	return index
+
+class GrimoireTracer(object):
+	def __init__(self):
+		self.startTime = time.time()
+		self.events = []
+		self.lock = threading.Lock()
+
+	def addSpan(self, name, category, start, end, args):
+		self.addEvents([{ 'name' : name, 'cat' : category, 'ph' : 'X',
+						'ts' : int((start - self.startTime) * 1000000), 'dur' : int((end - start) * 1000000),
+						'pid' : os.getpid(), 'tid' : threading.current_thread().ident, 'args' : args }])
+
+	def addEvents(self, events):
+		with self.lock:
+			self.events.extend(events)
+
+	def drainEvents(self):
+		with self.lock:
+			events, self.events = self.events, []
+		return events
+
+	def save(self, traceFile):
+		with open(traceFile, 'w') as traceData:
+			json.dump({ 'traceEvents' : sorted(self.events, key=lambda event: event['ts']), 'displayTimeUnit' : 'ms' }, traceData)
+
+activeTracer = None
+
+@contextlib.contextmanager
+def traceSpan(name, category='stage', **args):
+	start = time.time()
+	try:
+		yield
+	finally:
+		if activeTracer is not None:
+			activeTracer.addSpan(name, category, start, time.time(), args)
+
+def clearTraceEvents():
+	if activeTracer is not None:
+		activeTracer.drainEvents()
 
 class DestinyContentAPIClientError(Exception):
 	NO_API_KEY_PROVIDED_ERROR_MSG = "No API key provided. One is required to refresh the content cache."
+	SHEET_DOWNLOAD_FAILED_ERROR_MSG = "Failed to download %d Grimoire image sheet(s): %s"
+	INVALID_SNAPSHOT_ERROR_MSG = "Cannot build from Grimoire snapshot %s: %s"
+	NO_SEARCH_INDEX_ERROR_MSG = "No lore search index at %s. Build the ebook with --search-index first."
+	INVALID_SEARCH_INDEX_ERROR_MSG = "Cannot read lore search index %s: %s"
 
 	def __init__(self, value):
 		self.value = value
@@ -170,6 +2252,37 @@ class DestinyContentAPIClientError(Exception):
 	def __str__(self):
 		return self.value
 
+def parseCommandLineArguments(arguments):
+	parser = argparse.ArgumentParser(description='Generate an ebook with the Destiny Grimoire lore.')
+	parser.add_argument('apiKey', nargs='?', help='Bungie API key (not needed when building from a snapshot)')
+	parser.add_argument('--download-workers', dest='downloadPoolSize', type=int, default=DEFAULT_DOWNLOAD_POOL_SIZE, help='number of image sheets downloaded in parallel')
+	parser.add_argument('--skip-cached-sheets', dest='revalidateCachedSheets', action='store_false', help='use cached image sheets without revalidating them against Bungie')
+	parser.add_argument('--no-crop-cache', dest='useCropCache', action='store_false', help='do not read or write the persistent cache of cut card images')
+	parser.add_argument('--crop-workers', dest='cropPoolSize', type=int, default=DEFAULT_CROP_POOL_SIZE, help='number of processes cutting card images from the sheets')
+	parser.add_argument('--full-rebuild', dest='incremental', action='store_false', help='regenerate every card instead of reusing unchanged ones from the previous build')
+	parser.add_argument('--encode-profile', dest='encodeProfile', choices=sorted(CARD_IMAGE_ENCODE_PROFILES), default=DEFAULT_ENCODE_PROFILE, help='trade card image encoding time against ebook size (default %s)' % DEFAULT_ENCODE_PROFILE)
+	parser.add_argument('--pack-sheets', dest='packSheets', action='store_true', help='keep the downloaded image sheets in one memory-mapped pack file and cut the cards from it')
+	parser.add_argument('--overlap-stages', dest='overlapStages', action='store_true', help='cut and assemble cards while the remaining image sheets are still downloading')
+	parser.add_argument('--stream-book', dest='streamBook', action='store_true', help='write every card into the epub as soon as it is ready instead of keeping the whole book in memory')
+	parser.add_argument('--locales', dest='locales', nargs='+', metavar='LOCALE', help='build one ebook per given Bungie locale (e.g. en fr de) sharing the same image sheets and card images')
+	parser.add_argument('--themes-per-volume', dest='themesPerVolume', type=int, default=0, help='split the Grimoire into one ebook per given number of themes instead of a single ebook')
+	parser.add_argument('--volume-workers', dest='volumePoolSize', type=int, default=DEFAULT_VOLUME_POOL_SIZE, help='number of processes building volumes in parallel')
+	parser.add_argument('--index-volume', dest='indexVolume', action='store_true', help='also write an index ebook listing the volumes and their themes')
+	parser.add_argument('--search-index', dest='writeSearchIndex', action='store_true', help='write a full-text index of the card lore while parsing the Grimoire, for use with --search')
+	parser.add_argument('--keyword-index', dest='keywordIndex', action='store_true', help='add a keyword index section linking distinctive lore terms to their cards')
+	parser.add_argument('--search', dest='searchQuery', metavar='QUERY', help='print the cards whose lore matches every word of QUERY (a trailing * matches a prefix) instead of building the ebook')
+	parser.add_argument('--catalog', dest='useCatalog', action='store_true', help='keep the parsed Grimoire in an SQLite catalog and load it from there while Bungie reports it unchanged')
+	parser.add_argument('--stream-definition', dest='streamDefinition', action='store_true', help='parse the Grimoire definition incrementally while it is downloaded')
+	parser.add_argument('--export-snapshot', dest='exportSnapshotFile', metavar='FILE', help='pack the Grimoire definition and every image sheet into a snapshot archive instead of building the ebook')
+	parser.add_argument('--snapshot', dest='snapshotFile', metavar='FILE', help='build offline from a snapshot archive, without contacting Bungie')
+	parser.add_argument('--trace', dest='traceFile', help='write a Chrome trace-event JSON file with the timings of every generation stage')
+	return parser.parse_args(arguments)
+
 if __name__ == "__main__":
 	logging.basicConfig(level=logging.DEBUG)
-	generateGrimoireEbook(sys.argv[1])
\ No newline at end of file
+	arguments = vars(parseCommandLineArguments(sys.argv[1:]))
+	searchQuery = arguments.pop('searchQuery')
+	if searchQuery is not None:
+		printGrimoireSearchResults(searchQuery, arguments['locales'])
+	else:
+		generateGrimoireEbook(**arguments)
\ No newline at end of file
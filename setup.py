@@ -22,7 +22,7 @@ setup(
 	keywords = "destiny bungie lore ebook",
 	packages = find_packages(),
 	cmdclass={"test": PyTest},
-	install_requires=[ 'requests', 'jsonpath-rw', 'Pillow', 'ebooklib'],
+	install_requires=[ 'requests', 'Pillow', 'ebooklib'],
 	tests_require=[ 'pytest', 'mock', 'httpretty'],
 	package_data={
 		'': ['*.jpg']
@@ -7,8 +7,17 @@ import collections
 import os
 import string
 import hashlib
+import tempfile
+import io
+import zipfile
+import pickle
+import time
+import email.utils
+import sys
+import subprocess
 from PIL import Image
 from grimoireebook import DestinyContentAPIClientError
+import ebooklib
 from ebooklib import epub
 from mock import call
 
@@ -22,9 +31,32 @@ def test_shouldTriggerGrimoireEbookGenerationWithDefaultValues(mock_createGrimoi
 	
 	grimoireebook.generateGrimoireEbook(__testApiKey__)
 
-	mock_loadDestinyGrimoireDefinition.assert_called_once_with(__testApiKey__)
+	mock_loadDestinyGrimoireDefinition.assert_called_once_with(__testApiKey__, False)
 	mock_createGrimoireEpub.assert_called_once_with(__dummyGrimoireDefinition__)
 
+@mock.patch('grimoireebook.loadDestinyGrimoireDefinition', autospec = True)
+@mock.patch('grimoireebook.createGrimoireEpub', autospec = True)
+def test_shouldWriteChromeTraceOfGrimoireEbookGeneration(mock_createGrimoireEpub, mock_loadDestinyGrimoireDefinition):
+	traceFile = os.path.join(tempfile.mkdtemp(), 'trace.json')
+	def createTracedGrimoireEpub(grimoireDefinition):
+		with grimoireebook.traceSpan('writeEpub'):
+			pass
+	mock_createGrimoireEpub.side_effect = createTracedGrimoireEpub
+
+	grimoireebook.generateGrimoireEbook(__testApiKey__, traceFile=traceFile)
+
+	traceEvents = json.load(open(traceFile))['traceEvents']
+	assert [event['name'] for event in traceEvents] == ['generateGrimoireEbook', 'writeEpub']
+	assert all(event['ph'] == 'X' and event['pid'] == os.getpid() for event in traceEvents)
+	assert traceEvents[0]['dur'] >= traceEvents[1]['dur']
+	assert grimoireebook.activeTracer is None
+
+def test_shouldNotRecordTraceSpansWithoutActiveTracer():
+	with grimoireebook.traceSpan('untraced'):
+		pass
+
+	assert grimoireebook.activeTracer is None
+
 @mock.patch('grimoireebook.getDestinyGrimoireFromBungie', autospec = True)
 @mock.patch('grimoireebook.getDestinyGrimoireDefinitionFromJson', autospec = True)
 def test_shouldLoadDestinyGrimoireDefinition(mock_getDestinyGrimoireDefinitionFromJson, mock_getDestinyGrimoireFromBungie):
@@ -34,8 +66,20 @@ def test_shouldLoadDestinyGrimoireDefinition(mock_getDestinyGrimoireDefinitionFr
 
 	grimoireDefinition = grimoireebook.loadDestinyGrimoireDefinition(__testApiKey__)
 
-	mock_getDestinyGrimoireFromBungie.assert_called_once_with(__testApiKey__)
-	mock_getDestinyGrimoireDefinitionFromJson.assert_called_once_with(__dummyGrimoireDefinition__)
+	mock_getDestinyGrimoireFromBungie.assert_called_once_with(__testApiKey__, None)
+	mock_getDestinyGrimoireDefinitionFromJson.assert_called_once_with(__dummyGrimoireDefinition__, None)
+
+	assert grimoireDefinition == __dummyGrimoireDefinition__
+
+@mock.patch('grimoireebook.streamDestinyGrimoireFromBungie', autospec = True)
+@mock.patch('grimoireebook.getDestinyGrimoireDefinitionFromStream', autospec = True)
+def test_shouldLoadDestinyGrimoireDefinitionFromStream(mock_getDestinyGrimoireDefinitionFromStream, mock_streamDestinyGrimoireFromBungie):
+	mock_getDestinyGrimoireDefinitionFromStream.return_value = __dummyGrimoireDefinition__
+
+	grimoireDefinition = grimoireebook.loadDestinyGrimoireDefinition(__testApiKey__, True)
+
+	mock_streamDestinyGrimoireFromBungie.assert_called_once_with(__testApiKey__, None)
+	mock_getDestinyGrimoireDefinitionFromStream.assert_called_once_with(mock_streamDestinyGrimoireFromBungie.return_value, None)
 
 	assert grimoireDefinition == __dummyGrimoireDefinition__
 
@@ -57,16 +101,70 @@ def test_shouldRetrieveGrimoireDataFromBungie():
 					body=json.dumps(__dummyGrimoireDefinition__, ensure_ascii=False, encoding='utf8'),
 					content_type='application/json',
 					status=200)
-	retrievedGrimoire = grimoireebook.getDestinyGrimoireFromBungie(__testApiKey__)
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', tempfile.mkdtemp()):
+		retrievedGrimoire = grimoireebook.getDestinyGrimoireFromBungie(__testApiKey__)
 
 	assert httpretty.last_request().headers['X-API-Key'] == __testApiKey__
 	assert retrievedGrimoire == __dummyGrimoireDefinition__
 
+@httpretty.activate
+def test_shouldRevalidateCachedGrimoireDataWithBungie():
+	httpretty.register_uri(httpretty.GET,
+					'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/',
+					responses=[
+						httpretty.Response(body=json.dumps(__dummyGrimoireDefinition__), content_type='application/json', status=200, etag='"grimoireVersion1"'),
+						httpretty.Response(body='', status=304)
+					])
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', os.path.join(tempfile.mkdtemp(), 'cache')):
+		grimoireebook.getDestinyGrimoireFromBungie(__testApiKey__)
+		assert 'If-None-Match' not in httpretty.last_request().headers
+
+		retrievedGrimoire = grimoireebook.getDestinyGrimoireFromBungie(__testApiKey__)
+
+	assert httpretty.last_request().headers['If-None-Match'] == '"grimoireVersion1"'
+	assert retrievedGrimoire == __dummyGrimoireDefinition__
+
+@httpretty.activate
+def test_shouldStreamAndCacheGrimoireDataFromBungie():
+	httpretty.register_uri(httpretty.GET,
+					'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/',
+					body=json.dumps(__dummyGrimoireDefinition__),
+					content_type='application/json',
+					status=200)
+	cacheFolder = tempfile.mkdtemp()
+	session = grimoireebook.createBungieSession(1)
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', cacheFolder), mock.patch('grimoireebook.createBungieSession', return_value = session), \
+			mock.patch.object(session, 'close', wraps = session.close) as mock_sessionClose:
+		chunks = grimoireebook.streamDestinyGrimoireFromBungie(__testApiKey__)
+		firstChunk = next(chunks)
+		mock_sessionClose.assert_not_called()
+		streamedGrimoire = firstChunk + ''.join(chunks)
+		mock_sessionClose.assert_called_once_with()
+
+	assert httpretty.last_request().headers['X-API-Key'] == __testApiKey__
+	assert json.loads(streamedGrimoire) == __dummyGrimoireDefinition__
+	assert open(os.path.join(cacheFolder, grimoireebook.GRIMOIRE_DEFINITION_CACHE_FILE_NAME), 'rb').read() == streamedGrimoire
+
+@httpretty.activate
+def test_shouldRequestAndCacheGrimoireDataPerLocale():
+	httpretty.register_uri(httpretty.GET,
+					'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/',
+					body=json.dumps(__dummyGrimoireDefinition__),
+					content_type='application/json',
+					status=200)
+	cacheFolder = tempfile.mkdtemp()
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', cacheFolder):
+		retrievedGrimoire = grimoireebook.getDestinyGrimoireFromBungie(__testApiKey__, 'de')
+
+	assert httpretty.last_request().querystring == { 'lc' : [ 'de' ] }
+	assert retrievedGrimoire == __dummyGrimoireDefinition__
+	assert os.path.exists(os.path.join(cacheFolder, 'grimoireDefinition.de.json'))
+	assert not os.path.exists(os.path.join(cacheFolder, grimoireebook.GRIMOIRE_DEFINITION_CACHE_FILE_NAME))
+
 def generateExpectedCardHash(themeName, pageName, cardName):
 	return hashlib.sha1('%s.%s.%s' % (themeName, pageName, cardName)).hexdigest()
 
-def test_shouldExtractDestinyGrimoireDefinitionFromJsonData():
-	testGrimoire = '''
+__testGrimoireJson__ = '''
 		{
 		  "Response": {
 		    "themeCollection": [
@@ -1086,7 +1184,47 @@ def test_shouldExtractDestinyGrimoireDefinitionFromJsonData():
 		}
 	'''
 
-	grimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromJson(json.loads(testGrimoire, encoding='utf8'))
+def test_shouldExtractSameDestinyGrimoireDefinitionFromStreamedJsonData():
+	expectedGrimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromJson(json.loads(__testGrimoireJson__, encoding='utf8'))
+
+	for chunkSize in [1, 7, 64, len(__testGrimoireJson__)]:
+		chunks = [__testGrimoireJson__[start:start + chunkSize] for start in range(0, len(__testGrimoireJson__), chunkSize)]
+		assert grimoireebook.getDestinyGrimoireDefinitionFromStream(iter(chunks)) == expectedGrimoireDefinition
+
+def test_shouldStreamGrimoireCardsWithEscapedStrings():
+	grimoireJson = json.dumps({ 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme "1"', 'pageCollection' : [ { 'pageName' : 'page {1}', 'cardCollection' : [
+						{ 'cardName' : u'card \\ \u00e9 [1]', 'cardIntro' : 'intro } "quoted"', 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 1, 'y' : 2, 'width' : 3, 'height' : 4 } } } } ] } ] } ] } })
+
+	events = list(grimoireebook.iterGrimoireEventsFromStream([grimoireJson[start:start + 5] for start in range(0, len(grimoireJson), 5)]))
+
+	assert events[0] == ('theme', 'theme "1"')
+	assert events[1] == ('page', 'page {1}')
+	assert events[2][0] == 'card'
+	assert events[2][1]['cardName'] == u'card \\ \u00e9 [1]'
+	assert events[2][1]['cardIntro'] == 'intro } "quoted"'
+
+def test_shouldStreamGrimoireDefinitionWhateverTheKeyOrder():
+	def generateCard(cardName):
+		return { 'cardName' : cardName, 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 1, 'y' : 2, 'width' : 3, 'height' : 4 } } } }
+	firstPage = collections.OrderedDict([ ('pageName', 'P1'), ('cardCollection', [ generateCard('first') ]) ])
+	secondPage = collections.OrderedDict([ ('cardCollection', [ generateCard('second'), generateCard('third') ]), ('pageName', 'P2') ])
+	lateNamedTheme = collections.OrderedDict([ ('pageCollection', [ collections.OrderedDict([ ('cardCollection', [ generateCard('fourth') ]), ('pageName', 'P3') ]) ]), ('themeName', 'T2') ])
+	grimoireJson = { 'Response' : { 'themeCollection' : [ collections.OrderedDict([ ('themeName', 'T1'), ('pageCollection', [ firstPage, secondPage ]) ]), lateNamedTheme ] } }
+
+	for rawGrimoireJson in (json.dumps(grimoireJson), json.dumps(grimoireJson, sort_keys = True)):
+		expectedGrimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromJson(json.loads(rawGrimoireJson))
+		for chunkSize in [1, 16, len(rawGrimoireJson)]:
+			grimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromStream(rawGrimoireJson[start:start + chunkSize] for start in range(0, len(rawGrimoireJson), chunkSize))
+			assert grimoireDefinition == expectedGrimoireDefinition
+			assert grimoireDefinition.sheets == expectedGrimoireDefinition.sheets
+	assert [ [ (pageData.pageName, [ cardData.cardName for cardData in pageData.cards ]) for pageData in themeData.pages ] for themeData in expectedGrimoireDefinition.themes ] == \
+			[ [ ('P1', [ 'first' ]), ('P2', [ 'second', 'third' ]) ], [ ('P3', [ 'fourth' ]) ] ]
+
+	with pytest.raises(ValueError):
+		grimoireebook.getDestinyGrimoireDefinitionFromStream(iter([json.dumps({ 'Response' : { 'themeCollection' : [ { 'pageCollection' : [ { 'pageName' : 'P', 'cardCollection' : [ generateCard('card') ] } ] } ] } })]))
+
+def test_shouldExtractDestinyGrimoireDefinitionFromJsonData():
+	grimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromJson(json.loads(__testGrimoireJson__, encoding='utf8'))
 
 	assert len(grimoireDefinition["themes"]) == 3
 	assert grimoireDefinition["themes"][0]["themeName"] == "theme_1"
@@ -1169,126 +1307,477 @@ def test_shouldExtractDestinyGrimoireDefinitionFromJsonData():
 
 @mock.patch('os.path.exists')
 @mock.patch('os.makedirs')
-@mock.patch('urllib.urlretrieve')
-def test_shouldDownloadAllGrimoireImagesToLocalStorage(mock_urllib, mock_makedirs, mock_pathExists):
-	testGrimoireDefinition = dict()
+@mock.patch('grimoireebook.saveSheetManifest')
+@mock.patch('grimoireebook.createBungieSession')
+@mock.patch('grimoireebook.downloadGrimoireSheet')
+def test_shouldDownloadAllGrimoireImagesToLocalStorage(mock_downloadGrimoireSheet, mock_createBungieSession, mock_saveSheetManifest, mock_makedirs, mock_pathExists):
+	testGrimoireDefinition = grimoireebook.GrimoireDefinition()
 	testGrimoireDefinition["themes"] = []
-	testGrimoireDefinition["themes"].append(dict())
+	testGrimoireDefinition["themes"].append(grimoireebook.Theme('theme'))
 	testGrimoireDefinition["themes"][0]["pages"] = []
-	testGrimoireDefinition["themes"][0]["pages"].append(dict())
+	testGrimoireDefinition["themes"][0]["pages"].append(grimoireebook.Page('page'))
 	testGrimoireDefinition["themes"][0]["pages"][0]["cards"] = []
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][0]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][1]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][2]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][3]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"].append(dict())
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][0]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][1]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][2]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][3]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"].append(grimoireebook.Page('page'))
 	testGrimoireDefinition["themes"][0]["pages"][1]["cards"] = []
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][0]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet03_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][1]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet03_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][2]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet04_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][3]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet04_High.jpg")
-	testGrimoireDefinition["themes"].append(dict())
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][0]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet03_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][1]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet03_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][2]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet04_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][1]["cards"][3]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet04_High.jpg")
+	testGrimoireDefinition["themes"].append(grimoireebook.Theme('theme'))
 	testGrimoireDefinition["themes"][1]["pages"] = []
-	testGrimoireDefinition["themes"][1]["pages"].append(dict())
+	testGrimoireDefinition["themes"][1]["pages"].append(grimoireebook.Page('page'))
 	testGrimoireDefinition["themes"][1]["pages"][0]["cards"] = []
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][0]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet05_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][1]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet05_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][2]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet06_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][3]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet06_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"].append(dict())
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][0]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet05_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][1]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet05_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][2]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet06_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][0]["cards"][3]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet06_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"].append(grimoireebook.Page('page'))
 	testGrimoireDefinition["themes"][1]["pages"][1]["cards"] = []
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][0]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet07_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][1]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet07_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][2]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet08_High.jpg")
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(dict())
-	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][3]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet08_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][0]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet07_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][1]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet07_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][2]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet08_High.jpg")
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][1]["pages"][1]["cards"][3]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet08_High.jpg")
 
 	mock_pathExists.return_value = False
 
 	grimoireebook.dowloadGrimoireImages(testGrimoireDefinition)
 
 	mock_makedirs.assert_called_once_with(grimoireebook.DEFAULT_IMAGE_FOLDER)
-	assert mock_urllib.call_count == 8
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet01_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet01_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet02_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet02_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet03_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet03_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet04_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet04_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet05_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet05_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet06_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet06_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet07_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet07_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet08_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet08_High.jpg"))
+	assert len(mock_downloadGrimoireSheet.call_args_list) == 8
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet01_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet02_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet03_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet04_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet05_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet06_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet07_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet08_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
 
 @mock.patch('os.path.exists')
 @mock.patch('os.makedirs')
-@mock.patch('urllib.urlretrieve')
-def test_shouldNotCreateImageFolderWhenDownloadAllGrimoireImagesToLocalStorageIfItAlreadyExists(mock_urllib, mock_makedirs, mock_pathExists):
-	testGrimoireDefinition = dict()
+@mock.patch('grimoireebook.saveSheetManifest')
+@mock.patch('grimoireebook.createBungieSession')
+@mock.patch('grimoireebook.downloadGrimoireSheet')
+def test_shouldNotCreateImageFolderWhenDownloadAllGrimoireImagesToLocalStorageIfItAlreadyExists(mock_downloadGrimoireSheet, mock_createBungieSession, mock_saveSheetManifest, mock_makedirs, mock_pathExists):
+	testGrimoireDefinition = grimoireebook.GrimoireDefinition()
 	testGrimoireDefinition["themes"] = []
-	testGrimoireDefinition["themes"].append(dict())
+	testGrimoireDefinition["themes"].append(grimoireebook.Theme('theme'))
 	testGrimoireDefinition["themes"][0]["pages"] = []
-	testGrimoireDefinition["themes"][0]["pages"].append(dict())
+	testGrimoireDefinition["themes"][0]["pages"].append(grimoireebook.Page('page'))
 	testGrimoireDefinition["themes"][0]["pages"][0]["cards"] = []
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][0]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(dict())
-	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][1]["image"] = dict(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][0]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"].append(grimoireebook.Card('card'))
+	testGrimoireDefinition["themes"][0]["pages"][0]["cards"][1]["image"] = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")
 
 	mock_pathExists.return_value = True
 
 	grimoireebook.dowloadGrimoireImages(testGrimoireDefinition)
 
 	mock_makedirs.assert_not_called()
-	assert mock_urllib.call_count == 2
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet01_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet01_High.jpg"))
-	mock_urllib.assert_any_call("http://www.bungie.net/images/cardSet02_High.jpg", os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, "cardSet02_High.jpg"))
+	assert len(mock_downloadGrimoireSheet.call_args_list) == 2
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet01_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+	mock_downloadGrimoireSheet.assert_any_call(mock_createBungieSession.return_value, "http://www.bungie.net/images/cardSet02_High.jpg", grimoireebook.DEFAULT_IMAGE_FOLDER, None)
+
+@mock.patch('os.path.exists')
+@mock.patch('grimoireebook.saveSheetManifest')
+@mock.patch('grimoireebook.createBungieSession')
+@mock.patch('grimoireebook.downloadGrimoireSheet')
+def test_shouldDownloadAllGrimoireImagesBeforeReportingFailedSheets(mock_downloadGrimoireSheet, mock_createBungieSession, mock_saveSheetManifest, mock_pathExists):
+	testGrimoireDefinition = generateTestDefinition([[
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet01_High.jpg")),
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet02_High.jpg")),
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "http://www.bungie.net/images/cardSet03_High.jpg")) ]])
+
+	def failSecondSheet(session, imageURL, imagesFolder, manifestEntry):
+		if imageURL.endswith('cardSet02_High.jpg'):
+			raise IOError('connection reset')
+		return { 'checksum' : imageURL }
+
+	mock_pathExists.return_value = True
+	mock_downloadGrimoireSheet.side_effect = failSecondSheet
+
+	with pytest.raises(DestinyContentAPIClientError) as expectedException:
+		grimoireebook.dowloadGrimoireImages(testGrimoireDefinition, 2)
+
+	assert len(mock_downloadGrimoireSheet.call_args_list) == 3
+	assert str(expectedException.value) == DestinyContentAPIClientError.SHEET_DOWNLOAD_FAILED_ERROR_MSG % (1, "http://www.bungie.net/images/cardSet02_High.jpg")
+	mock_createBungieSession.return_value.close.assert_called_once_with()
+	mock_saveSheetManifest.assert_called_once_with(grimoireebook.DEFAULT_IMAGE_FOLDER, {
+		"http://www.bungie.net/images/cardSet01_High.jpg" : { 'checksum' : "http://www.bungie.net/images/cardSet01_High.jpg" },
+		"http://www.bungie.net/images/cardSet03_High.jpg" : { 'checksum' : "http://www.bungie.net/images/cardSet03_High.jpg" } })
+
+def test_shouldSortGrimoireSheetsLargestFirst():
+	testGrimoireDefinition = generateTestDefinition([[
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "small.jpg", regionXStart = 0, regionYStart = 0, regionWidth = 10, regionHeight = 10)),
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "large.jpg", regionXStart = 0, regionYStart = 0, regionWidth = 10, regionHeight = 10)),
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "large.jpg", regionXStart = 90, regionYStart = 90, regionWidth = 10, regionHeight = 10)),
+								grimoireebook.Card('card', image = grimoireebook.ImageRegion(sourceImage = "medium.jpg", regionXStart = 40, regionYStart = 0, regionWidth = 10, regionHeight = 10)) ]])
+
+	assert grimoireebook.getGrimoireSheetsBySize(testGrimoireDefinition) == ["large.jpg", "medium.jpg", "small.jpg"]
+
+@httpretty.activate
+def test_shouldDownloadGrimoireSheetIntoImageFolder():
+	imagesFolder = tempfile.mkdtemp()
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', body='dummySheetData', status=200, etag='"sheetVersion1"')
+
+	manifestEntry = grimoireebook.downloadGrimoireSheet(grimoireebook.createBungieSession(), 'http://www.bungie.net/images/cardSet01_High.jpg', imagesFolder)
+
+	sheetPath = os.path.join(imagesFolder, 'cardSet01_High.jpg')
+	assert open(sheetPath, 'rb').read() == 'dummySheetData'
+	assert not os.path.exists(sheetPath + '.part')
+	assert manifestEntry['etag'] == '"sheetVersion1"'
+	assert manifestEntry['size'] == len('dummySheetData')
+	assert manifestEntry['checksum'] == hashlib.sha1('dummySheetData').hexdigest()
+
+@httpretty.activate
+def test_shouldRevalidateCachedGrimoireSheetWithConditionalRequest():
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', body='', status=304)
+	manifestEntry = { 'etag' : '"sheetVersion1"', 'lastModified' : 'Sat, 01 Oct 2016 10:00:00 GMT', 'size' : 14, 'mtime' : 0, 'checksum' : 'abc' }
+
+	revalidatedEntry = grimoireebook.downloadGrimoireSheet(grimoireebook.createBungieSession(), 'http://www.bungie.net/images/cardSet01_High.jpg', tempfile.mkdtemp(), manifestEntry)
+
+	assert revalidatedEntry == manifestEntry
+	assert httpretty.last_request().headers['If-None-Match'] == manifestEntry['etag']
+	assert httpretty.last_request().headers['If-Modified-Since'] == manifestEntry['lastModified']
+
+@httpretty.activate
+def test_shouldRetryThrottledGrimoireSheetDownloads():
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg',
+					responses=[
+						httpretty.Response(body='', status=429, retry_after='0'),
+						httpretty.Response(body='', status=503),
+						httpretty.Response(body='dummySheetData', status=200)
+					])
+	session = grimoireebook.createBungieSession(scheduler = grimoireebook.BungieRequestScheduler(backoffBase = 0))
+
+	manifestEntry = grimoireebook.downloadGrimoireSheet(session, 'http://www.bungie.net/images/cardSet01_High.jpg', tempfile.mkdtemp())
+
+	assert len(httpretty.latest_requests()) == 3
+	assert manifestEntry['checksum'] == hashlib.sha1('dummySheetData').hexdigest()
+
+@httpretty.activate
+def test_shouldGiveUpOnGrimoireSheetAfterConfiguredRetries():
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', body='', status=503)
+	session = grimoireebook.createBungieSession(scheduler = grimoireebook.BungieRequestScheduler(retries = 2, backoffBase = 0))
+
+	with pytest.raises(grimoireebook.requests.HTTPError):
+		grimoireebook.downloadGrimoireSheet(session, 'http://www.bungie.net/images/cardSet01_High.jpg', tempfile.mkdtemp())
+
+	assert len(httpretty.latest_requests()) == 3
+
+@httpretty.activate
+def test_shouldHoldRequestSlotUntilStreamedBodyIsReadOrClosed():
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', body='dummySheetData', status=200)
+	scheduler = grimoireebook.BungieRequestScheduler(concurrency = 1)
+	session = grimoireebook.createBungieSession(scheduler = scheduler)
+	assert isinstance(session, grimoireebook.requests.Session) and 'request' not in vars(session)
+
+	response = session.get('http://www.bungie.net/images/cardSet01_High.jpg', stream = True)
+	assert scheduler.inFlight == 1
+	assert ''.join(response.iter_content(4)) == 'dummySheetData'
+	assert scheduler.inFlight == 0
+	response.close()
+	assert scheduler.inFlight == 0
+
+	response = session.get('http://www.bungie.net/images/cardSet01_High.jpg', stream = True)
+	assert scheduler.inFlight == 1
+	response.close()
+	assert scheduler.inFlight == 0
+
+	assert session.get('http://www.bungie.net/images/cardSet01_High.jpg').content == 'dummySheetData'
+	assert scheduler.inFlight == 0
+
+@httpretty.activate
+def test_shouldRetryGrimoireDefinitionRequestThrottledByBungie():
+	httpretty.register_uri(httpretty.GET,
+					'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/',
+					responses=[
+						httpretty.Response(body=json.dumps({ 'ErrorCode' : 36, 'ThrottleSeconds' : 0, 'ErrorStatus' : 'ThrottleLimitExceededMinutes' }), content_type='application/json', status=200),
+						httpretty.Response(body=json.dumps(__dummyGrimoireDefinition__), content_type='application/json', status=200)
+					])
+	with mock.patch('grimoireebook.bungieRequestScheduler', grimoireebook.BungieRequestScheduler(backoffBase = 0)):
+		with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', tempfile.mkdtemp()):
+			retrievedGrimoire = grimoireebook.getDestinyGrimoireFromBungie(__testApiKey__)
+
+	assert len(httpretty.latest_requests()) == 2
+	assert retrievedGrimoire == __dummyGrimoireDefinition__
+
+def test_shouldReadRetryDelayFromRetryAfterAndBungieThrottleFields():
+	def createResponse(statusCode, headers = {}, body = None):
+		response = mock.Mock(status_code = statusCode, headers = headers)
+		response.json.return_value = body
+		return response
+	jsonHeaders = { 'Content-Type' : 'application/json; charset=utf-8', 'Content-Length' : '100' }
+
+	assert grimoireebook.getBungieRetryDelay(createResponse(200, { 'Content-Type' : 'image/jpeg', 'Content-Length' : '100' })) is None
+	assert grimoireebook.getBungieRetryDelay(createResponse(200, jsonHeaders, { 'ErrorCode' : 1, 'ThrottleSeconds' : 0 })) is None
+	assert grimoireebook.getBungieRetryDelay(createResponse(200, jsonHeaders, { 'ErrorCode' : 1, 'ThrottleSeconds' : 7 })) == 7
+	assert grimoireebook.getBungieRetryDelay(createResponse(200, jsonHeaders, { 'ErrorCode' : 51, 'ThrottleSeconds' : 0 })) == 0
+	assert grimoireebook.getBungieRetryDelay(createResponse(429, { 'Retry-After' : '12' })) == 12
+	assert grimoireebook.getBungieRetryDelay(createResponse(502)) == 0
+	assert 0 < grimoireebook.parseRetryAfter(email.utils.formatdate(time.time() + 60, usegmt = True)) <= 60
+
+def test_shouldHalveRequestConcurrencyOnceOnThrottlingAndGrowItBack():
+	scheduler = grimoireebook.BungieRequestScheduler(concurrency = 8, maxConcurrency = 9)
+	tickets = [scheduler.acquire() for _ in range(8)]
+
+	scheduler.release(tickets[0], failed = True)
+	scheduler.release(tickets[1], failed = True)
+	assert scheduler.concurrency == 4
+
+	for ticket in tickets[2:]:
+		scheduler.release(ticket)
+	assert scheduler.concurrency == 4.25
+
+	for _ in range(100):
+		tickets = [scheduler.acquire() for _ in range(int(scheduler.concurrency))]
+		for ticket in tickets:
+			scheduler.release(ticket)
+	assert scheduler.concurrency == 9
+
+def test_shouldNotGrowRequestConcurrencyBeyondWhatWorkersUse():
+	scheduler = grimoireebook.BungieRequestScheduler(concurrency = 8, maxConcurrency = 64)
+	for _ in range(400):
+		tickets = [scheduler.acquire() for _ in range(8)]
+		for ticket in tickets:
+			scheduler.release(ticket)
+	assert 9 <= scheduler.concurrency < 10
+
+	scheduler.release(scheduler.acquire(), failed = True)
+	assert int(scheduler.concurrency) < 8
+
+@mock.patch('grimoireebook.downloadGrimoireSheet')
+def test_shouldSkipUnchangedCachedGrimoireSheetWhenNotRevalidating(mock_downloadGrimoireSheet):
+	imagesFolder = tempfile.mkdtemp()
+	with open(os.path.join(imagesFolder, 'cardSet01_High.jpg'), 'wb') as sheetFile:
+		sheetFile.write('dummySheetData')
+	manifestEntry = { 'etag' : None, 'lastModified' : None, 'size' : 14, 'mtime' : 0, 'checksum' : hashlib.sha1('dummySheetData').hexdigest() }
+
+	imageURL, cachedEntry, error = grimoireebook.tryDownloadGrimoireSheet(None, 'http://www.bungie.net/images/cardSet01_High.jpg', imagesFolder, manifestEntry, False)
+
+	assert error is None
+	assert cachedEntry['checksum'] == manifestEntry['checksum']
+	mock_downloadGrimoireSheet.assert_not_called()
+
+def test_shouldDiscardSheetManifestEntryWhenCachedSheetChanged():
+	imagesFolder = tempfile.mkdtemp()
+	sheetPath = os.path.join(imagesFolder, 'cardSet01_High.jpg')
+	with open(sheetPath, 'wb') as sheetFile:
+		sheetFile.write('changedSheetData')
+
+	assert grimoireebook.getValidSheetManifestEntry({ 'size' : 16, 'mtime' : 0, 'checksum' : hashlib.sha1('dummySheetData').hexdigest() }, sheetPath) is None
+	assert grimoireebook.getValidSheetManifestEntry({ 'size' : 14, 'mtime' : 0, 'checksum' : hashlib.sha1('changedSheetData').hexdigest() }, sheetPath) is None
 
 @mock.patch('grimoireebook.Image.open')
 @mock.patch('grimoireebook.Image')
 @mock.patch('grimoireebook.Image')
 def test_shouldGenerateCardImageFromGivenSheet(mock_sheetImage, mock_cardImage, mock_imageOpen):
-	localImageFolder = '~/destinyGrimoire/images'
 	mock_imageOpen.return_value = mock_sheetImage
+	mock_sheetImage.format = 'JPEG'
 	mock_sheetImage.crop.return_value = mock_cardImage
+	mock_cardImage.save.side_effect = lambda cardImageBuffer, **encoderSettings: cardImageBuffer.write('DummyPictureData')
 
 	sheetImagePath = '/home/me/sheet.jpg'
 	cardName = 'test'
 	dimensions_tuple = (1,2,3,4)
-	expectedGeneratedImagePath = os.path.join(localImageFolder, 'test.jpg')
 
-	generatedImagePath = grimoireebook.generateCardImageFromImageSheet(cardName, sheetImagePath, localImageFolder, dimensions_tuple)
+	generatedImage = grimoireebook.generateCardImageFromImageSheet(cardName, sheetImagePath, dimensions_tuple)
 
-	assert generatedImagePath == expectedGeneratedImagePath
+	assert generatedImage.fileName == '%s.jpg' % hashlib.sha1('DummyPictureData').hexdigest()
+	assert generatedImage.content == 'DummyPictureData'
 	mock_imageOpen.assert_called_once_with(sheetImagePath)
 	mock_sheetImage.crop.assert_called_once_with((dimensions_tuple[0], dimensions_tuple[1], dimensions_tuple[0] + dimensions_tuple[2], dimensions_tuple[1] + dimensions_tuple[3]))
-	mock_cardImage.save.assert_called_once_with(expectedGeneratedImagePath, optimize=True)
+	mock_cardImage.save.assert_called_once_with(mock.ANY, format='JPEG', optimize=True)
+
+def test_shouldReuseCachedCardImagesForUnchangedSheetAndRect():
+	imagesFolder = tempfile.mkdtemp()
+	cropCacheFolder = tempfile.mkdtemp()
+	sheetImagePath = os.path.join(imagesFolder, 'cardSet01_High.jpg')
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(sheetImagePath)
+
+	generatedImages = grimoireebook.generateCachedCardImagesFromImageSheet(sheetImagePath, [('test_img', (0, 0, 10, 10))], cropCacheFolder)
+
+	with mock.patch('grimoireebook.Image.open') as mock_imageOpen:
+		cachedImages = grimoireebook.generateCachedCardImagesFromImageSheet(sheetImagePath, [('other_img', (0, 0, 10, 10))], cropCacheFolder, grimoireebook.getFileChecksum(sheetImagePath))
+
+	mock_imageOpen.assert_not_called()
+	assert cachedImages['other_img'].fileName == generatedImages['test_img'].fileName
+	assert cachedImages['other_img'].content == generatedImages['test_img'].content
+	assert os.listdir(cropCacheFolder) == ['%s.jpg' % grimoireebook.getCardImageCacheKey(grimoireebook.getFileChecksum(sheetImagePath), (0, 0, 10, 10))]
+
+def test_shouldConvertOpaquePngCardImagesToJpeg():
+	imagesFolder = tempfile.mkdtemp()
+	Image.new('RGBA', (20, 10), (255, 0, 0, 255)).save(os.path.join(imagesFolder, 'opaque.png'))
+	translucentSheet = Image.new('RGBA', (20, 10), (255, 0, 0, 255))
+	translucentSheet.paste((255, 0, 0, 128), (10, 0, 20, 10))
+	translucentSheet.save(os.path.join(imagesFolder, 'translucent.png'))
+
+	opaqueImage = grimoireebook.generateCardImagesFromImageSheet(os.path.join(imagesFolder, 'opaque.png'), [('opaque_img', (0, 0, 10, 10))])['opaque_img']
+	translucentImages = grimoireebook.generateCardImagesFromImageSheet(os.path.join(imagesFolder, 'translucent.png'), [('solid_img', (0, 0, 10, 10)), ('translucent_img', (10, 0, 10, 10))])
+
+	assert opaqueImage.fileName.endswith('.jpg') and Image.open(io.BytesIO(opaqueImage.content)).format == 'JPEG'
+	assert translucentImages['solid_img'].fileName.endswith('.jpg')
+	assert translucentImages['translucent_img'].fileName.endswith('.png') and Image.open(io.BytesIO(translucentImages['translucent_img'].content)).format == 'PNG'
+
+def test_shouldKeepCachedCardImagesApartPerEncodeProfile():
+	imagesFolder = tempfile.mkdtemp()
+	cropCacheFolder = tempfile.mkdtemp()
+	sheetImagePath = os.path.join(imagesFolder, 'cardSet01_High.png')
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(sheetImagePath)
+
+	for encodeProfile in sorted(grimoireebook.CARD_IMAGE_ENCODE_PROFILES):
+		cardImage = grimoireebook.generateCachedCardImagesFromImageSheet(sheetImagePath, [('test_img', (0, 0, 10, 10))], cropCacheFolder, None, encodeProfile)['test_img']
+		cachedImage = grimoireebook.generateCachedCardImagesFromImageSheet(sheetImagePath, [('test_img', (0, 0, 10, 10))], cropCacheFolder, None, encodeProfile)['test_img']
+		assert cachedImage == cardImage
+		assert cardImage.fileName.endswith('.jpg')
+
+	assert len(os.listdir(cropCacheFolder)) == len(grimoireebook.CARD_IMAGE_ENCODE_PROFILES)
+	assert grimoireebook.getGrimoireCardDigest(generateTestCard('card1', 'sheet.png', (0, 0, 10, 10)), {}, 'fast') != grimoireebook.getGrimoireCardDigest(generateTestCard('card1', 'sheet.png', (0, 0, 10, 10)), {}, 'smallest')
+
+def generateTestCard(cardName, sourceImage, dimensions_tuple):
+	return grimoireebook.Card(cardName, hash = hashlib.sha1(cardName).hexdigest(), image = grimoireebook.ImageRegion(sourceImage, *dimensions_tuple))
+
+def generateTestDefinition(*themes):
+	return grimoireebook.GrimoireDefinition([ grimoireebook.Theme('theme_%d' % themeIndex, [ grimoireebook.Page('page_%d' % pageIndex, cards) for pageIndex, cards in enumerate(pages) ]) for themeIndex, pages in enumerate(themes) ])
+
+def test_shouldKeepDictStyleAccessOnGrimoireCardModel():
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme', 'pageCollection' : [ { 'pageName' : 'page', 'cardCollection' : [
+						{ 'cardName' : 'card', 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 1.0, 'y' : 2, 'width' : 3, 'height' : 4 } } } } ] } ] } ] } }
+
+	grimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromJson(grimoireJson)
+	cardData = grimoireDefinition.themes[0].pages[0].cards[0]
+
+	assert cardData['image']['sourceImage'] is cardData.image.sourceImage
+	assert type(cardData.image.regionXStart) is int
+	assert 'cardIntro' in cardData and 'unknown' not in cardData
+	assert cardData.get('unknown', 'default') == 'default'
+	with pytest.raises(KeyError):
+		cardData['unknown']
+	assert pickle.loads(pickle.dumps(cardData)) == cardData
+	assert not hasattr(cardData, '__dict__')
+	assert list(cardData) == cardData.keys() and len(cardData) == 5
+	assert dict(cardData.image) == { 'sourceImage' : 'http://www.bungie.net/images/set.jpg', 'regionXStart' : 1, 'regionYStart' : 2, 'regionWidth' : 3, 'regionHeight' : 4 }
+	assert json.loads(json.dumps(grimoireDefinition.toDict())) == { 'themes' : [ { 'themeName' : 'theme', 'pages' : [ { 'pageName' : 'page', 'cards' : [ { 'cardName' : 'card', 'cardIntro' : '', 'cardDescription' : '',
+								'hash' : cardData.hash, 'image' : dict(cardData.image) } ] } ] } ] }
+
+def test_shouldGroupGrimoireCardsBySheet():
+	firstCard = generateTestCard('card1', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10))
+	secondCard = generateTestCard('card2', 'http://www.bungie.net/images/cardSet02_High.jpg', (0, 0, 10, 10))
+	thirdCard = generateTestCard('card3', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 10))
+	grimoireDefinition = generateTestDefinition([[ firstCard, secondCard ]], [[ thirdCard ]])
+
+	cardsBySheet = grimoireebook.groupGrimoireCardsBySheet(grimoireDefinition)
+
+	assert cardsBySheet.keys() == ['http://www.bungie.net/images/cardSet01_High.jpg', 'http://www.bungie.net/images/cardSet02_High.jpg']
+	assert cardsBySheet['http://www.bungie.net/images/cardSet01_High.jpg'] == [firstCard, thirdCard]
+	assert cardsBySheet['http://www.bungie.net/images/cardSet02_High.jpg'] == [secondCard]
+
+def test_shouldDecodeEachSheetOnceWhenGeneratingGrimoireCardImages():
+	imagesFolder = tempfile.mkdtemp()
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	firstCard = generateTestCard('card1', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10))
+	secondCard = generateTestCard('card2', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 5))
+	grimoireDefinition = generateTestDefinition([[ firstCard, secondCard ]])
+
+	with mock.patch('grimoireebook.Image.open', side_effect=Image.open) as mock_imageOpen:
+		cardImages = grimoireebook.generateGrimoireCardImages(grimoireDefinition, imagesFolder)
+
+	mock_imageOpen.assert_called_once_with(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	assert cardImages[firstCard['hash']].fileName == '%s.jpg' % hashlib.sha1(cardImages[firstCard['hash']].content).hexdigest()
+	assert Image.open(io.BytesIO(cardImages[firstCard['hash']].content)).size == (10, 10)
+	assert Image.open(io.BytesIO(cardImages[secondCard['hash']].content)).size == (10, 5)
+	assert not os.path.exists(os.path.join(imagesFolder, cardImages[firstCard['hash']].fileName))
+
+def test_shouldGenerateSameGrimoireCardImagesWithProcessPool():
+	imagesFolder = tempfile.mkdtemp()
+	cards = []
+	for sheetIndex in range(3):
+		Image.new('RGB', (20, 10), (80 * sheetIndex, 0, 0)).save(os.path.join(imagesFolder, 'cardSet0%d_High.jpg' % sheetIndex))
+		cards.append(generateTestCard('card%d.1' % sheetIndex, 'http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex, (0, 0, 10, 10)))
+		cards.append(generateTestCard('card%d.2' % sheetIndex, 'http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex, (10, 0, 10, 10)))
+	grimoireDefinition = generateTestDefinition([cards])
+
+	serialCardImages = grimoireebook.generateGrimoireCardImages(grimoireDefinition, imagesFolder)
+	parallelCardImages = grimoireebook.generateGrimoireCardImages(grimoireDefinition, imagesFolder, poolSize=2)
+
+	assert len(parallelCardImages) == len(cards)
+	assert parallelCardImages == serialCardImages
+
+def test_shouldCollectCardTraceSpansFromProcessPool():
+	imagesFolder = tempfile.mkdtemp()
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	grimoireDefinition = generateTestDefinition([[ generateTestCard('card1', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10)) ]])
+
+	with mock.patch('grimoireebook.activeTracer', grimoireebook.GrimoireTracer()) as tracer:
+		grimoireebook.generateGrimoireCardImages(grimoireDefinition, imagesFolder, poolSize=2)
+
+	assert sorted(event['name'] for event in tracer.events) == ['cropCard', 'cropSheet', 'decodeSheet']
+	assert all(event['pid'] != os.getpid() for event in tracer.events)
+
+def test_shouldReuseOnlyUnchangedCardImagesFromPreviousBuild():
+	bookFile = os.path.join(tempfile.mkdtemp(), 'destinyGrimoire.epub')
+	unchangedCard = generateTestCard('unchanged', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10)).replace(cardIntro = 'intro', cardDescription = 'description')
+	changedCard = generateTestCard('changed', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 10)).replace(cardIntro = 'intro', cardDescription = 'description')
+	addedCard = generateTestCard('added', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 10, 10, 10)).replace(cardIntro = 'intro', cardDescription = 'description')
+	cardImages = dict((cardData['hash'], grimoireebook.CardImage(fileName='%s_img.jpg' % cardData['cardName'], content=cardData['cardName'])) for cardData in [unchangedCard, changedCard])
+	removedCard = generateTestCard('removed', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10))
+
+	buildState = grimoireebook.createGrimoireBuildState(generateTestDefinition([[ unchangedCard, changedCard ]]), {}, cardImages)
+	buildState['cards'][removedCard['hash']] = { 'digest' : 'removed', 'page' : 'removed.xhtml', 'image' : 'images/removed_img.jpg' }
+	with zipfile.ZipFile(bookFile, 'w') as previousBook:
+		for cardImage in cardImages.values():
+			previousBook.writestr('EPUB/images/%s' % cardImage.fileName, cardImage.content)
+
+	currentDefinition = generateTestDefinition([[ unchangedCard, changedCard.replace(cardIntro = 'new intro'), addedCard ]])
+	with mock.patch.object(zipfile.ZipFile, 'read', autospec = True, side_effect = zipfile.ZipFile.read) as mock_read:
+		reusableCardImages = grimoireebook.loadReusableCardImages(currentDefinition, buildState, bookFile, {})
+		assert len(reusableCardImages) == 1 and unchangedCard['hash'] in reusableCardImages and changedCard['hash'] not in reusableCardImages
+		assert mock_read.call_count == 0
+
+		assert dict(reusableCardImages.items()) == { unchangedCard['hash'] : cardImages[unchangedCard['hash']] }
+		assert mock_read.call_count == 1
+	reusableCardImages.close()
+
+def test_shouldNotReuseCardImagesWithoutPreviousBook():
+	assert len(grimoireebook.loadReusableCardImages(grimoireebook.GrimoireDefinition(), { 'cards' : {} }, os.path.join(tempfile.mkdtemp(), 'missing.epub'))) == 0
+
+@mock.patch('grimoireebook.generateCachedCardImagesFromImageSheet')
+def test_shouldOnlyCutCardImagesThatCannotBeReused(mock_generateCachedCardImagesFromImageSheet):
+	reusedCard = generateTestCard('reused', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10))
+	newCard = generateTestCard('new', 'http://www.bungie.net/images/cardSet02_High.jpg', (0, 0, 10, 10))
+	reusedImage = grimoireebook.CardImage(fileName='reused_img.jpg', content='reused')
+	newImage = grimoireebook.CardImage(fileName='new_img.jpg', content='new')
+	mock_generateCachedCardImagesFromImageSheet.return_value = { '%s-new_img' % newCard['hash'] : newImage }
+
+	cardImages = grimoireebook.generateGrimoireCardImages(generateTestDefinition([[ reusedCard, newCard ]]), 'images', reusableCardImages = { reusedCard['hash'] : reusedImage })
+
+	assert cardImages == { reusedCard['hash'] : reusedImage, newCard['hash'] : newImage }
+	mock_generateCachedCardImagesFromImageSheet.assert_called_once_with(os.path.join('images', 'cardSet02_High.jpg'), [('%s-new_img' % newCard['hash'], (0, 0, 10, 10))], None, None, grimoireebook.DEFAULT_ENCODE_PROFILE)
 
 def test_shouldGenerateGrimoirePageContent():
-	pageData = {'cardName': 'NameText',
-					'cardIntro': 'IntroText',
-					'cardDescription': 'DescriptionText',
-					'image': {
-						'sourceImage': 'http://www.bungie.net/images/cardSet.jpg',
-						'regionXStart': 0,
-						'regionYStart': 0,
-						'regionHeight': 30,
-						'regionWidth': 31
-					}
-				}
+	pageData = grimoireebook.Card('NameText', 'IntroText', 'DescriptionText',
+					image = grimoireebook.ImageRegion('http://www.bungie.net/images/cardSet.jpg', regionXStart = 0, regionYStart = 0, regionHeight = 30, regionWidth = 31))
 	pageImagePath = os.path.join("images", "NameText_img.jpg")
 
 	expectedContent = u'''<cardname">%s</cardname>
@@ -1306,21 +1795,14 @@ def test_shouldGenerateGrimoirePageContent():
 def test_shouldGenerateEpubImageItem(mock_card_image_gen):
 	testImageData = 'DummyPictureData'
 
-	with mock.patch('grimoireebook.open', mock.mock_open(read_data=testImageData)):
+	with mock.patch('grimoireebook.open', side_effect=AssertionError('card images must not be read back from disk')):
 		cardName = "test"
 		cardImageBaseName = '%s_img' % (cardName)
 		cardImageFolder = "images"
-		generatedCardImagePath = ".destinyCache/cache/%s/%s.jpg" % (cardImageFolder, cardImageBaseName)
 		sheetImagePath = "images/cardSet.jpg"
-		cardImageData = {
-							'sourceImage': 'http://www.bungie.net/images/cardSet.jpg',
-							'regionXStart': 0,
-							'regionYStart': 0,
-							'regionHeight': 30,
-							'regionWidth': 31
-						}
+		cardImageData = grimoireebook.ImageRegion('http://www.bungie.net/images/cardSet.jpg', regionXStart = 0, regionYStart = 0, regionHeight = 30, regionWidth = 31)
 
-		mock_card_image_gen.return_value = generatedCardImagePath
+		mock_card_image_gen.return_value = grimoireebook.CardImage(fileName='%s.jpg' % (cardImageBaseName), content=testImageData)
 
 		epubImageItem = grimoireebook.generateGrimoirePageImage(cardName, cardImageData, cardImageFolder)
 
@@ -1328,7 +1810,7 @@ def test_shouldGenerateEpubImageItem(mock_card_image_gen):
 		assert epubImageItem.file_name == os.path.join('images','%s_img.jpg' % (cardName))
 		assert epubImageItem.content == testImageData
 
-		mock_card_image_gen.assert_called_with(cardImageBaseName, sheetImagePath, cardImageFolder, (0,0,31,30))
+		mock_card_image_gen.assert_called_with(cardImageBaseName, sheetImagePath, (0,0,31,30))
 
 @mock.patch('grimoireebook.generateGrimoirePageImage')
 def test_shouldCreateGrimoireEbookPage(mock_generate_grimoire_page_image):
@@ -1343,19 +1825,8 @@ def runCreateGrimoireEbookPageTest(cardName, cardFilename, mock_generate_grimoir
 	cardImagePath = os.path.join(grimoireebook.DEFAULT_IMAGE_FOLDER, cardImage)
 	cardHash = '12345678890abcdef'
 
-	cardData = {
-					'cardName': cardName,
-					'cardIntro': 'IntroText',
-					'cardDescription': 'DescriptionText',
-					'hash': cardHash,
-					'image': {
-						'sourceImage': 'http://www.bungie.net/images/cardSet.jpg',
-						'regionXStart': 0,
-						'regionYStart': 0,
-						'regionHeight': 30,
-						'regionWidth': 31
-					}
-				}
+	cardData = grimoireebook.Card(cardName, 'IntroText', 'DescriptionText', cardHash,
+					grimoireebook.ImageRegion('http://www.bungie.net/images/cardSet.jpg', regionXStart = 0, regionYStart = 0, regionHeight = 30, regionWidth = 31))
 	default_css = epub.EpubItem(uid="page_style", file_name="style/page.css", media_type="text/css", content=grimoireebook.DEFAULT_PAGE_STYLE)
 
 	mock_grimoire_page_image = mock.Mock()
@@ -1371,7 +1842,7 @@ def runCreateGrimoireEbookPageTest(cardName, cardFilename, mock_generate_grimoir
 	assert createdPageItems.page.content == grimoireebook.generateGrimoirePageContent(cardData, cardImagePath)
 	assert createdPageItems.image == mock_grimoire_page_image
 
-	mock_generate_grimoire_page_image.assert_called_with(expectedCardFilename, cardData['image'], grimoireebook.DEFAULT_IMAGE_FOLDER)
+	mock_generate_grimoire_page_image.assert_called_with(expectedCardFilename, cardData['image'], grimoireebook.DEFAULT_IMAGE_FOLDER, None)
 
 	pageStyle = createdPageItems.page.get_links_of_type("text/css").next()
 	assert pageStyle['href'] == 'style/page.css'
@@ -1386,14 +1857,12 @@ def test_shouldAddPageCardsToGrimoireEbook(mock_createGrimoireCardPage, mock_ebo
 
 	mock_createGrimoireCardPage.side_effect = [ collections.namedtuple('GrimoirePage', ['page', 'image'])(page=firstCardPage, image=firstCardImage), collections.namedtuple('GrimoirePage', ['page', 'image'])(page=secondCardPage, image=secondCardImage) ]
 
-	pageData = {
-					'cards' : [ 'card1', 'card2' ]
-				}
+	pageData = grimoireebook.Page('page1', [ 'card1', 'card2' ])
 
 	pageCards = grimoireebook.addPageItemsToEbook(mock_ebook, pageData)
 
 	assert pageCards == (firstCardPage, secondCardPage)
-	mock_createGrimoireCardPage.assert_has_calls([mock.call('card1', BookStyleItemMatcher()), mock.call('card2', BookStyleItemMatcher())])
+	mock_createGrimoireCardPage.assert_has_calls([mock.call('card1', BookStyleItemMatcher(), None, 'en'), mock.call('card2', BookStyleItemMatcher(), None, 'en')])
 	mock_ebook.add_item.assert_has_calls([mock.call(firstCardPage), mock.call(firstCardImage), mock.call(secondCardPage), mock.call(secondCardImage)])
 	mock_ebook.spine.append.assert_has_calls([mock.call(firstCardPage), mock.call(secondCardPage)])
 
@@ -1405,13 +1874,10 @@ def test_shouldAddThemePagesToGrimoireEbook(mock_addPageItemsToEbook, mock_ebook
 
 	mock_addPageItemsToEbook.side_effect = [firstPageSet, secondPageSet]
 
-	firstPage = {'pageName' : 'page1'}
-	secondPage = {'pageName': 'page2'}
+	firstPage = grimoireebook.Page('page1')
+	secondPage = grimoireebook.Page('page2')
 
-	themeData = {
-					'themeName' : 'testTheme',
-					'pages' : [ firstPage, secondPage ]
-				}
+	themeData = grimoireebook.Theme('testTheme', [ firstPage, secondPage ])
 
 	themePages = grimoireebook.addThemePagesToEbook(mock_ebook, themeData)
 
@@ -1422,7 +1888,8 @@ def test_shouldAddThemePagesToGrimoireEbook(mock_addPageItemsToEbook, mock_ebook
 	assert themePages[1][0].title == secondPage['pageName']
 	assert themePages[1][1] == secondPageSet
 
-	mock_addPageItemsToEbook.assert_has_calls([mock.call(mock_ebook, firstPage), mock.call(mock_ebook, secondPage)])
+	mock_addPageItemsToEbook.assert_has_calls([mock.call(mock_ebook, firstPage, None, mock.ANY, 'en'), mock.call(mock_ebook, secondPage, None, mock.ANY, 'en')])
+	assert mock_addPageItemsToEbook.call_args_list[0][0][3] is mock_addPageItemsToEbook.call_args_list[1][0][3]
 
 @mock.patch('ebooklib.epub.EpubBook')
 @mock.patch('grimoireebook.addThemePagesToEbook')
@@ -1432,12 +1899,10 @@ def test_shouldAddThemesToGrimoireBook(mock_addThemePagesToEbook, mock_ebook):
 
 	mock_addThemePagesToEbook.side_effect = [firstThemeSet, secondThemeSet]
 
-	firstTheme = { 'themeName' : 'theme_1'}
-	secondTheme = { 'themeName' : 'theme_2'}
+	firstTheme = grimoireebook.Theme('theme_1')
+	secondTheme = grimoireebook.Theme('theme_2')
 
-	grimoireData = {
-						'themes' : [ firstTheme, secondTheme]
-					}
+	grimoireData = grimoireebook.GrimoireDefinition([ firstTheme, secondTheme ])
 
 	themeSets = grimoireebook.addThemeSetsToEbook(mock_ebook, grimoireData)
 
@@ -1448,13 +1913,136 @@ def test_shouldAddThemesToGrimoireBook(mock_addThemePagesToEbook, mock_ebook):
 	assert themeSets[1][0].title == secondTheme['themeName']
 	assert themeSets[1][1] == secondThemeSet
 
-	mock_addThemePagesToEbook.assert_has_calls([mock.call(mock_ebook, firstTheme), mock.call(mock_ebook, secondTheme)])
+	mock_addThemePagesToEbook.assert_has_calls([mock.call(mock_ebook, firstTheme, None, mock.ANY, 'en'), mock.call(mock_ebook, secondTheme, None, mock.ANY, 'en')])
+	assert mock_addThemePagesToEbook.call_args_list[0][0][3] is mock_addThemePagesToEbook.call_args_list[1][0][3]
+
+def test_shouldStreamGrimoireEpubWithSameEntriesAsInMemoryBook():
+	workFolder = tempfile.mkdtemp()
+	imagesFolder = os.path.join(workFolder, 'images')
+	os.makedirs(imagesFolder)
+	sheetImage = Image.new('RGB', (20, 10), (255, 0, 0))
+	sheetImage.paste((0, 0, 255), (10, 0, 20, 10))
+	sheetImage.save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	grimoireDefinition = generateTestDefinition([[ generateTestCard('card1', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10)).replace(cardIntro = 'intro', cardDescription = 'description'),
+											generateTestCard('card2', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 10)).replace(cardIntro = 'intro', cardDescription = 'description') ]])
+
+	bookEntries = {}
+	for streamBook in (False, True):
+		bookFile = os.path.join(workFolder, 'stream%s.epub' % streamBook)
+		with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder), mock.patch('grimoireebook.DEFAULT_BOOK_FILE', bookFile), \
+				mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', os.path.join(workFolder, 'buildState.json')), \
+				mock.patch('grimoireebook.dowloadGrimoireImages', return_value = {}):
+			grimoireebook.createGrimoireEpub(grimoireDefinition, epub.EpubBook(), useCropCache = False, incremental = False, streamBook = streamBook)
+
+		with zipfile.ZipFile(bookFile) as writtenBook:
+			bookEntries[streamBook] = sorted(writtenBook.namelist())
+			assert writtenBook.namelist()[0] == 'mimetype'
+		assert not os.path.exists(bookFile + '.part')
+
+	streamedBook = epub.read_epub(os.path.join(workFolder, 'streamTrue.epub'))
+	assert bookEntries[True] == bookEntries[False]
+	assert [item.get_name() for item in streamedBook.get_items_of_type(ebooklib.ITEM_DOCUMENT)] == ['cover.xhtml', '%s-card1.xhtml' % hashlib.sha1('card1').hexdigest(), '%s-card2.xhtml' % hashlib.sha1('card2').hexdigest(), 'nav.xhtml']
+	assert len(list(streamedBook.get_items_of_type(ebooklib.ITEM_IMAGE))) == 3
+
+	bookFile = os.path.join(workFolder, 'streamTrue.epub')
+	with zipfile.ZipFile(bookFile) as writtenBook:
+		previousImages = dict((name, writtenBook.read(name)) for name in writtenBook.namelist() if name.startswith('EPUB/images/'))
+	with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder), mock.patch('grimoireebook.DEFAULT_BOOK_FILE', bookFile), \
+			mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', os.path.join(workFolder, 'buildState.json')), \
+			mock.patch('grimoireebook.dowloadGrimoireImages', return_value = {}), mock.patch('grimoireebook.generateCardImagesFromImageSheetTask') as mock_generateCardImages:
+		grimoireebook.createGrimoireEpub(grimoireDefinition, epub.EpubBook(), useCropCache = False, cropPoolSize = 1, streamBook = True)
+
+	assert not mock_generateCardImages.called
+	with zipfile.ZipFile(bookFile) as rebuiltBook:
+		assert dict((name, rebuiltBook.read(name)) for name in rebuiltBook.namelist() if name.startswith('EPUB/images/')) == previousImages
+
+def test_shouldStoreIdenticalCardImagesOnceInEpub():
+	imagesFolder = tempfile.mkdtemp()
+	Image.new('RGB', (30, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	cards = [ generateTestCard(cardName, 'http://www.bungie.net/images/cardSet01_High.jpg', dimensions_tuple).replace(cardIntro = 'intro', cardDescription = 'description')
+				for cardName, dimensions_tuple in [('card1', (0, 0, 10, 10)), ('card2', (0, 0, 10, 10)), ('card3', (20, 0, 10, 10))] ]
+	book = epub.EpubBook()
+
+	with mock.patch('grimoireebook.generateCardImagesFromImageSheet', side_effect=grimoireebook.generateCardImagesFromImageSheet) as mock_generateCardImagesFromImageSheet:
+		cardImages = grimoireebook.generateGrimoireCardImages(generateTestDefinition([cards]), imagesFolder)
+	with mock.patch('grimoireebook.createGrimoireCardPage', side_effect=grimoireebook.createGrimoireCardPage) as mock_createGrimoireCardPage:
+		grimoireebook.addThemeSetsToEbook(book, generateTestDefinition([cards]), cardImages)
+
+	assert len(mock_generateCardImagesFromImageSheet.call_args[0][1]) == 2
+	assert len(set(cardImage.fileName for cardImage in cardImages.values())) == 1
+	assert len(list(book.get_items_of_type(ebooklib.ITEM_IMAGE))) == 1
+	assert len(set(id(pageCall[0][1]) for pageCall in mock_createGrimoireCardPage.call_args_list)) == 1
+
+@pytest.mark.parametrize('streamBook', [False, True])
+def test_shouldBuildSameGrimoireEpubWhenOverlappingStages(streamBook):
+	workFolder = tempfile.mkdtemp()
+	imagesFolder = os.path.join(workFolder, 'images')
+	os.makedirs(imagesFolder)
+	cards = []
+	for sheetIndex in range(3):
+		Image.new('RGB', (20, 10), (80 * sheetIndex, 0, 0)).save(os.path.join(imagesFolder, 'cardSet0%d_High.jpg' % sheetIndex))
+		cards.append(generateTestCard('card%d' % sheetIndex, 'http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex, (0, 0, 10, 10)).replace(cardIntro = 'intro', cardDescription = 'description'))
+	grimoireDefinition = generateTestDefinition([cards[:2], cards[2:]])
+
+	bookEntries = {}
+	for overlapStages in (False, True):
+		bookFile = os.path.join(workFolder, 'overlap%s.epub' % overlapStages)
+		with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder), mock.patch('grimoireebook.DEFAULT_BOOK_FILE', bookFile), \
+				mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', os.path.join(workFolder, 'buildState%s.json' % overlapStages)), \
+				mock.patch('grimoireebook.dowloadGrimoireImages', return_value = {}), \
+				mock.patch('grimoireebook.tryDownloadGrimoireSheet', side_effect = lambda session, imageURL, imagesFolder, manifestEntry, revalidate: (imageURL, { 'checksum' : None }, None)):
+			grimoireebook.createGrimoireEpub(grimoireDefinition, epub.EpubBook(), useCropCache = False, incremental = False, streamBook = streamBook, overlapStages = overlapStages)
+
+		with zipfile.ZipFile(bookFile) as writtenBook:
+			bookEntries[overlapStages] = dict((entryName, writtenBook.read(entryName)) for entryName in writtenBook.namelist() if entryName.startswith('EPUB/images/') or entryName.endswith('card0.xhtml'))
+
+	assert bookEntries[True] == bookEntries[False]
+	assert len(bookEntries[True]) == 4
+
+@mock.patch('grimoireebook.saveSheetManifest')
+@mock.patch('grimoireebook.tryDownloadGrimoireSheet')
+def test_shouldReportFailedSheetsOnceOverlappedPipelineFinishes(mock_tryDownloadGrimoireSheet, mock_saveSheetManifest):
+	imagesFolder = tempfile.mkdtemp()
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	goodCard = generateTestCard('good', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10))
+	failedCard = generateTestCard('failed', 'http://www.bungie.net/images/cardSet02_High.jpg', (0, 0, 10, 10))
+	mock_tryDownloadGrimoireSheet.side_effect = lambda session, imageURL, imagesFolder, manifestEntry, revalidate: (imageURL, { 'checksum' : None }, None) if imageURL.endswith('cardSet01_High.jpg') else (imageURL, None, IOError('connection reset'))
+
+	cardPipeline = grimoireebook.GrimoireCardPipeline(generateTestDefinition([[ failedCard, goodCard ]]), imagesFolder, downloadPoolSize = 2)
+	cardPipeline.start()
+
+	with pytest.raises(DestinyContentAPIClientError):
+		cardPipeline.cardImages.get(failedCard.hash)
+	assert Image.open(io.BytesIO(cardPipeline.cardImages.get(goodCard.hash).content)).size == (10, 10)
+	with pytest.raises(DestinyContentAPIClientError) as expectedException:
+		cardPipeline.join()
+	assert str(expectedException.value) == DestinyContentAPIClientError.SHEET_DOWNLOAD_FAILED_ERROR_MSG % (1, 'http://www.bungie.net/images/cardSet02_High.jpg')
+	assert mock_saveSheetManifest.call_args[0][1].keys() == ['http://www.bungie.net/images/cardSet01_High.jpg']
+
+def test_shouldReleaseItemContentOnceStreamedIntoEpub():
+	bookFile = os.path.join(tempfile.mkdtemp(), 'destinyGrimoire.epub')
+	bookWriter = grimoireebook.StreamingEpubWriter(bookFile, epub.EpubBook())
+	bookWriter.open()
+	imageItem = grimoireebook.createCardImageItem('card_img', grimoireebook.CardImage(fileName='card_img.jpg', content='DummyPictureData'))
+
+	bookWriter.add_item(imageItem)
+	bookWriter.add_item(grimoireebook.createCardImageItem('card_img', grimoireebook.CardImage(fileName='card_img.jpg', content=None)))
+
+	assert imageItem.content is None
+	assert len(bookWriter.book.items) == 1
+	bookWriter.abort()
+	assert not os.path.exists(bookFile + '.part')
 
 @mock.patch('ebooklib.epub.write_epub')
 @mock.patch('ebooklib.epub.EpubBook')
 @mock.patch('grimoireebook.addThemeSetsToEbook')
+@mock.patch('grimoireebook.generateGrimoireCardImages')
 @mock.patch('grimoireebook.dowloadGrimoireImages')
-def test_shouldCreateGrimoireEpub(mock_dowloadGrimoireImages, mock_addThemeSetsToEbook, mock_ebook, mock_epubWrite):
+@mock.patch('grimoireebook.loadBuildState')
+@mock.patch('grimoireebook.loadReusableCardImages')
+@mock.patch('grimoireebook.createGrimoireBuildState')
+@mock.patch('grimoireebook.saveBuildState')
+def test_shouldCreateGrimoireEpub(mock_saveBuildState, mock_createGrimoireBuildState, mock_loadReusableCardImages, mock_loadBuildState, mock_dowloadGrimoireImages, mock_generateGrimoireCardImages, mock_addThemeSetsToEbook, mock_ebook, mock_epubWrite):
 	grimoireDefinition = {}
 	mock_addThemeSetsToEbook.return_value = ()
 
@@ -1467,12 +2055,18 @@ def test_shouldCreateGrimoireEpub(mock_dowloadGrimoireImages, mock_addThemeSetsT
 		mock_ebook.add_author.assert_called_with('Bungie')
 		mock_ebook.set_cover.assert_called_with('cover.jpg', "dummyCoverImageData")
 
-		mock_dowloadGrimoireImages.assert_called_once_with(grimoireDefinition)
-		mock_addThemeSetsToEbook.assert_called_once_with(mock_ebook, grimoireDefinition)
+		mock_dowloadGrimoireImages.assert_called_once_with(grimoireDefinition, grimoireebook.DEFAULT_DOWNLOAD_POOL_SIZE, True, False)
+		mock_loadBuildState.assert_called_once_with(grimoireebook.DEFAULT_BUILD_STATE_FILE)
+		mock_loadReusableCardImages.assert_called_once_with(grimoireDefinition, mock_loadBuildState.return_value, grimoireebook.DEFAULT_BOOK_FILE, mock_dowloadGrimoireImages.return_value, grimoireebook.DEFAULT_ENCODE_PROFILE)
+		mock_generateGrimoireCardImages.assert_called_once_with(grimoireDefinition, grimoireebook.DEFAULT_IMAGE_FOLDER, grimoireebook.DEFAULT_CROP_CACHE_FOLDER, grimoireebook.DEFAULT_CROP_POOL_SIZE, mock_dowloadGrimoireImages.return_value, mock_loadReusableCardImages.return_value, grimoireebook.DEFAULT_ENCODE_PROFILE)
+		mock_addThemeSetsToEbook.assert_called_once_with(mock_ebook, grimoireDefinition, mock_generateGrimoireCardImages.return_value, mock.ANY, 'en')
+		assert mock_addThemeSetsToEbook.call_args[0][3].style == BookStyleItemMatcher()
 
 		mock_ebook.add_item.assert_has_calls([call(BookStyleItemMatcher()), call(ItemTypeMatcher(epub.EpubNcx)), call(ItemTypeMatcher(epub.EpubNav))], any_order=True)
 
 		mock_epubWrite.assert_called_once_with(grimoireebook.DEFAULT_BOOK_FILE, mock_ebook)
+		mock_createGrimoireBuildState.assert_called_once_with(grimoireDefinition, mock_dowloadGrimoireImages.return_value, mock_generateGrimoireCardImages.return_value, grimoireebook.DEFAULT_ENCODE_PROFILE)
+		mock_saveBuildState.assert_called_once_with(grimoireebook.DEFAULT_BUILD_STATE_FILE, mock_createGrimoireBuildState.return_value)
 
 		mock_ebook.toc == mock_addThemeSetsToEbook.return_value
 
@@ -1488,4 +2082,344 @@ class ItemTypeMatcher:
 		return type(arg) is self.expectedType
 
 	def __repr__(self):
-		return 'Item Type Matcher for %s' % self.expectedType
\ No newline at end of file
+		return 'Item Type Matcher for %s' % self.expectedType
+
+def test_shouldBuildOneEpubPerThemeVolumeInParallelWithIndex():
+	workFolder = tempfile.mkdtemp()
+	imagesFolder = os.path.join(workFolder, 'images')
+	os.makedirs(imagesFolder)
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	firstCard = generateTestCard('first', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10))
+	secondCard = generateTestCard('second', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 10))
+
+	with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder), mock.patch('grimoireebook.DEFAULT_BOOK_FILE', os.path.join(workFolder, 'destinyGrimoire.epub')), \
+			mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', os.path.join(workFolder, 'buildState.json')), \
+			mock.patch('grimoireebook.dowloadGrimoireImages', return_value = {}) as mock_dowloadGrimoireImages:
+		volumes = grimoireebook.createGrimoireVolumes(generateTestDefinition([[ firstCard ]], [[ secondCard ]]), 1, 2, True, useCropCache = False)
+
+	assert mock_dowloadGrimoireImages.call_count == 1
+	assert [ os.path.basename(volume.bookFile) for volume in volumes ] == [ 'destinyGrimoire.volume01.epub', 'destinyGrimoire.volume02.epub' ]
+	assert [ volume.title for volume in volumes ] == [ 'Destiny Grimoire 1: theme_0', 'Destiny Grimoire 2: theme_1' ]
+	for volume, cardData in zip(volumes, (firstCard, secondCard)):
+		with zipfile.ZipFile(volume.bookFile) as volumeBook:
+			assert [ entryName for entryName in volumeBook.namelist() if entryName.endswith('.xhtml') and entryName not in ('EPUB/nav.xhtml', 'EPUB/cover.xhtml') ] == [ 'EPUB/%s.xhtml' % grimoireebook.getGrimoireCardFileName(cardData) ]
+		assert os.path.exists(volume.buildStateFile)
+
+	with zipfile.ZipFile(os.path.join(workFolder, 'destinyGrimoire.index.epub')) as indexBook:
+		indexContent = indexBook.read('EPUB/volumes.xhtml')
+	assert 'href="destinyGrimoire.volume01.epub"' in indexContent
+	assert 'href="destinyGrimoire.volume02.epub"' in indexContent
+
+def test_shouldBuildOneEpubPerLocaleCroppingSharedCardImagesOnce():
+	workFolder = tempfile.mkdtemp()
+	imagesFolder = os.path.join(workFolder, 'images')
+	os.makedirs(imagesFolder)
+	Image.new('RGB', (20, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	definitionsByLocale = collections.OrderedDict((locale, generateTestDefinition([[ generateTestCard('%s_%d' % (locale, cardIndex), 'http://www.bungie.net/images/cardSet01_High.jpg', (10 * cardIndex, 0, 10, 10)) for cardIndex in range(2) ]]))
+												for locale in ('en', 'de'))
+
+	with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder), mock.patch('grimoireebook.DEFAULT_CROP_CACHE_FOLDER', os.path.join(workFolder, 'crops')), \
+			mock.patch('grimoireebook.DEFAULT_BOOK_FILE', os.path.join(workFolder, 'destinyGrimoire.epub')), \
+			mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', os.path.join(workFolder, 'buildState.json')), \
+			mock.patch('grimoireebook.dowloadGrimoireImages', return_value = {}) as mock_dowloadGrimoireImages, \
+			mock.patch('grimoireebook.generateCardImagesFromImageSheet', wraps = grimoireebook.generateCardImagesFromImageSheet) as mock_generateCardImagesFromImageSheet:
+		grimoireebook.createGrimoireEditions(definitionsByLocale, volumePoolSize = 1)
+
+	assert mock_dowloadGrimoireImages.call_count == 1
+	assert mock_generateCardImagesFromImageSheet.call_count == 1
+	for locale in definitionsByLocale:
+		with zipfile.ZipFile(os.path.join(workFolder, 'destinyGrimoire.%s.epub' % locale)) as localeBook:
+			assert '<dc:language>%s</dc:language>' % locale in localeBook.read('EPUB/content.opf')
+
+def test_shouldParseAndBuildLocaleEditionWithAccentedNames():
+	workFolder = tempfile.mkdtemp()
+	imagesFolder = os.path.join(workFolder, 'images')
+	os.makedirs(imagesFolder)
+	Image.new('RGB', (10, 10), (255, 0, 0)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : u'Histoire', 'pageCollection' : [ { 'pageName' : u'Pr\u00e9sentation', 'cardCollection' : [
+						{ 'cardName' : u'Fant\u00f4me', 'cardIntro' : u'\u00c9veill\u00e9', 'highResolution' : { 'image' : { 'sheetPath' : 'images/cardSet01_High.jpg', 'rect' : { 'x' : 0, 'y' : 0, 'width' : 10, 'height' : 10 } } } } ] } ] } ] } }
+
+	grimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromJson(grimoireJson)
+	assert grimoireebook.getDestinyGrimoireDefinitionFromStream(iter([json.dumps(grimoireJson)])) == grimoireDefinition
+	cardData = grimoireDefinition.themes[0].pages[0].cards[0]
+	assert cardData.hash == hashlib.sha1(u'Histoire.Pr\u00e9sentation.Fant\u00f4me'.encode('utf8')).hexdigest()
+	assert grimoireebook.getDestinyGrimoireDefinitionFromJson({ 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme', 'pageCollection' : [ { 'pageName' : 'page', 'cardCollection' : [
+						dict(grimoireJson['Response']['themeCollection'][0]['pageCollection'][0]['cardCollection'][0], cardName = 'card') ] } ] } ] } }).themes[0].pages[0].cards[0].hash == hashlib.sha1('theme.page.card').hexdigest()
+
+	with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder), mock.patch('grimoireebook.DEFAULT_CROP_CACHE_FOLDER', os.path.join(workFolder, 'crops')), \
+			mock.patch('grimoireebook.DEFAULT_BOOK_FILE', os.path.join(workFolder, 'destinyGrimoire.epub')), \
+			mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', os.path.join(workFolder, 'buildState.json')), \
+			mock.patch('grimoireebook.dowloadGrimoireImages', return_value = {}):
+		grimoireebook.createGrimoireEditions({ 'fr' : grimoireDefinition }, volumePoolSize = 1)
+
+	with zipfile.ZipFile(os.path.join(workFolder, 'destinyGrimoire.fr.epub')) as localeBook:
+		cardPage = localeBook.read('EPUB/%s.xhtml' % grimoireebook.getGrimoireCardFileName(cardData)).decode('utf8')
+	assert u'Fant\u00f4me' in cardPage and u'\u00c9veill\u00e9' in cardPage
+	assert 'lang="fr"' in cardPage and 'lang="en"' not in cardPage
+
+@httpretty.activate
+def test_shouldBuildIdenticalEpubsOfflineFromExportedSnapshot():
+	workFolder = tempfile.mkdtemp()
+	sheetData = io.BytesIO()
+	sheetImage = Image.new('RGB', (20, 10), (255, 0, 0))
+	sheetImage.paste((0, 0, 255), (10, 0, 20, 10))
+	sheetImage.save(sheetData, 'JPEG')
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme', 'pageCollection' : [ { 'pageName' : 'page', 'cardCollection' : [
+						{ 'cardName' : cardName, 'highResolution' : { 'image' : { 'sheetPath' : 'images/cardSet01_High.jpg', 'rect' : { 'x' : x, 'y' : 0, 'width' : 10, 'height' : 10 } } } }
+						for cardName, x in (('first', 0), ('second', 10)) ] } ] } ] } }
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/', body=json.dumps(grimoireJson), content_type='application/json', status=200)
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', body=sheetData.getvalue(), status=200)
+	snapshotFile = os.path.join(workFolder, 'grimoire.snapshot')
+	os.makedirs(os.path.join(workFolder, 'images'))
+	grimoireebook.saveSheetManifest(os.path.join(workFolder, 'images'), { 'http://www.bungie.net/images/unusedSheet.jpg' : { 'checksum' : 'unused', 'size' : 6, 'mtime' : 0 } })
+
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', os.path.join(workFolder, 'cache')), mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', os.path.join(workFolder, 'images')):
+		grimoireebook.generateGrimoireEbook(__testApiKey__, exportSnapshotFile = snapshotFile)
+
+	bookFiles = [ os.path.join(workFolder, 'offline%d.epub' % buildIndex) for buildIndex in range(2) ]
+	for bookFile in bookFiles:
+		with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', os.path.join(workFolder, 'emptyImages')), mock.patch('grimoireebook.DEFAULT_BOOK_FILE', bookFile), \
+				mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', bookFile + '.state'), \
+				mock.patch('grimoireebook.createBungieSession', side_effect = AssertionError('network used')):
+			grimoireebook.generateGrimoireEbook(snapshotFile = snapshotFile, useCropCache = False)
+
+	snapshot = grimoireebook.GrimoireSnapshot(snapshotFile)
+	assert snapshot.getSheetManifest() == { 'http://www.bungie.net/images/cardSet01_High.jpg' : { 'checksum' : hashlib.sha1(sheetData.getvalue()).hexdigest(), 'size' : len(sheetData.getvalue()) } }
+	assert snapshot.getSheetSource('http://www.bungie.net/images/cardSet01_High.jpg').read() == sheetData.getvalue()
+	assert snapshot.getSheetSource('http://www.bungie.net/images/cardSet01_High.jpg').fileName == 'sheets/www.bungie.net/images/cardSet01_High.jpg'
+	assert open(bookFiles[0], 'rb').read() == open(bookFiles[1], 'rb').read()
+	with zipfile.ZipFile(bookFiles[0]) as offlineBook:
+		assert set(entry.date_time for entry in offlineBook.infolist()) == set([ time.gmtime(snapshot.created - snapshot.created % 2)[:6] ])
+		assert time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(snapshot.created)) in offlineBook.read('EPUB/content.opf')
+		assert len([ entryName for entryName in offlineBook.namelist() if entryName.startswith('EPUB/images/') ]) == 2
+
+@httpretty.activate
+def test_shouldBuildEveryLocaleOfSnapshotWhenNoneIsGiven():
+	workFolder = tempfile.mkdtemp()
+	sheetData = io.BytesIO()
+	Image.new('RGB', (10, 10), (255, 0, 0)).save(sheetData, 'JPEG')
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme', 'pageCollection' : [ { 'pageName' : 'page', 'cardCollection' : [
+						{ 'cardName' : 'card', 'highResolution' : { 'image' : { 'sheetPath' : 'images/cardSet01_High.jpg', 'rect' : { 'x' : 0, 'y' : 0, 'width' : 10, 'height' : 10 } } } } ] } ] } ] } }
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/', body=json.dumps(grimoireJson), content_type='application/json', status=200)
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', body=sheetData.getvalue(), status=200)
+	snapshotFile = os.path.join(workFolder, 'grimoire.snapshot')
+	bookFile = os.path.join(workFolder, 'offline.epub')
+
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', os.path.join(workFolder, 'cache')), mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', os.path.join(workFolder, 'images')):
+		grimoireebook.generateGrimoireEbook(__testApiKey__, locales = ['en', 'fr'], exportSnapshotFile = snapshotFile)
+	with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', os.path.join(workFolder, 'emptyImages')), mock.patch('grimoireebook.DEFAULT_BOOK_FILE', bookFile), \
+			mock.patch('grimoireebook.DEFAULT_BUILD_STATE_FILE', bookFile + '.state'), \
+			mock.patch('grimoireebook.createBungieSession', side_effect = AssertionError('network used')):
+		grimoireebook.generateGrimoireEbook(snapshotFile = snapshotFile, useCropCache = False, volumePoolSize = 1)
+		with pytest.raises(DestinyContentAPIClientError) as expectedException:
+			grimoireebook.generateGrimoireEbook(snapshotFile = snapshotFile, locales = ['de'], useCropCache = False, volumePoolSize = 1)
+
+	assert grimoireebook.GrimoireSnapshot(snapshotFile).getLocales() == ['en', 'fr']
+	assert os.path.exists(os.path.join(workFolder, 'offline.en.epub')) and os.path.exists(os.path.join(workFolder, 'offline.fr.epub'))
+	assert not os.path.exists(bookFile)
+	assert 'no definition for locale de, it holds en, fr' in str(expectedException.value)
+
+def test_shouldCutSameCardImagesFromMemoryMappedSheetPack():
+	imagesFolder = tempfile.mkdtemp()
+	sheetManifest = {}
+	cards = []
+	for sheetIndex in range(2):
+		sheetPath = os.path.join(imagesFolder, 'cardSet0%d_High.jpg' % sheetIndex)
+		Image.new('RGB', (20, 10), (100 * sheetIndex, 50, 0)).save(sheetPath)
+		sheetManifest['http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex] = { 'checksum' : grimoireebook.getFileChecksum(sheetPath) }
+		cards.append(generateTestCard('card%d' % sheetIndex, 'http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex, (0, 0, 10, 10)))
+	grimoireDefinition = generateTestDefinition([ cards ])
+
+	sheetStore = grimoireebook.packGrimoireSheets(imagesFolder, sheetManifest)
+	with mock.patch('grimoireebook.Image.open', side_effect = Image.open) as mock_imageOpen:
+		packedImages = grimoireebook.generateGrimoireCardImages(grimoireDefinition, sheetStore, sheetManifest = sheetManifest)
+
+	assert sheetStore.getSheetSource('http://www.bungie.net/images/cardSet01_High.jpg').read() == open(os.path.join(imagesFolder, 'cardSet01_High.jpg'), 'rb').read()
+	assert not any(isinstance(openCall[0][0], basestring) for openCall in mock_imageOpen.call_args_list)
+	assert packedImages == grimoireebook.generateGrimoireCardImages(grimoireDefinition, imagesFolder, sheetManifest = sheetManifest)
+
+	with mock.patch('grimoireebook.shutil.copyfileobj') as mock_copyfileobj:
+		grimoireebook.packGrimoireSheets(imagesFolder, sheetManifest)
+	mock_copyfileobj.assert_not_called()
+
+	Image.new('RGB', (20, 10), (0, 0, 255)).save(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	sheetManifest['http://www.bungie.net/images/cardSet01_High.jpg']['checksum'] = grimoireebook.getFileChecksum(os.path.join(imagesFolder, 'cardSet01_High.jpg'))
+	repackedStore = grimoireebook.packGrimoireSheets(imagesFolder, sheetManifest)
+	assert repackedStore.getSheetSource('http://www.bungie.net/images/cardSet01_High.jpg').read() == open(os.path.join(imagesFolder, 'cardSet01_High.jpg'), 'rb').read()
+
+@httpretty.activate
+def test_shouldDownloadSheetsStraightIntoSheetPackAndUnpackThemForLooseBuilds():
+	imagesFolder = tempfile.mkdtemp()
+	packFile = os.path.join(imagesFolder, grimoireebook.SHEET_PACK_FILE_NAME)
+	with open(os.path.join(imagesFolder, 'cardSet00_High.jpg'), 'wb') as sheetFile:
+		sheetFile.write('looseSheetData')
+	grimoireebook.saveSheetManifest(imagesFolder, { 'http://www.bungie.net/images/cardSet00_High.jpg' : { 'etag' : '"looseVersion"', 'lastModified' : None, 'size' : 14, 'mtime' : 0, 'checksum' : hashlib.sha1('looseSheetData').hexdigest() } })
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet00_High.jpg', body='', status=304)
+	httpretty.register_uri(httpretty.GET, 'http://www.bungie.net/images/cardSet01_High.jpg', responses=[ httpretty.Response(body='firstSheetData', status=200, etag='"firstVersion"'),
+																										httpretty.Response(body='updatedSheetData', status=200, etag='"updatedVersion"') ])
+	grimoireDefinition = generateTestDefinition([[ generateTestCard('card%d' % sheetIndex, 'http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex, (0, 0, 10, 10)) for sheetIndex in range(2) ]])
+
+	with mock.patch('grimoireebook.DEFAULT_IMAGE_FOLDER', imagesFolder):
+		sheetManifest = grimoireebook.dowloadGrimoireImages(grimoireDefinition, 1, True, True)
+		sheetStore = grimoireebook.PackedSheetStore(packFile)
+		assert sheetStore.getSheetSource('http://www.bungie.net/images/cardSet00_High.jpg').read() == 'looseSheetData'
+		assert sheetStore.getSheetSource('http://www.bungie.net/images/cardSet01_High.jpg').read() == 'firstSheetData'
+		assert sheetManifest['http://www.bungie.net/images/cardSet01_High.jpg']['checksum'] == hashlib.sha1('firstSheetData').hexdigest()
+		assert sorted(os.listdir(imagesFolder)) == [ 'cardSet00_High.jpg', grimoireebook.SHEET_MANIFEST_FILE_NAME, grimoireebook.SHEET_PACK_FILE_NAME ]
+
+		os.remove(os.path.join(imagesFolder, 'cardSet00_High.jpg'))
+		packedData = open(packFile, 'rb').read()
+		requestCount = len(httpretty.latest_requests())
+		with mock.patch('grimoireebook.getValidSheetManifestEntry') as mock_getValidSheetManifestEntry:
+			assert grimoireebook.dowloadGrimoireImages(grimoireDefinition, 1, False, True) == sheetManifest
+		mock_getValidSheetManifestEntry.assert_not_called()
+		assert len(httpretty.latest_requests()) == requestCount
+		assert open(packFile, 'rb').read() == packedData
+
+		sheetManifest = grimoireebook.dowloadGrimoireImages(grimoireDefinition, 1, True, True)
+		sheetStore = grimoireebook.PackedSheetStore(packFile)
+		assert sheetStore.getSheetSource('http://www.bungie.net/images/cardSet00_High.jpg').read() == 'looseSheetData'
+		assert sheetStore.getSheetSource('http://www.bungie.net/images/cardSet01_High.jpg').read() == 'updatedSheetData'
+		assert all(manifestEntry['packed'] for manifestEntry in sheetManifest.values())
+
+		grimoireebook.saveSheetManifest(imagesFolder, dict(sheetManifest, **{ 'http://www.bungie.net/images/unusedSheet.jpg' : { 'checksum' : 'unused', 'size' : 6, 'packed' : True } }))
+		requestCount = len(httpretty.latest_requests())
+		sheetManifest = grimoireebook.dowloadGrimoireImages(grimoireDefinition, 1, False)
+		assert len(httpretty.latest_requests()) == requestCount
+		assert sorted(sheetManifest) == [ 'http://www.bungie.net/images/cardSet00_High.jpg', 'http://www.bungie.net/images/cardSet01_High.jpg' ]
+		assert grimoireebook.loadSheetManifest(imagesFolder) == sheetManifest
+		assert not any(manifestEntry.get('packed') for manifestEntry in sheetManifest.values())
+		assert open(os.path.join(imagesFolder, 'cardSet00_High.jpg'), 'rb').read() == 'looseSheetData'
+		assert open(os.path.join(imagesFolder, 'cardSet01_High.jpg'), 'rb').read() == 'updatedSheetData'
+
+	for sheetIndex in range(2):
+		os.remove(os.path.join(imagesFolder, 'cardSet0%d_High.jpg' % sheetIndex))
+	with open(os.path.join(imagesFolder, 'cardSet02_High.jpg'), 'wb') as sheetFile:
+		sheetFile.write('thirdSheetData')
+	sheetManifest['http://www.bungie.net/images/cardSet02_High.jpg'] = { 'checksum' : hashlib.sha1('thirdSheetData').hexdigest() }
+	sheetStore = grimoireebook.packGrimoireSheets(imagesFolder, sheetManifest)
+	assert [ sheetStore.getSheetSource('http://www.bungie.net/images/cardSet0%d_High.jpg' % sheetIndex).read() for sheetIndex in range(3) ] == [ 'looseSheetData', 'updatedSheetData', 'thirdSheetData' ]
+	grimoireebook.releaseMappedStoreFile(packFile)
+
+def test_shouldStoreAndQueryGrimoireDefinitionInCatalog():
+	grimoireDefinition = generateTestDefinition([[ generateTestCard('first', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10)).replace(cardIntro = u'intro', cardDescription = u'description'),
+													generateTestCard('second', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 10)) ], []],
+												[[ generateTestCard('third', 'http://www.bungie.net/images/cardSet02_High.jpg', (0, 10, 5, 5)) ]], [])
+	catalog = grimoireebook.GrimoireCatalog(os.path.join(tempfile.mkdtemp(), 'cache', 'catalog.sqlite'))
+	try:
+		assert catalog.load() is None
+		catalog.save(grimoireDefinition, version = { 'etag' : '"grimoireVersion1"' })
+		catalog.save(generateTestDefinition([[ generateTestCard('dritte', 'http://www.bungie.net/images/cardSet02_High.jpg', (0, 10, 5, 5)) ]]), 'de')
+
+		assert catalog.load() == grimoireDefinition
+		assert catalog.getVersion() == { 'etag' : '"grimoireVersion1"' }
+		assert catalog.findCards(hash = hashlib.sha1('third').hexdigest()) == [ grimoireebook.CatalogEntry(None, 'theme_1', 'page_0', grimoireDefinition.themes[1].pages[0].cards[0]) ]
+		assert [ (entry.locale, entry.card.cardName) for entry in catalog.findCards(themeName = 'theme_0', pageName = 'page_0') ] == [ (None, 'first'), (None, 'second'), ('de', 'dritte') ]
+		assert [ (entry.locale, entry.card.cardName) for entry in catalog.findCards(themeName = 'theme_0', locale = 'de') ] == [ ('de', 'dritte') ]
+	finally:
+		catalog.close()
+
+@httpretty.activate
+def test_shouldLoadUnchangedGrimoireFromCatalogWithoutParsingIt():
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme', 'pageCollection' : [ { 'pageName' : 'page', 'cardCollection' : [
+						{ 'cardName' : 'card', 'cardIntro' : 'intro', 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 1, 'y' : 2, 'width' : 3, 'height' : 4 } } } } ] } ] } ] } }
+	httpretty.register_uri(httpretty.GET,
+					'http://www.bungie.net/Platform/Destiny/Vanguard/Grimoire/Definition/',
+					responses=[
+						httpretty.Response(body=json.dumps(grimoireJson), content_type='application/json', status=200, etag='"grimoireVersion1"'),
+						httpretty.Response(body='', status=304)
+					])
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', tempfile.mkdtemp()):
+		parsedGrimoire = grimoireebook.loadDestinyGrimoireDefinition(__testApiKey__, useCatalog = True)
+		with mock.patch('grimoireebook.getDestinyGrimoireDefinitionFromStream') as mock_getDestinyGrimoireDefinitionFromStream:
+			catalogedGrimoire = grimoireebook.loadDestinyGrimoireDefinition(__testApiKey__, useCatalog = True)
+
+	mock_getDestinyGrimoireDefinitionFromStream.assert_not_called()
+	assert httpretty.last_request().headers['If-None-Match'] == '"grimoireVersion1"'
+	assert catalogedGrimoire == parsedGrimoire == grimoireebook.getDestinyGrimoireDefinitionFromJson(grimoireJson)
+
+def test_shouldSearchCardLoreThroughIndexBuiltWhileParsing():
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : u'Guardians', 'pageCollection' : [ { 'pageName' : u'Classes', 'cardCollection' : [
+						{ 'cardName' : u'Titan', 'cardIntro' : u'Walls of the <b>Last City</b>', 'cardDescription' : u'The Titan&rsquo;s fist', 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 0, 'y' : 0, 'width' : 1, 'height' : 1 } } } },
+						{ 'cardName' : u'Warlock', 'cardIntro' : u'Scholars of the Traveler', 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 1, 'y' : 0, 'width' : 1, 'height' : 1 } } } } ] } ] },
+					{ 'themeName' : u'Allies', 'pageCollection' : [ { 'pageName' : u'City', 'cardCollection' : [
+						{ 'cardName' : u'Ikora Rey', 'cardDescription' : u'Warlock Vanguard, trusted by the Traveler\u2019s Sp\u00e9aker', 'highResolution' : { 'image' : { 'sheetPath' : 'images/set.jpg', 'rect' : { 'x' : 2, 'y' : 0, 'width' : 1, 'height' : 1 } } } } ] } ] } ] } }
+	searchIndex = grimoireebook.GrimoireSearchIndex()
+
+	grimoireDefinition = grimoireebook.getDestinyGrimoireDefinitionFromStream(iter([json.dumps(grimoireJson)]), searchIndex)
+	titan, warlock = grimoireDefinition.themes[0].pages[0].cards
+	ikora = grimoireDefinition.themes[1].pages[0].cards[0]
+	with mock.patch('grimoireebook.DEFAULT_CACHE_FOLDER', tempfile.mkdtemp()):
+		searchIndex.save(grimoireebook.getSearchIndexFile('fr'))
+		storedIndex = grimoireebook.StoredSearchIndex(grimoireebook.getSearchIndexFile('fr'))
+		assert grimoireebook.searchGrimoireLore('CITY', 'fr') == [ grimoireebook.SearchHit(titan.hash, u'Guardians', u'Classes', u'Titan') ]
+		with pytest.raises(grimoireebook.DestinyContentAPIClientError):
+			grimoireebook.searchGrimoireLore('city')
+
+	for index in (searchIndex, storedIndex, grimoireebook.indexGrimoireDefinition(grimoireDefinition)):
+		assert [ hit.hash for hit in index.search('traveler') ] == [ warlock.hash, ikora.hash ]
+		assert [ hit.hash for hit in index.search('warlock traveler vanguard') ] == [ ikora.hash ]
+		assert [ hit.hash for hit in index.search(u'sp\u00e9aker') ] == [ ikora.hash ]
+		assert [ hit.hash for hit in index.search('tit* fist') ] == [ titan.hash ]
+		assert [ hit.cardName for hit in index.search('b rsquo') ] == []
+		assert index.search('walls nowhere') == []
+	assert storedIndex.cards == searchIndex.cards
+
+def test_shouldAddKeywordIndexSectionLinkingDistinctiveTermsToCardPages():
+	cards = [ generateTestCard('first', 'http://www.bungie.net/images/cardSet01_High.jpg', (0, 0, 10, 10)).replace(cardIntro = u'Ghost awakens', cardDescription = u'the 4242 Traveler'),
+				generateTestCard('second', 'http://www.bungie.net/images/cardSet01_High.jpg', (10, 0, 10, 10)).replace(cardIntro = u'the <i>Traveler</i>') ]
+	book = epub.EpubBook()
+
+	with mock.patch('grimoireebook.KEYWORD_INDEX_MAX_CARDS', 1):
+		keywordToc = grimoireebook.addKeywordIndexToEbook(book, generateTestDefinition([cards]), language = 'fr')
+
+	keywordPages = keywordToc[0][1]
+	assert keywordToc[0][0].title == 'Keyword index'
+	assert [ keywordPage.title for keywordPage in keywordPages ] == [ u'Keywords: A', u'Keywords: F', u'Keywords: G', u'Keywords: S' ]
+	assert book.spine == list(keywordPages)
+	assert all(keywordPage.lang == 'fr' for keywordPage in keywordPages)
+	assert keywordPages[2].content == u'<h2>G</h2><p><b>ghost</b>: <a href="%s-first.xhtml">first</a></p>' % cards[0].hash
+	assert 'traveler' not in u''.join(keywordPage.content for keywordPage in keywordPages)
+	assert grimoireebook.addKeywordIndexToEbook(epub.EpubBook(), generateTestDefinition([])) == ()
+
+def test_shouldLoadHeavyDependenciesOnlyWhenFirstUsed():
+	lazyImportCheck = '''
+import sys, grimoireebook
+heavyModules = ('requests', 'PIL.Image', 'ebooklib.epub')
+grimoireebook.parseCommandLineArguments(['apiKey', '--catalog'])
+print(sorted(moduleName for moduleName in heavyModules if moduleName in sys.modules))
+grimoireebook.epub.EpubBook()
+print(sorted(moduleName for moduleName in heavyModules if moduleName in sys.modules))
+'''
+	output = subprocess.check_output([sys.executable, '-c', lazyImportCheck], cwd = os.path.dirname(os.path.abspath(grimoireebook.__file__)))
+
+	assert output.splitlines() == [ "[]", "['ebooklib.epub']" ]
+	assert grimoireebook.Image.open is Image.open
+	with mock.patch('grimoireebook.Image.open') as mock_imageOpen:
+		assert grimoireebook.Image.open is mock_imageOpen and Image.open is not mock_imageOpen
+	assert grimoireebook.Image.open is Image.open
+
+	lazyModule = grimoireebook.LazyModule('json')
+	with mock.patch('importlib.import_module', return_value = json) as mock_importModule:
+		assert lazyModule.dumps is json.dumps and lazyModule.loads is json.loads
+	mock_importModule.assert_called_once_with('json')
+
+def test_shouldIndexCardsBySheetWhileParsingAndServeDownloadsAndCropsFromIt():
+	grimoireJson = { 'Response' : { 'themeCollection' : [ { 'themeName' : 'theme', 'pageCollection' : [ { 'pageName' : 'page', 'cardCollection' : [
+						{ 'cardName' : 'first', 'highResolution' : { 'image' : { 'sheetPath' : 'images/small.jpg', 'rect' : { 'x' : 0, 'y' : 0, 'width' : 10, 'height' : 10 } } } },
+						{ 'cardName' : 'second', 'highResolution' : { 'image' : { 'sheetPath' : 'images/large.jpg', 'rect' : { 'x' : 0, 'y' : 0, 'width' : 10, 'height' : 10 } } } },
+						{ 'cardName' : 'third', 'highResolution' : { 'image' : { 'sheetPath' : 'images/small.jpg', 'rect' : { 'x' : 10, 'y' : 0, 'width' : 10, 'height' : 10 } } } },
+						{ 'cardName' : 'fourth', 'highResolution' : { 'image' : { 'sheetPath' : 'images/large.jpg', 'rect' : { 'x' : 90, 'y' : 90, 'width' : 10, 'height' : 10 } } } } ] } ] } ] } }
+
+	for grimoireDefinition in (grimoireebook.getDestinyGrimoireDefinitionFromJson(grimoireJson), grimoireebook.getDestinyGrimoireDefinitionFromStream(iter([json.dumps(grimoireJson)]))):
+		first, second, third, fourth = grimoireDefinition.themes[0].pages[0].cards
+		with mock.patch('grimoireebook.iterGrimoireCards', side_effect = AssertionError('definition walked again')):
+			assert grimoireebook.groupGrimoireCardsBySheet(grimoireDefinition) == collections.OrderedDict([ ('http://www.bungie.net/images/small.jpg', [ first, third ]),
+																											('http://www.bungie.net/images/large.jpg', [ second, fourth ]) ])
+			assert grimoireebook.getGrimoireSheetsBySize(grimoireDefinition) == [ 'http://www.bungie.net/images/large.jpg', 'http://www.bungie.net/images/small.jpg' ]
+			assert grimoireebook.mergeGrimoireDefinitions([ grimoireDefinition, grimoireDefinition ]).sheets['http://www.bungie.net/images/large.jpg'] == [ second, fourth, second, fourth ]
+
+		assert grimoireDefinition == grimoireebook.GrimoireDefinition(grimoireDefinition.themes)
+		assert grimoireDefinition.keys() == [ 'themes' ]
+		assert pickle.loads(pickle.dumps(grimoireDefinition)).sheets is None
+		assert grimoireebook.groupGrimoireCardsBySheet(grimoireebook.GrimoireDefinition(grimoireDefinition.themes)) == grimoireDefinition.sheets